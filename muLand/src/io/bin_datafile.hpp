@@ -0,0 +1,81 @@
+/*******************************************************************************
+ *            Micro Land (mu-land) - Land Use Model 
+ *                     Copyright 2016 by
+ *
+ *          Felipe Saavedra C. (fsaavedr@dcc.uchile.cl)
+ *
+ *
+ *  This file is part of Micro Land (mu-land)
+ *
+ *  Mu-Land is free software: you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation, either version 3 of the License, or
+ *  (at your option) any later version.
+ *
+ *  Mu-Land is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+ *
+ *  You should have received a copy of the GNU General Public License
+ *  along with Mu-Land.  If not, see <http://www.gnu.org/licenses/>.
+ *
+ ******************************************************************************/
+
+#pragma once
+
+#include <istream>
+#include <ostream>
+#include <cstring>
+#include <stdint.h>
+
+namespace muland
+{
+/// Binary datafile format helpers, independent of host byte order.
+/// A binary datafile holds the number of rows and columns as little-endian
+/// 64 bit unsigned integers, followed by rows of little-endian doubles.
+namespace bin
+{
+
+inline uint64_t
+ReadUInt64 ( std::istream& rStream )
+{
+    unsigned char bytes_[8] = {0};
+    rStream.read ( reinterpret_cast<char*> ( bytes_ ), 8 );
+    uint64_t value_ = 0;
+    for ( int k = 7; k >= 0; k-- )
+        value_ = ( value_ << 8 ) | bytes_[k];
+    return value_;
+}
+
+inline double
+ReadDouble ( std::istream& rStream )
+{
+    uint64_t bits_ = ReadUInt64 ( rStream );
+    double value_;
+    std::memcpy ( &value_, &bits_, sizeof ( value_ ) );
+    return value_;
+}
+
+inline void
+WriteUInt64 ( std::ostream& rStream, uint64_t value )
+{
+    char bytes_[8];
+    for ( int k = 0; k < 8; k++ )
+    {
+        bytes_[k] = static_cast<char> ( value & 0xff );
+        value >>= 8;
+    }
+    rStream.write ( bytes_, 8 );
+}
+
+inline void
+WriteDouble ( std::ostream& rStream, double value )
+{
+    uint64_t bits_;
+    std::memcpy ( &bits_, &value, sizeof ( bits_ ) );
+    WriteUInt64 ( rStream, bits_ );
+}
+
+} // end namespace bin
+} // end namespace muland
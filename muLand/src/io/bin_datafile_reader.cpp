@@ -0,0 +1,64 @@
+/*******************************************************************************
+ *            Micro Land (mu-land) - Land Use Model 
+ *                     Copyright 2016 by
+ *
+ *          Felipe Saavedra C. (fsaavedr@dcc.uchile.cl)
+ *
+ *
+ *  This file is part of Micro Land (mu-land)
+ *
+ *  Mu-Land is free software: you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation, either version 3 of the License, or
+ *  (at your option) any later version.
+ *
+ *  Mu-Land is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+ *
+ *  You should have received a copy of the GNU General Public License
+ *  along with Mu-Land.  If not, see <http://www.gnu.org/licenses/>.
+ *
+ ******************************************************************************/
+
+#include <fstream>
+#include <stdexcept>
+
+#include <io/bin_datafile.hpp>
+#include <io/bin_datafile_reader.hpp>
+#include <data/muland_data.hpp>
+
+using namespace muland;
+
+/********************************************************************/
+template <typename MATRIX_TYPE>
+int
+binDatafileReader::Parse
+(MATRIX_TYPE _destination )
+{
+    std::ifstream ifstream_( this->mp_datafile->getPath().c_str(), std::ios::binary );
+    if ( !ifstream_ )
+        throw std::runtime_error( "could not open " + this->mp_datafile->getPath() );
+
+    unsigned rows_ = bin::ReadUInt64( ifstream_ );
+    unsigned columns_ = bin::ReadUInt64( ifstream_ );
+    _destination->resize(rows_, columns_ +1); // +1 for index
+
+    for (unsigned i = 0; i < rows_; i++)
+    {
+        _destination->at_element(i, 0) = i;
+        for (unsigned j = 0; j < columns_; j++)
+            _destination->at_element(i, j+1) = bin::ReadDouble( ifstream_ );
+    }
+    if ( !ifstream_ )
+        throw std::runtime_error( "truncated file " + this->mp_datafile->getPath() );
+    return 0;
+}
+
+/********************************************************************/
+int
+binDatafileReader::Parse()
+{
+    return Parse( this->mp_datafile->GetData() );
+}
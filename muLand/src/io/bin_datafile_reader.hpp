@@ -0,0 +1,67 @@
+/*******************************************************************************
+ *            Micro Land (mu-land) - Land Use Model 
+ *                     Copyright 2016 by
+ *
+ *          Felipe Saavedra C. (fsaavedr@dcc.uchile.cl)
+ *
+ *
+ *  This file is part of Micro Land (mu-land)
+ *
+ *  Mu-Land is free software: you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation, either version 3 of the License, or
+ *  (at your option) any later version.
+ *
+ *  Mu-Land is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+ *
+ *  You should have received a copy of the GNU General Public License
+ *  along with Mu-Land.  If not, see <http://www.gnu.org/licenses/>.
+ *
+ ******************************************************************************/
+
+#pragma once
+
+#include <string>
+
+#include <m2l/io/datafile_reader.hpp>
+
+namespace muland
+{
+
+/** @brief Raw binary reader.
+ *
+ * Reads a Datafile formated as a binary matrix: a header with the number
+ * of rows and columns as little-endian 64 bit unsigned integers, followed
+ * by the values of each row as little-endian 64 bit floats.
+ */
+class binDatafileReader : public m2l::io::DatafileReader
+{
+public:
+    /** Default constructor.
+     * @param rDatafile data file to parse */
+    binDatafileReader( m2l::io::Datafile::datafile_ptr rDatafile): DatafileReader(rDatafile) { };
+    /** Copy constructor.
+     * @param rFrom The value to copy to this object.
+     */
+    binDatafileReader(const binDatafileReader& rFrom): DatafileReader(*rFrom.mp_datafile) { };
+    /// Destructor
+    virtual ~binDatafileReader( void ){ };
+
+    /** Parse the binary file
+     * @return 0 if success
+     */
+    int
+    Parse();
+
+private:
+    /// Parser
+    template<typename MATRIX_TYPE>
+    int
+    Parse ( MATRIX_TYPE );
+
+};
+
+} //end namespace
@@ -109,15 +109,20 @@ idx::viIdxGen
     return 0;
 }
 
+/// Values of each zone are given to the real estates found at it by I_IDX,
+/// so results of a real estate don't depend on the others of the run
 vector
 FixDimensions
 ( vector& source, unsigned dim_i, unsigned dim_f )
 {
-    vector ret ( dim_f );
-    unsigned step = std::floor ( dim_f / dim_i );
+    vector ret = zero_vector ( dim_f );
 
-    for ( unsigned i = 0; i < dim_i; i++ )
-        ublas::subrange ( ret, i * step, ( i + 1 ) * step ) = scalar_vector ( step, source ( i ) );
+    for ( unsigned vi = 0; vi < dim_f; vi++ )
+    {
+        unsigned i_ = idx::findI ( idx::reverseFindVi ( vi ).second );
+        if ( i_ < dim_i )
+            ret ( vi ) = source ( i_ );
+    }
     return ( ret );
 }
 
@@ -102,6 +102,7 @@ MarketIdxGen ( DataType* pData )
 }// namespace idx
 ///@}
 
+/// Spread vector by zone (i) over real estates (vi), matching them by I_IDX
 vector
 FixDimensions ( vector&, unsigned int, unsigned int );
 
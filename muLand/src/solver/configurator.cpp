@@ -26,8 +26,12 @@
 
 #include <iostream>
 #include <fstream>
+#include <sstream>
+#include <vector>
 
 #include <io/txt_datafile_reader.hpp>
+#include <io/bin_datafile_reader.hpp>
+#include <io/bin_datafile.hpp>
 #include <data/muland_data.hpp>
 #include <math/muland_tools.hpp>
 #include <solver/configurator.hpp>
@@ -60,7 +64,11 @@ ParseInput ( io::DatafileReader* reader, io::Datafile::datafile_ptr datafile )
 {
     try
     {
-        reader = new txtDatafileReader(datafile); 
+        const std::string name_ = datafile->getFileName();
+        if ( name_.size() > 4 && name_.compare ( name_.size() - 4, 4, ".bin" ) == 0 )
+            reader = new binDatafileReader(datafile);
+        else
+            reader = new txtDatafileReader(datafile); 
         reader->Parse();
         reader->Close();
         return 0;
@@ -72,8 +80,21 @@ ParseInput ( io::DatafileReader* reader, io::Datafile::datafile_ptr datafile )
     }
 }
 /******************************************************************************/
+/// Path of input file name, preferring its binary format when present
+std::string
+InputPath ( const std::string& input, const std::string& name, bool& binary )
+{
+    std::ifstream file_ ( ( input+"/"+name+".bin" ).c_str() );
+    if ( file_.good() )
+    {
+        binary = true;
+        return input+"/"+name+".bin";
+    }
+    return input+"/"+name+".csv";
+}
+/******************************************************************************/
 configurator::configurator
-( std::string sim_path )
+( std::string sim_path ) : m_binary ( false )
 {
 
     io::DatafileReader* reader = 0; // reader instance
@@ -81,19 +102,26 @@ configurator::configurator
     const std::string _input  ( sim_path+"/input" );
     const std::string _output ( sim_path+"/output" );
     
-    mp_agents = io::Datafile::datafile_ptr ( new io::Datafile ( _input+"/agents.csv", io::Datafile::AGENTS ) );
-    mp_zones  = io::Datafile::datafile_ptr ( new io::Datafile ( _input+"/zones.csv" , io::Datafile::ZONES  ) );
-    mp_access_attraction = io::Datafile::datafile_ptr( new io::Datafile( _input+"/agents_zones.csv"       , io::Datafile::ACCESS_ATTRACTION ) );
-    mp_real_estates      = io::Datafile::datafile_ptr( new io::Datafile( _input+"/real_estates_zones.csv" , io::Datafile::REAL_ESTATES ) );
-    mp_demand            = io::Datafile::datafile_ptr( new io::Datafile( _input+"/demand.csv"             , io::Datafile::DEMAND ) );
-    mp_demand_exogenous_cutoff = io::Datafile::datafile_ptr( new io::Datafile( _input+"/demand_exogenous_cutoff.csv", io::Datafile::DEMAND_EXOGENOUS_CUTOFF ) );
-    mp_bid_function  = io::Datafile::datafile_ptr( new io::Datafile( _input+"/bids_functions.csv", io::Datafile::BID_FUNCTION ) );
-    mp_rent_function = io::Datafile::datafile_ptr( new io::Datafile( _input+"/rent_functions.csv", io::Datafile::RENT_FUNCTION ) );
-    mp_bid_adjustment  = io::Datafile::datafile_ptr( new io::Datafile( _input+"/bids_adjustments.csv", io::Datafile::BID_ADJUSTMENT ) );
-    mp_rent_adjustment = io::Datafile::datafile_ptr( new io::Datafile(_input+"/rent_adjustments.csv", io::Datafile::RENT_ADJUSTMENT ) );
-    mp_subsidies = io::Datafile::datafile_ptr( new io::Datafile( _input+"/subsidies.csv", io::Datafile::SUBSIDES ) );
-    mp_supply    = io::Datafile::datafile_ptr( new io::Datafile( _input+"/supply.csv"   , io::Datafile::FIXED_SUPPLY ) );
+    mp_agents = io::Datafile::datafile_ptr ( new io::Datafile ( InputPath ( _input, "agents", m_binary ), io::Datafile::AGENTS ) );
+    mp_zones  = io::Datafile::datafile_ptr ( new io::Datafile ( InputPath ( _input, "zones", m_binary ) , io::Datafile::ZONES  ) );
+    mp_access_attraction = io::Datafile::datafile_ptr( new io::Datafile( InputPath ( _input, "agents_zones", m_binary )       , io::Datafile::ACCESS_ATTRACTION ) );
+    mp_real_estates      = io::Datafile::datafile_ptr( new io::Datafile( InputPath ( _input, "real_estates_zones", m_binary ) , io::Datafile::REAL_ESTATES ) );
+    mp_demand            = io::Datafile::datafile_ptr( new io::Datafile( InputPath ( _input, "demand", m_binary )             , io::Datafile::DEMAND ) );
+    mp_demand_exogenous_cutoff = io::Datafile::datafile_ptr( new io::Datafile( InputPath ( _input, "demand_exogenous_cutoff", m_binary ), io::Datafile::DEMAND_EXOGENOUS_CUTOFF ) );
+    mp_bid_function  = io::Datafile::datafile_ptr( new io::Datafile( InputPath ( _input, "bids_functions", m_binary ), io::Datafile::BID_FUNCTION ) );
+    mp_rent_function = io::Datafile::datafile_ptr( new io::Datafile( InputPath ( _input, "rent_functions", m_binary ), io::Datafile::RENT_FUNCTION ) );
+    mp_bid_adjustment  = io::Datafile::datafile_ptr( new io::Datafile( InputPath ( _input, "bids_adjustments", m_binary ), io::Datafile::BID_ADJUSTMENT ) );
+    mp_rent_adjustment = io::Datafile::datafile_ptr( new io::Datafile(InputPath ( _input, "rent_adjustments", m_binary ), io::Datafile::RENT_ADJUSTMENT ) );
+    mp_subsidies = io::Datafile::datafile_ptr( new io::Datafile( InputPath ( _input, "subsidies", m_binary ), io::Datafile::SUBSIDES ) );
+    mp_supply    = io::Datafile::datafile_ptr( new io::Datafile( InputPath ( _input, "supply", m_binary )   , io::Datafile::FIXED_SUPPLY ) );
     
+    // read selection of output files, when given
+    std::ifstream outputs_file ( ( _input+"/outputs.txt" ).c_str() );
+    std::string output_name;
+    while ( outputs_file >> output_name )
+        m_outputs.insert ( output_name );
+    outputs_file.close();
+
     // try to create output directory if not exists
     io::Datafile* _directories = new io::Datafile ( _output, io::Datafile::OTHER, io::Datafile::PATH, io::Datafile::OUTPUT );
     _directories->create_directory();
@@ -120,9 +148,11 @@ configurator::configurator
 
 
     /// @todo Review output files design
+    // outputs are saved in binary format when inputs are given in it
+    const std::string _extension ( m_binary ? ".bin" : ".csv" );
     mp_b_hvi     = io::Datafile::datafile_ptr (
                       new io::Datafile (
-                          _output+"/bids.csv",
+                          _output+"/bids"+_extension,
                           io::Datafile::BIDS,
                           io::Datafile::TXT,
                           io::Datafile::OUTPUT
@@ -132,7 +162,7 @@ configurator::configurator
                   (
                       new io::Datafile
                       (
-                          _output+"/bh.csv",
+                          _output+"/bh"+_extension,
                           io::Datafile::BH_BID_COMPONENT,
                           io::Datafile::TXT,
                           io::Datafile::OUTPUT
@@ -144,7 +174,7 @@ configurator::configurator
                   (
                       new io::Datafile
                       (
-                          _output+"/location.csv",
+                          _output+"/location"+_extension,
                           io::Datafile::LOCATION,
                           io::Datafile::TXT,
                           io::Datafile::OUTPUT
@@ -156,7 +186,7 @@ configurator::configurator
                               (
                                   new io::Datafile
                                   (
-                                      _output+"/location_probability.csv",
+                                      _output+"/location_probability"+_extension,
                                       io::Datafile::LOCATION_PROBABILITY,
                                       io::Datafile::DBF,
                                       io::Datafile::OUTPUT
@@ -168,7 +198,7 @@ configurator::configurator
                   (
                       new io::Datafile
                       (
-                          _output+"/rents.csv",
+                          _output+"/rents"+_extension,
                           io::Datafile::RENTS,
                           io::Datafile::TXT,
                           io::Datafile::OUTPUT
@@ -180,7 +210,7 @@ configurator::configurator
                   (
                       new io::Datafile
                       (
-                          _output+"/supply.csv",
+                          _output+"/supply"+_extension,
                           io::Datafile::SUPPLY,
                           io::Datafile::TXT,
                           io::Datafile::OUTPUT
@@ -190,66 +220,150 @@ configurator::configurator
 
 }
 
+bool
+configurator::is_output ( const std::string& name ) const
+{
+    return m_outputs.empty() || m_outputs.count ( name ) > 0;
+}
+
+/******************************************************************************/
+/// Output datafile saved in text or binary format
+class OutputFile
+{
+public:
+    OutputFile ( const std::string& path, bool binary ) : m_binary ( binary ), m_first ( true )
+    {
+        m_file.open ( path.c_str(), binary ? std::ios::out | std::ios::binary : std::ios::out );
+    }
+
+    /// Column names of text files, number of rows and columns of binary ones
+    void
+    header ( const std::vector<std::string>& names, unsigned rows )
+    {
+        if ( m_binary )
+        {
+            bin::WriteUInt64 ( m_file, rows );
+            bin::WriteUInt64 ( m_file, names.size() );
+            return;
+        }
+        for ( unsigned j = 0; j < names.size(); j++ )
+            m_file << ( j ? ";" : "" ) << names[j];
+        m_file << "\n";
+    }
+
+    /// Next index value of current row
+    void
+    index ( unsigned value )
+    {
+        if ( m_binary ) bin::WriteDouble ( m_file, value );
+        else m_file << ( m_first ? "" : ";" ) << value;
+        m_first = false;
+    }
+
+    /// Next value of current row
+    void
+    value ( double value )
+    {
+        if ( m_binary ) bin::WriteDouble ( m_file, value );
+        else m_file << ( m_first ? "" : ";" ) << value;
+        m_first = false;
+    }
+
+    void
+    end_row()
+    {
+        if ( !m_binary ) m_file << "\n";
+        m_first = true;
+    }
+
+private:
+    std::ofstream m_file;
+    bool m_binary;
+    bool m_first;
+};
+
+/// Column names of output files with a column per agent
+std::vector<std::string>
+AgentColumns ( unsigned n_h )
+{
+    std::vector<std::string> names_;
+    names_.push_back ( "Realestate" );
+    names_.push_back ( "Zone" );
+    for (unsigned h = 0; h < n_h; h++)
+    {
+        std::ostringstream name_;
+        name_ << "H_Type[" << h+1 << "]";
+        names_.push_back ( name_.str() );
+    }
+    return names_;
+}
+
+/// Save matrix with a row per agent and a column per real estate
+template <typename MATRIX_TYPE>
+void
+SaveHviMatrix ( const std::string& path, bool binary, const MATRIX_TYPE& matrix, unsigned n_h )
+{
+    OutputFile file ( path, binary );
+    file.header ( AgentColumns ( n_h ), matrix.size2() );
+    for (unsigned i = 0; i < matrix.size2(); i++)
+    {
+        file.index ( idx::reverseFindVi(i).first );
+        file.index ( idx::reverseFindVi(i).second );
+        for (unsigned h = 0; h < n_h; h++) file.value ( matrix(h, i) );
+        file.end_row();
+    }
+}
+
+/******************************************************************************/
 int configurator::save( )
 {
     
     LandData* data = LandData::GetInstance();
     unsigned n_h = mp_agents->GetData()->size1();
     // save bh vector
-    std::ofstream file;
-    file.open ( mp_b_h->getPath().c_str() );
-    file << "Agents;Value\n";
-    for (unsigned i = 0; i < data->b_h.size(); i++)
-        file << idx::reverseFindH( i%n_h) << ";" << data->b_h(i) << "\n";
-    file.close();
-    // save bids
-    file.open ( mp_b_hvi->getPath().c_str() );
-    file << "Realestate;Zone";
-    for (unsigned h = 0; h < n_h; h++) file << ";H_Type[" << h+1 << "]";
-    file << "\n";
-    
-    for (unsigned i = 0; i < data->b_hvi.size2(); i++)
+    if ( is_output ( "bh" ) )
     {
-        file << idx::reverseFindVi(i).first << ";" << idx::reverseFindVi(i).second; 
-        for (unsigned h = 0; h < n_h; h++) file << ";" << data->b_hvi(h, i);
-        file << "\n";
+        OutputFile file ( mp_b_h->getPath(), m_binary );
+        std::vector<std::string> names_;
+        names_.push_back ( "Agents" );
+        names_.push_back ( "Value" );
+        file.header ( names_, data->b_h.size() );
+        for (unsigned i = 0; i < data->b_h.size(); i++)
+        {
+            file.index ( idx::reverseFindH( i%n_h) );
+            file.value ( data->b_h(i) );
+            file.end_row();
+        }
     }
-    file.close();
+    // save bids
+    if ( is_output ( "bids" ) )
+        SaveHviMatrix ( mp_b_hvi->getPath(), m_binary, data->b_hvi, n_h );
     
     // save location
-    file.open ( mp_H_hvi->getPath().c_str() );
-    file << "Realestate;Zone";
-    for (unsigned h = 0; h < n_h; h++) file << ";H_Type[" << h+1 << "]";
-    file << "\n";
-    
-    for (unsigned i = 0; i < data->H_hvi.size2(); i++)
-    {
-        file << idx::reverseFindVi(i).first << ";" << idx::reverseFindVi(i).second; 
-        for (unsigned h = 0; h < n_h; h++) file << ";" << data->H_hvi(h, i);
-        file << "\n";
-    }
-    file.close();
+    if ( is_output ( "location" ) )
+        SaveHviMatrix ( mp_H_hvi->getPath(), m_binary, data->H_hvi, n_h );
 
     // save location_probability
-    file.open ( mp_Prob_hvi->getPath().c_str() );
-    file << "Realestate;Zone";
-    for (unsigned h = 0; h < n_h; h++) file << ";H_Type[" << h+1 << "]";
-    file << "\n";
+    if ( is_output ( "location_probability" ) )
+        SaveHviMatrix ( mp_Prob_hvi->getPath(), m_binary, data->P_hvi, n_h );
     
-    for (unsigned i = 0; i < data->P_hvi.size2(); i++)
+    // save rents vector
+    if ( is_output ( "rents" ) )
     {
-        file << idx::reverseFindVi(i).first << ";" << idx::reverseFindVi(i).second; 
-        for (unsigned h = 0; h < n_h; h++) file << ";" << data->P_hvi(h, i);
-        file << "\n";
+        OutputFile file ( mp_r_vi->getPath(), m_binary );
+        std::vector<std::string> names_;
+        names_.push_back ( "Realestate" );
+        names_.push_back ( "Zone" );
+        names_.push_back ( "Value" );
+        file.header ( names_, data->r_vi.size() );
+        for (unsigned i = 0; i < data->r_vi.size(); i++)
+        {
+            file.index ( idx::reverseFindVi(i).first );
+            file.index ( idx::reverseFindVi(i).second );
+            file.value ( data->r_vi(i) );
+            file.end_row();
+        }
     }
-    file.close();
-    
-    // save rents vector
-    file.open ( mp_r_vi->getPath().c_str() );
-    file << "Realestate;Zone;Value\n";
-    for (unsigned i = 0; i < data->r_vi.size(); i++)
-        file << idx::reverseFindVi(i).first << ";" << idx::reverseFindVi(i).second  << ";" << data->r_vi(i) << "\n";
-    file.close();
     
     return 0;
 }
@@ -25,6 +25,7 @@
 #pragma once
 
 #include<string>
+#include<set>
 
 #include <m2l/io/datafile.hpp>
 
@@ -57,6 +58,10 @@ public:
     int
     save();
 
+    /// Whether an output file (e.g. "bids") was selected to be saved
+    bool
+    is_output ( const std::string& name ) const;
+
     // Input files
     io::Datafile::datafile_ptr mp_access_attraction;
     io::Datafile::datafile_ptr mp_agents;
@@ -84,6 +89,11 @@ public:
     io::Datafile::datafile_ptr mp_S_vi;
     
 private:
+    /// Output files listed at input/outputs.txt, empty to save all
+    std::set<std::string> m_outputs;
+    /// Whether inputs were given, and outputs are saved, in binary format
+    bool m_binary;
+
     configurator
     ( std::string simfile );
     ~configurator() { delete mps_instance; }
@@ -92,10 +92,17 @@ Solver::Init()
     for ( unsigned j = 0; j < acc_att_matrix_file.size1(); j++ )
         data->att_matrix ( idx::findH ( acc_att_matrix_file ( j, 1 ) ), idx::findI ( acc_att_matrix_file ( j, 2 ) ) ) = acc_att_matrix_file ( j, 4 );
 
+    // Vectors by real estate are matched by V_IDX and I_IDX, not by row
     matrix rent_adjustment = *configurator->mp_rent_adjustment->GetData();
-    data->rents_adjustment_vector = matrix_column ( rent_adjustment, 3 );
+    data->rents_adjustment_vector = data->zero_vi;
+    for ( unsigned j = 0; j < rent_adjustment.size1(); j++ )
+        if ( idx::findVi ( rent_adjustment ( j, 1 ), rent_adjustment ( j, 2 ) ) < data->n_vi )
+            data->rents_adjustment_vector ( idx::findVi ( rent_adjustment ( j, 1 ), rent_adjustment ( j, 2 ) ) ) = rent_adjustment ( j, 3 );
     matrix supply = *configurator->mp_supply->GetData();
-    data->S_vi = matrix_column ( supply , 3 );
+    data->S_vi = data->zero_vi;
+    for ( unsigned j = 0; j < supply.size1(); j++ )
+        if ( idx::findVi ( supply ( j, 1 ), supply ( j, 2 ) ) < data->n_vi )
+            data->S_vi ( idx::findVi ( supply ( j, 1 ), supply ( j, 2 ) ) ) = supply ( j, 3 );
 
     return m_status;
 }
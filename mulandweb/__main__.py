@@ -3,15 +3,24 @@
 import argparse
 from . import config
 
+def clean_workspaces():
+    '''Remove working directories left by previous servers'''
+    from .workspace import workspaces
+    workspaces.clean()
+
 def run(host=config.mulandweb_host, port=config.mulandweb_port):
     '''Run server on Gunicorn'''
     from . import app
+    clean_workspaces()
     from gunicorn.app.base import Application
     gunicorn_config = {'bind': "%s:%d" % (host, port)}
     class GunicornApplication(Application):
         def __init__(self):
             self.application = app
-            self.options = {'bind': "%s:%d" % (host, port)}
+            self.options = {'bind': "%s:%d" % (host, port),
+                            'workers': config.mulandweb_workers,
+                            'worker_class': config.mulandweb_worker_class,
+                            'threads': config.mulandweb_threads}
             super().__init__()
         def load_config(self):
             for key, value in self.options.items():
@@ -20,6 +29,12 @@ def run(host=config.mulandweb_host, port=config.mulandweb_port):
             return self.application
     GunicornApplication().run()
 
+def run_async(host=config.mulandweb_host, port=config.mulandweb_port):
+    '''Run asyncio server on aiohttp'''
+    from . import aioserver
+    clean_workspaces()
+    aioserver.run(host, port)
+
 def import_model(name, srid=4326):
     '''Import model into database'''
     from .mulanddb import ModelImporter
@@ -36,11 +51,14 @@ def main():
     action = parser.add_mutually_exclusive_group(required=True)
     action.add_argument('-r', '--run', action='store_true',
                         help='run mulandweb on gunicorn')
+    action.add_argument('--run-async', action='store_true',
+                        help='run mulandweb on an asyncio server (aiohttp)')
     action.add_argument('-i', '--import', dest='import_name',
                         metavar='model_name', type=str, nargs='?', default=None,
                         help="import model 'model_name' with name 'model_name'")
     action.add_argument('-c', '--create-tables', action='store_true',
-                        help='create mulandweb tables at the database.')
+                        help='create mulandweb tables at the database, '
+                             'upgrading existing ones.')
     parser.add_argument('--import-srid', dest='srid',
                         metavar='srid', type=int, nargs='?', default=4326,
                         help='specify SRID used in shape files when importing')
@@ -50,6 +68,10 @@ def main():
         run()
         return
 
+    if args.run_async:
+        run_async()
+        return
+
     if args.import_name:
         import_model(args.import_name, srid=args.srid)
         return
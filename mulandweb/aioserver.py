@@ -0,0 +1,147 @@
+# coding: utf-8
+'''Provides an asyncio server for MulandWeb
+
+Serves POST /<model> like handlers.post_handler, with the same validation
+and XML/JSON negotiation. Parsing, database access and serialization run
+at a bounded thread pool, and Mu-Land runs as asyncio subprocesses once
+admitted by the scheduler. Jobs and batch routes are only served by the
+bottle application. Requires aiohttp.
+'''
+
+import io
+import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import bottle
+from aiohttp import web
+
+from .muland import MulandRunError
+from .cache import unit_cache, result_store
+from .scheduler import QueueFull
+from . import jsonstream, xmlparser, protocol
+from . import config
+
+__all__ = ['make_app', 'run']
+
+_db_executor = web.AppKey('db_executor', ThreadPoolExecutor)
+
+def _error_response(error):
+    '''Convert bottle.HTTPError raised by protocol helpers into a response'''
+    return web.Response(status=error.status_code, text=str(error.body or ''))
+
+def _parse_locations(body, output_mime):
+    '''Parse and validate location list from request body'''
+    if output_mime == 'xml':
+        return protocol.read_xml(io.BytesIO(body))
+
+    try:
+        data_in = json.loads(body.decode('utf-8')) if body else None
+    except ValueError:
+        raise bottle.HTTPError(400, 'Invalid JSON')
+    return protocol.check_data(data_in)
+
+async def _read_locations(request, executor):
+    '''Read and validate location list from request, as handlers do
+
+    The body is parsed and validated at executor.
+    '''
+    output_mime = protocol.output_mime(request.headers.get('Content-Type', ''))
+    body = await request.read()
+    loop = asyncio.get_event_loop()
+    locations = await loop.run_in_executor(executor, _parse_locations, body,
+                                           output_mime)
+    return locations, output_mime
+
+async def _write_chunks(response, chunks, executor):
+    '''Write chunks of a generator to response, producing each at executor
+
+    Serialization and result store writes don't block the event loop. The
+    generator is closed at executor if writing stops early, once the chunk
+    being produced is done.
+    '''
+    loop = asyncio.get_event_loop()
+    future = None
+    try:
+        while True:
+            future = loop.run_in_executor(executor, next, chunks, None)
+            chunk = await asyncio.shield(future)
+            if chunk is None:
+                break
+            await response.write(chunk)
+    finally:
+        if future is not None and not future.done():
+            await asyncio.wait([future])
+        await loop.run_in_executor(executor, chunks.close)
+
+async def post_handler(request):
+    '''Handles POST requests to server'''
+    # Validate model name
+    model = request.match_info['model']
+    if protocol.model_re.match(model) is None:
+        raise web.HTTPNotFound()
+
+    loop = asyncio.get_event_loop()
+    executor = request.app[_db_executor]
+    try:
+        locations, output_mime = await _read_locations(request, executor)
+        outputs = protocol.parse_outputs(request.query.get('outputs'))
+        mudb = await loop.run_in_executor(executor, protocol.get_mudb,
+                                          model, locations)
+    except bottle.HTTPError as e:
+        return _error_response(e)
+
+    # Answer from result store when possible
+    key = await loop.run_in_executor(executor, protocol.result_key, model, mudb,
+                                     locations, output_mime, outputs)
+    etag = '"%s"' % key
+    if protocol.etag_matches(request.headers.get('If-None-Match'), etag):
+        return web.Response(status=304, headers={'ETag': etag})
+
+    chunks = None
+    body = await loop.run_in_executor(executor, result_store.get, key)
+    if body is None:
+        # Run Mu-Land for units not in cache
+        try:
+            output_data = await unit_cache.run_async(mudb, outputs=outputs,
+                                                     executor=executor)
+        except QueueFull as e:
+            return web.Response(status=429, text=str(e),
+                                headers={'Retry-After': str(e.retry_after)})
+        except MulandRunError:
+            return web.Response(status=500, text='Error running Mu-Land')
+
+        if output_mime == 'json':
+            chunks = jsonstream.iterdumps(output_data)
+        elif output_mime == 'xml':
+            chunks = xmlparser.iterdump(output_data)
+        chunks = result_store.put_iter(key, chunks)
+
+    # Send response
+    response = web.StreamResponse(headers={
+        'Content-Type': protocol.content_types[output_mime],
+        'ETag': etag})
+    await response.prepare(request)
+    if chunks is None:
+        await response.write(body)
+    else:
+        await _write_chunks(response, chunks, executor)
+    await response.write_eof()
+    return response
+
+async def _cleanup(app):
+    '''Release resources'''
+    app[_db_executor].shutdown(wait=False)
+
+def make_app():
+    '''Build aiohttp application'''
+    app = web.Application(client_max_size=config.mulandweb_memfile_max)
+    app[_db_executor] = ThreadPoolExecutor(
+        max_workers=config.mulandweb_async_db_threads)
+    app.on_cleanup.append(_cleanup)
+    app.router.add_post('/{model}', post_handler)
+    return app
+
+def run(host=config.mulandweb_host, port=config.mulandweb_port):
+    '''Run server on aiohttp'''
+    web.run_app(make_app(), host=host, port=port)
@@ -0,0 +1,343 @@
+# coding: utf-8
+'''Provides caches of Muland results for MulandWeb'''
+
+from collections import OrderedDict
+from threading import Lock
+from pathlib import Path
+import os, tempfile, hashlib, json, asyncio
+
+import numpy as np
+
+from .muland import Muland
+from .output import OutputTable, table_array
+from .dispatch import dispatcher
+from .scheduler import scheduler
+from . import config
+
+__all__ = ['UnitCache', 'unit_cache', 'ResultStore', 'result_store']
+
+class UnitCache:
+    '''LRU cache of Muland output records by unit
+
+    Muland normalizes location probabilities and computes rents by real
+    estate, so the records of a unit depend only on its zone, type and
+    overrides, besides the model's tables. Entries are keyed by model,
+    model version and MulandDB.unit_keys, and hold the output files they
+    were solved for. Units are only cached, and solved once per key, with
+    Muland.separable_engines, which include both engines.
+    '''
+    def __init__(self, maxsize=config.mulandweb_unit_cache_size):
+        '''Initialize cache holding up to maxsize units'''
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        '''Return entry for key or None'''
+        with self._lock:
+            try:
+                self._entries.move_to_end(key)
+            except KeyError:
+                return None
+            return self._entries[key]
+
+    def put(self, key, value):
+        '''Store entry for key, evicting least recently used entries'''
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        '''Remove all entries'''
+        with self._lock:
+            self._entries.clear()
+
+    def run(self, mudb, timeout=None, outputs=None):
+        '''Run Muland for the units of a MulandDB, solving only uncached ones
+
+        Returns Muland output data for all units, including only output
+        files in outputs, which defaults to all. Units with equal keys are
+        solved once, as a single real estate, with both engines. Engines
+        not in Muland.separable_engines solve every unit instead.
+        '''
+        if Muland.engine not in Muland.separable_engines:
+            mudb.resolve()
+            return dispatcher.run((mudb.model, mudb.models_version), mudb.get(),
+                                  timeout, outputs)
+
+        run = _UnitRun(self, mudb, outputs)
+        output_data = None
+        if run.needs_solve:
+            output_data = dispatcher.run(run.prefix, mudb.get(run.missing_units),
+                                         timeout, run.outputs)
+            run.store(output_data)
+        return run.output(output_data)
+
+    async def run_async(self, mudb, timeout=None, outputs=None, executor=None):
+        '''Run Muland for the units of a MulandDB like run, in asyncio
+
+        Database access and record handling run at executor, defaulting to
+        the loop's default executor, and Muland runs with Muland.run_async
+        once admitted by the scheduler.
+        '''
+        loop = asyncio.get_event_loop()
+        if Muland.engine not in Muland.separable_engines:
+            input_data = await loop.run_in_executor(executor, mudb.get)
+            return await self._solve_async(input_data, (mudb.model, mudb.models_version),
+                                           timeout, outputs)
+
+        run = await loop.run_in_executor(executor, _UnitRun, self, mudb, outputs)
+        output_data = None
+        if run.needs_solve:
+            input_data = await loop.run_in_executor(executor, mudb.get,
+                                                    run.missing_units)
+            output_data = await self._solve_async(input_data, run.prefix, timeout,
+                                                  run.outputs)
+            await loop.run_in_executor(executor, run.store, output_data)
+        return await loop.run_in_executor(executor, run.output, output_data)
+
+    @staticmethod
+    async def _solve_async(input_data, static_key, timeout=None, outputs=None):
+        '''Run Muland over input data once admitted by the scheduler'''
+        loop = asyncio.get_event_loop()
+        mu = Muland(outputs=outputs, static_key=static_key, **input_data)
+        cost = scheduler.estimate(input_data)
+        processes = await loop.run_in_executor(None, lambda: mu.processes)
+        slots = await scheduler.acquire_async(cost, timeout is None, processes)
+        try:
+            await mu.run_async(scheduler.timeout(cost) if timeout is None
+                               else timeout)
+        finally:
+            scheduler.release(slots)
+        return mu.output_data
+
+class _UnitRun:
+    '''Units of a MulandDB and their entries at a UnitCache'''
+    def __init__(self, cache, mudb, outputs=None):
+        '''Resolve mudb and look its units up at cache'''
+        if outputs is None:
+            outputs = Muland.output_files
+        self.cache = cache
+        self.mudb = mudb
+        self.outputs = outputs
+        self.wanted = frozenset(outputs)
+
+        mudb.resolve()
+        self.units = mudb.units
+        self.prefix = (mudb.model, mudb.models_version)
+        self.keys = [self.prefix + key for key in mudb.unit_keys(self.units)]
+        self.cached = [cache.get(key) for key in self.keys]
+        self.entries = [entry if entry is not None and self.wanted <= entry[0]
+                        else None for entry in self.cached]
+
+        # Group missing units by key
+        self.missing = OrderedDict()
+        for index, entry in enumerate(self.entries):
+            if entry is None:
+                self.missing.setdefault(self.keys[index], []).append(index)
+        self.missing_units = self.units[[indexes[0] for indexes
+                                         in self.missing.values()]]
+
+    @property
+    def needs_solve(self):
+        '''Whether Muland must run for missing units'''
+        return bool(self.missing) or not len(self.units)
+
+    def store(self, output_data):
+        '''Store records of missing units from Muland output data'''
+        bh = output_data.get('bh')
+        if bh is not None:
+            # Copy, so output files of the run aren't kept
+            bh = OutputTable(np.array(table_array(bh)))
+        unit_records = self.mudb.split_output(output_data, self.missing_units)
+        for indexes, records in zip(self.missing.values(), unit_records):
+            entry = (self.wanted, records, bh)
+            old_entry = self.cached[indexes[0]]
+            if old_entry is not None:
+                # Keep output files solved before
+                old_outputs, old_records, old_bh = old_entry
+                entry = (old_outputs | self.wanted, dict(old_records, **records),
+                         old_bh if bh is None else bh)
+            for index in indexes:
+                self.entries[index] = entry
+            self.cache.put(self.keys[indexes[0]], entry)
+
+    def output(self, output_data=None):
+        '''Return Muland output data for all units'''
+        entries = self.entries
+        bh = entries[0][2] if entries else output_data.get('bh')
+        return self.mudb.join_output([entry[1] for entry in entries], bh,
+                                     outputs=self.outputs)
+
+unit_cache = UnitCache()
+
+class ResultStore:
+    '''Content-addressed store of serialized responses
+
+    Responses are kept in a memory LRU tier backed by a disk tier, both
+    limited by size in bytes. Keys are hashes of the request, as given by
+    ResultStore.key, so they also serve as ETags.
+    '''
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, path=config.mulandweb_cache_path,
+                 memory_max=config.mulandweb_cache_memory_max,
+                 disk_max=config.mulandweb_cache_disk_max):
+        '''Initialize store at path'''
+        self.path = path
+        self.memory_max = memory_max
+        self.disk_max = disk_max
+        self._entries = OrderedDict()
+        self._memory_size = 0
+        self._disk_size = 0
+        self._lock = Lock()
+
+    @staticmethod
+    def _normalize(value):
+        '''Normalize numbers so equal requests get equal keys'''
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, (int, float)):
+            return float(value)
+        if isinstance(value, dict):
+            return {key: ResultStore._normalize(item)
+                    for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [ResultStore._normalize(item) for item in value]
+        return value
+
+    @classmethod
+    def key(cls, model, version, locations, output_format, outputs=None):
+        '''Return key of a request'''
+        if outputs is None:
+            outputs = Muland.output_files
+        request = [model, str(version), output_format,
+                   cls._normalize(locations), sorted(outputs)]
+        canonical = json.dumps(request, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        '''Return stored body for key or None'''
+        with self._lock:
+            try:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            except KeyError:
+                pass
+
+        if self.disk_max <= 0:
+            return None
+        filename = Path(self.path, key)
+        try:
+            with filename.open('rb') as file:
+                body = file.read()
+            os.utime(str(filename))
+        except OSError:
+            return None
+        self._memory_put(key, body)
+        return body
+
+    def put(self, key, body):
+        '''Store body for key'''
+        self._memory_put(key, body)
+        self._disk_put(key, body)
+
+    def put_iter(self, key, chunks):
+        '''Store body given as chunks for key, yielding the chunks
+
+        Chunks are written to the disk tier as they are yielded, and kept
+        for the memory tier only while they fit it. Nothing is stored if
+        iteration doesn't complete.
+        '''
+        file = None
+        if self.disk_max > 0:
+            os.makedirs(self.path, exist_ok=True)
+            file = tempfile.NamedTemporaryFile(dir=self.path, prefix='.',
+                                               delete=False)
+        parts = []
+        size = 0
+        completed = False
+        try:
+            for chunk in chunks:
+                size += len(chunk)
+                if size > self.memory_max:
+                    parts = None
+                elif parts is not None:
+                    parts.append(chunk)
+                if file is not None:
+                    file.write(chunk)
+                yield chunk
+            completed = True
+        finally:
+            if file is not None:
+                file.close()
+                if completed and size <= self.disk_max:
+                    self._disk_commit(key, file.name, size)
+                else:
+                    os.remove(file.name)
+
+        if parts is not None:
+            self._memory_put(key, b''.join(parts))
+
+    def _memory_put(self, key, body):
+        '''Store body at memory tier, evicting least recently used'''
+        if len(body) > self.memory_max:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = body
+            self._memory_size += len(body)
+            while self._memory_size > self.memory_max:
+                _, evicted = self._entries.popitem(last=False)
+                self._memory_size -= len(evicted)
+
+    def _disk_put(self, key, body):
+        '''Store body at disk tier, evicting least recently used'''
+        if len(body) > self.disk_max:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=self.path, prefix='.',
+                                         delete=False) as file:
+            file.write(body)
+        self._disk_commit(key, file.name, len(body))
+
+    def _disk_commit(self, key, filename, size):
+        '''Move written file into disk tier, evicting least recently used'''
+        os.replace(filename, str(Path(self.path, key)))
+
+        with self._lock:
+            self._disk_size += size
+            if self._disk_size > self.disk_max:
+                self._disk_size = self._evict()
+
+    def _evict(self):
+        '''Remove least recently used files until disk tier fits its size
+
+        Other processes may share the directory, so its size is recomputed
+        before evicting. Returns the resulting size.
+        '''
+        files = []
+        for entry in os.scandir(self.path):
+            if entry.name.startswith('.'):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+        size = sum(file[1] for file in files)
+        for _, file_size, filename in sorted(files):
+            if size <= self.disk_max:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                continue
+            size -= file_size
+        return size
+
+result_store = ResultStore()
@@ -3,7 +3,8 @@
 '''Specifies database tables and provides function to create them'''
 
 from sqlalchemy import create_engine, Table, Column, MetaData
-from sqlalchemy import Integer, String, Float, ForeignKey, Sequence
+from sqlalchemy import Integer, String, Float, DateTime, ForeignKey, Sequence
+from sqlalchemy import func, table, column, inspect, text
 from sqlalchemy import ForeignKeyConstraint
 from sqlalchemy.dialects.postgresql import ARRAY
 from geoalchemy2 import Geometry
@@ -19,6 +20,7 @@ models = Table(config.db_prefix + 'models', meta,
     Column('agents_header', ARRAY(String, zero_indexes=True), nullable=False),
     Column('agents_zones_header', ARRAY(String, zero_indexes=True), nullable=False),
     Column('real_estates_zones_header', ARRAY(String, zero_indexes=True), nullable=False),
+    Column('version', DateTime, nullable=False, server_default=func.now()),
 )
 
 zones = Table(config.db_prefix + 'zones', meta,
@@ -156,6 +158,31 @@ rent_functions = Table(config.db_prefix + 'rent_functions', meta,
     Column('exppar_y', Float, nullable=False),
 )
 
+# Temporary table holding the units of a request, see MulandDB._load_units
+request_units = table(config.db_prefix + 'request_units',
+    column('lid', Integer),
+    column('zones_id', Integer),
+    column('types_id', Integer),
+)
+
+# Columns added to existing tables since they were first released, as
+# (table, column name, column definition)
+_added_columns = [
+    (models, 'version', 'timestamp NOT NULL DEFAULT now()'),
+]
+
 def create_tables():
-    '''Create tables at the database'''
+    '''Create tables at the database, upgrading existing ones'''
     meta.create_all(engine)
+    upgrade_tables()
+
+def upgrade_tables():
+    '''Add columns missing from tables created by older versions'''
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for added_table, name, definition in _added_columns:
+            columns = {column['name'] for column in
+                       inspector.get_columns(added_table.name)}
+            if name not in columns:
+                conn.execute(text('ALTER TABLE %s ADD COLUMN %s %s' %
+                                  (added_table.name, name, definition)))
@@ -0,0 +1,112 @@
+# coding: utf-8
+'''Provides merging of concurrent Muland runs into shared runs'''
+
+from threading import Lock, Event
+import time
+
+from .muland import Muland
+from .scheduler import scheduler
+from . import partition
+from . import config
+
+__all__ = ['Dispatcher', 'dispatcher']
+
+class _Batch:
+    '''Runs waiting to be solved together'''
+    # pylint: disable=too-few-public-methods
+    def __init__(self):
+        '''Initialize empty batch'''
+        self.inputs = []
+        self.timeouts = []
+        self.results = None
+        self.error = None
+        self.done = Event()
+
+class Dispatcher:
+    '''Merges concurrent Muland runs into a single run
+
+    Real estates don't affect each other's results, so runs of the same
+    model, version and outputs can be solved together, with their zones
+    renumbered, as long as Muland's engine is in Muland.separable_engines,
+    like both engines are. While other runs are in progress, a run waits
+    window seconds for runs to join it before solving them all at once.
+    Merged runs are admitted by the scheduler. Runs given a timeout, like
+    background jobs, are never merged with runs that weren't, which are
+    the ones that may be shed.
+    '''
+    def __init__(self, window=config.mulandweb_dispatch_window):
+        '''Initialize dispatcher'''
+        self.window = window
+        self._pending = {}
+        self._active = 0
+        self._lock = Lock()
+
+    def run(self, static_key, input_data, timeout=None, outputs=None):
+        '''Run Muland over input data, returning its output data
+
+        static_key identifies the model and its version, as given to
+        Muland. Only runs with equal static keys and outputs, either all
+        given a timeout or none, are merged.
+        '''
+        key = (static_key, tuple(outputs or Muland.output_files), timeout is None)
+        with self._lock:
+            self._active += 1
+            batch = self._pending.get(key)
+            leader = batch is None
+            if leader:
+                batch = _Batch()
+                waits = (self.window > 0 and self._active > 1 and
+                         Muland.engine in Muland.separable_engines)
+                if waits:
+                    self._pending[key] = batch
+            index = len(batch.inputs)
+            batch.inputs.append(input_data)
+            batch.timeouts.append(timeout)
+
+        try:
+            if leader:
+                if waits:
+                    time.sleep(self.window)
+                    with self._lock:
+                        del self._pending[key]
+                self._solve(batch, static_key, outputs)
+            else:
+                batch.done.wait()
+        finally:
+            with self._lock:
+                self._active -= 1
+
+        if batch.error is not None:
+            raise batch.error
+        return batch.results[index]
+
+    @staticmethod
+    def _solve(batch, static_key, outputs):
+        '''Solve runs of batch, storing their results or error'''
+        # pylint: disable=broad-except
+        try:
+            if len(batch.inputs) == 1:
+                input_data, offsets = batch.inputs[0], None
+            else:
+                input_data, offsets = partition.merge(batch.inputs)
+            cost = scheduler.estimate(input_data)
+            timeout = max(scheduler.timeout(cost) if timeout is None else timeout
+                          for timeout in batch.timeouts)
+            shed = batch.timeouts[0] is None
+
+            mu = Muland(outputs=outputs, static_key=static_key, **input_data)
+            slots = scheduler.acquire(cost, shed, mu.processes)
+            try:
+                mu.run(timeout)
+            finally:
+                scheduler.release(slots)
+            if offsets is None:
+                batch.results = [mu.output_data]
+            else:
+                batch.results = partition.split_output(mu.output_data, offsets)
+        except Exception as e:
+            batch.error = e
+        finally:
+            batch.done.set()
+
+dispatcher = Dispatcher()
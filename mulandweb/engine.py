@@ -0,0 +1,264 @@
+# coding: utf-8
+# pylint: disable=invalid-name
+'''Provides an in-process NumPy implementation of the Mu-Land model'''
+
+import numpy as np
+
+from .output import OutputTable
+
+__all__ = ['LandData', 'solve']
+
+class LandData:
+    '''Holds matrices used by the model functions
+
+    Mirrors muland::LandData. Matrices are dense NumPy arrays with agents
+    (h) as rows and real estates (vi) as columns.
+    '''
+    # pylint: disable=too-many-instance-attributes,too-few-public-methods
+    def __init__(self, input_data):
+        '''Build model matrices from a dict of MulandData'''
+        agents = _matrix(input_data['agents'])
+        zones = _matrix(input_data['zones'])
+        real_estates = _matrix(input_data['real_estates_zones'])
+
+        self.agents_matrix = agents
+        self.zones_matrix = zones
+        self.real_estate_matrix = real_estates
+        self.bids_fn = _matrix(input_data['bids_functions'])
+        self.rents_fn = _matrix(input_data['rent_functions'])
+
+        self.n_h = n_h = agents.shape[0]
+        self.n_vi = n_vi = real_estates.shape[0]
+        self.n_i = zones.shape[0]
+        self.n_m = int(agents[-1, 1]) if n_h else 0
+
+        # Indexes: agents by IDAGENT, zones by I_IDX, real estates by (V, I)
+        self._h_keys = agents[:, 0]
+        self._i_keys = zones[:, 0]
+        self._vi_keys = real_estates[:, 0:2]
+
+        # Zone row of each real estate, used to broadcast i to vi
+        self.i_of_vi = _lookup(self._i_keys[:, None], real_estates[:, 1:2])
+
+        # Markets
+        self.h_market = agents[:, 1].astype(int)
+        self.vi_market = real_estates[:, 2].astype(int)
+        self.m_idx = ((self.h_market[:, None] == self.vi_market[None, :]) &
+                      (self.h_market[:, None] <= self.n_m))
+
+        # Agent attributes
+        self.total_demand = self._h_vector(input_data['demand'])
+        self.acc_matrix, self.att_matrix = self._hi_matrices(
+            input_data['agents_zones'])
+
+        # Sparse definitions by h, v, i
+        self.phi_hvi = self._hvi_matrix(input_data['demand_exogenous_cutoff'])
+        self.bid_adjustment_matrix = self._hvi_matrix(input_data['bids_adjustments'])
+        self.subsidies_matrix = self._hvi_matrix(input_data['subsidies'])
+
+        # Vectors by v, i
+        self.rents_adjustment_vector = self._vi_vector(input_data['rent_adjustments'])
+        self.S_vi = self._vi_vector(input_data['supply'])
+
+        # Results
+        self.b_h = np.zeros(n_h)
+        self.b_hvi = np.zeros((n_h, n_vi))
+        self.P_hvi = np.zeros((n_h, n_vi))
+        self.H_hvi = np.zeros((n_h, n_vi))
+        self.r_vi = np.zeros(n_vi)
+        self.r_mu_m = np.zeros(self.n_m)
+
+    def _h_vector(self, data):
+        '''Build vector by agent from (H_IDX, VALUE) records'''
+        mat = _matrix(data)
+        ret = np.zeros(self.n_h)
+        h = _lookup(self._h_keys[:, None], mat[:, 0:1])
+        found = h >= 0
+        ret[h[found]] = mat[found, 1]
+        return ret
+
+    def _hi_matrices(self, data):
+        '''Build accessibility and attraction matrices by agent and zone'''
+        mat = _matrix(data)
+        acc = np.zeros((self.n_h, self.n_i))
+        att = np.zeros((self.n_h, self.n_i))
+        h = _lookup(self._h_keys[:, None], mat[:, 0:1])
+        i = _lookup(self._i_keys[:, None], mat[:, 1:2])
+        found = (h >= 0) & (i >= 0)
+        acc[h[found], i[found]] = mat[found, 2]
+        att[h[found], i[found]] = mat[found, 3]
+        return acc, att
+
+    def _hvi_matrix(self, data):
+        '''Build matrix by agent and real estate from (H, V, I, VALUE) records'''
+        mat = _matrix(data)
+        ret = np.zeros((self.n_h, self.n_vi))
+        h = _lookup(self._h_keys[:, None], mat[:, 0:1])
+        vi = _lookup(self._vi_keys, mat[:, 1:3])
+        found = (h >= 0) & (vi >= 0) & (mat[:, 3] != 0)
+        ret[h[found], vi[found]] = mat[found, 3]
+        return ret
+
+    def _vi_vector(self, data):
+        '''Build vector by real estate from (V, I, VALUE) records'''
+        mat = _matrix(data)
+        ret = np.zeros(self.n_vi)
+        vi = _lookup(self._vi_keys, mat[:, 0:2])
+        found = vi >= 0
+        ret[vi[found]] = mat[found, 2]
+        return ret
+
+def _matrix(data):
+    '''Convert MulandData records into a 2-dimensional float array'''
+    mat = np.asarray(data.records, dtype=float)
+    return mat.reshape(-1, len(data.header))
+
+def _lookup(keys, values):
+    '''Return row in keys of each row in values, -1 where not found
+
+    When keys has repeated rows, the first occurrence is returned, like the
+    index maps built by mu-land.
+    '''
+    if keys.shape[0] == 0 or values.shape[0] == 0:
+        return np.full(values.shape[0], -1, dtype=int)
+    dtype = np.dtype([('f%d' % j, float) for j in range(keys.shape[1])])
+    keys = np.ascontiguousarray(keys).view(dtype).ravel()
+    values = np.ascontiguousarray(values).view(dtype).ravel()
+    unique, first = np.unique(keys, return_index=True)
+    pos = np.searchsorted(unique, values).clip(0, unique.shape[0] - 1)
+    return np.where(unique[pos] == values, first[pos], -1)
+
+def _pow(x, exponent, mask):
+    '''Power of x, restricted to mask when exponent is negative'''
+    if exponent < 0:
+        ret = np.zeros(np.broadcast(x, mask).shape)
+        np.power(x, exponent, out=ret, where=mask.astype(bool))
+        return ret
+    return np.power(x, exponent)
+
+def _bid_term(data, h, vi_m, agent_col, rest_col, acc_col, zones_col):
+    '''Build x or y term of a bid function for the agents h'''
+    # pylint: disable=too-many-arguments
+    if agent_col:
+        return data.agents_matrix[h, int(agent_col) - 1][:, None] * vi_m
+    if rest_col:
+        return data.real_estate_matrix[:, int(rest_col) - 1] * vi_m
+    if acc_col:
+        source = data.acc_matrix if acc_col == 3 else data.att_matrix
+        return source[h][:, data.i_of_vi] * vi_m
+    if zones_col:
+        return data.zones_matrix[data.i_of_vi, int(zones_col) - 1] * vi_m
+    return None
+
+def _rent_term(data, vixm, rest_col, zones_col):
+    '''Build x or y term of a rent function'''
+    if rest_col:
+        return data.real_estate_matrix[:, int(rest_col) - 1] * vixm
+    if zones_col:
+        return data.zones_matrix[data.i_of_vi, int(zones_col) - 1] * vixm
+    return np.ones(data.n_vi)
+
+def bid_fn(data):
+    '''Evaluate bids b_hvi'''
+    data.b_hvi = np.zeros((data.n_h, data.n_vi))
+    for row in data.bids_fn:
+        market = row[0]
+        vi_m = (data.vi_market == market).astype(float)
+        # Bidders are agents in the market in the aggregated category
+        h = np.flatnonzero((data.h_market == market) &
+                           (data.agents_matrix[:, 2] == row[1]))
+        if h.size == 0:
+            continue
+
+        x = _bid_term(data, h, vi_m, row[4], row[5], row[6], row[7])
+        if x is None:
+            x = np.ones(data.n_vi)
+        x = _pow(x, row[8], vi_m)
+
+        y = _bid_term(data, h, vi_m, row[9], row[10], row[11], row[12])
+        if y is None:
+            y = np.ones(data.n_vi)
+        y = _pow(y, row[13], vi_m)
+
+        data.b_hvi[h] += row[3] * x * y
+    data.b_hvi += data.bid_adjustment_matrix + data.subsidies_matrix
+
+def _h_phi_exp_b(data):
+    '''Return H_h phi_hvi exp(b_hvi + b_h)'''
+    B_hvi = data.b_hvi + data.b_h[:, None]
+    return data.total_demand[:, None] * data.phi_hvi * np.exp(B_hvi)
+
+def location_prob_fn(data):
+    '''Evaluate location probability P_hvi'''
+    hphi = _h_phi_exp_b(data) * data.m_idx
+    sum_by_h = hphi.sum(axis=0)
+    nonzero = sum_by_h != 0
+    data.P_hvi = np.zeros((data.n_h, data.n_vi))
+    data.P_hvi[:, nonzero] = hphi[:, nonzero] / sum_by_h[nonzero]
+
+def location_fn(data):
+    '''Evaluate location H_hvi'''
+    data.H_hvi = data.S_vi[None, :] * data.P_hvi
+
+def rents_fn(data):
+    '''Evaluate rents r_vi'''
+    data.r_vi = np.zeros(data.n_vi)
+    for row in data.rents_fn:
+        market = int(row[0]) - 1
+        if not 0 <= market < data.n_m:
+            continue
+        vixm = (data.vi_market == market + 1).astype(float)
+        data.r_mu_m[market] = row[2]
+
+        x = _pow(_rent_term(data, vixm, row[4], row[5]), row[6], vixm)
+        y = _pow(_rent_term(data, vixm, row[7], row[8]), row[9], vixm)
+        data.r_vi += row[3] * x * y
+
+    # Logsum component for vi active in a market with a mu definition
+    sum_by_m = (_h_phi_exp_b(data) * data.m_idx).sum(axis=0)
+    active = (data.vi_market >= 1) & (data.vi_market <= data.n_m)
+    mu = np.zeros(data.n_vi)
+    mu[active] = data.r_mu_m[data.vi_market[active] - 1]
+    active &= mu != 0
+    rent_logsum = np.zeros(data.n_vi)
+    rent_logsum[active] = np.log(sum_by_m[active]) / mu[active]
+
+    data.r_vi += rent_logsum + data.rents_adjustment_vector
+
+def _vi_records(data, values):
+    '''Build output records prefixed by real estate and zone'''
+    return OutputTable(np.column_stack((data.real_estate_matrix[:, 0:2], values)))
+
+def solve(input_data, outputs=None):
+    '''Run model over dict of MulandData returning dict of OutputTable
+
+    outputs lists the output files to be returned, defaulting to all.
+    Steps whose results aren't needed by them are skipped.
+    '''
+    if outputs is None:
+        outputs = ['bids', 'bh', 'location', 'location_probability', 'rents']
+
+    with np.errstate(all='ignore'):
+        data = LandData(input_data)
+        bid_fn(data)
+        if 'location' in outputs or 'location_probability' in outputs:
+            location_prob_fn(data)
+        if 'location' in outputs:
+            location_fn(data)
+        if 'rents' in outputs:
+            rents_fn(data)
+
+    output_data = {}
+    for name in outputs:
+        if name == 'bh':
+            bh = np.column_stack((data.agents_matrix[:, 0], data.b_h))
+            output_data['bh'] = OutputTable(bh)
+        elif name == 'bids':
+            output_data['bids'] = _vi_records(data, data.b_hvi.T)
+        elif name == 'location':
+            output_data['location'] = _vi_records(data, data.H_hvi.T)
+        elif name == 'location_probability':
+            output_data['location_probability'] = _vi_records(data, data.P_hvi.T)
+        elif name == 'rents':
+            output_data['rents'] = _vi_records(data, data.r_vi)
+    return output_data
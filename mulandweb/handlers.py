@@ -3,98 +3,218 @@
 # pylint: disable=invalid-name,
 '''Provides request handlers for MulandWeb'''
 
-import re
 import json
-import codecs
 import bottle
 
-from .muland import Muland, MulandRunError
-from .mulanddb import MulandDB, ModelNotFound
-from . import xmlparser
+from .muland import MulandRunError
+from .mulanddb import MulandDB
+from .cache import unit_cache, result_store
+from .scheduler import QueueFull, scheduler
+from .jobs import job_manager
+from . import partition, parallel
+from . import xmlparser, jsonstream, protocol
+from . import config
 from . import app
 
-__all__ = ['post_handler']
+__all__ = ['post_handler', 'post_job_handler', 'get_job_handler',
+           'post_batch_handler']
 
-_model_re = re.compile('[a-z]')
-_utf8reader = codecs.getreader('utf-8')
+def _read_locations():
+    '''Read and validate location list from request
+
+    Returns tuple (locations, output_mime), where locations is either a
+    list of locations or LocationColumns, when given as 'columns' or XML.
+    '''
+    # Extract data acoording to Content-Type
+    output_mime = protocol.output_mime(bottle.request.headers['Content-Type']) # pylint: disable=unsubscriptable-object
+    if output_mime == 'xml':
+        return protocol.read_xml(bottle.request.body), output_mime
+
+    return protocol.check_data(bottle.request.json), output_mime
+
+def _read_outputs():
+    '''Read output files requested at the query string, None for all'''
+    return protocol.parse_outputs(bottle.request.query.get('outputs')) # pylint: disable=no-member
+
+def _get_body(mudb, key, output_mime, outputs, timeout=None):
+    '''Return response body chunks from result store or running Mu-Land
+
+    Mu-Land runs before returning, but the output is serialized as the
+    chunks are consumed.
+    '''
+    body = result_store.get(key)
+    if body is not None:
+        return [body]
+
+    # Run Mu-Land for units not in cache
+    output_data = unit_cache.run(mudb, timeout, outputs)
+
+    if output_mime == 'json':
+        chunks = jsonstream.iterdumps(output_data)
+    elif output_mime == 'xml':
+        chunks = xmlparser.iterdump(output_data)
+    return result_store.put_iter(key, chunks)
 
 @app.post('/<model>')
-def post_handler(model): # pylint: disable=too-many-branches,too-many-statements
+def post_handler(model):
     '''Handles POST requests to server'''
     # Validate model name
-    if _model_re.match(model) is None:
+    if protocol.model_re.match(model) is None:
         raise bottle.HTTPError(404)
 
-    # Extract data acoording to Content-Type
-    ctype = bottle.request.headers['Content-Type'].lower() # pylint: disable=unsubscriptable-object
-    mime = ctype.split(';')[0]
-    if mime == 'application/json':
-        data_in = bottle.request.json
-        output_mime = 'json'
-    elif mime == 'application/xml' or mime == 'text/xml':
-        if 'charset=utf-8' not in ctype:
-            raise bottle.HTTPError(400, 'Specify charset=utf-8 for '
-                                        'for this MIME type.')
-        loc = xmlparser.load(_utf8reader(bottle.request.body))
-        data_in = {'loc': loc} # pylint: disable=redefined-variable-type
-        output_mime = 'xml'
-    else:
-        raise bottle.HTTPError(400, 'Invalid Content-Type')
+    locations, output_mime = _read_locations()
+    outputs = _read_outputs()
+    mudb = protocol.get_mudb(model, locations)
 
-    # Prepare data
-    if data_in is None:
-        raise bottle.HTTPError(400, 'No input data.')
+    # Answer from result store when possible
+    key = protocol.result_key(model, mudb, locations, output_mime, outputs)
+    etag = '"%s"' % key
+    if protocol.etag_matches(bottle.request.headers.get('If-None-Match'), etag):
+        return bottle.HTTPResponse(status=304, ETag=etag)
 
-    if not isinstance(data_in, dict):
-        raise bottle.HTTPError(400, 'Input data isn\'t an object.')
+    try:
+        body = _get_body(mudb, key, output_mime, outputs)
+    except QueueFull as e:
+        raise _queue_full_error(e)
+    except MulandRunError as e:
+        raise bottle.HTTPError(500, exception=e)
 
-    if 'loc' not in data_in:
-        raise bottle.HTTPError(400, "'loc' is not present at input data.")
+    # Send response
+    bottle.response.headers['Content-Type'] = protocol.content_types[output_mime]
+    bottle.response.headers['ETag'] = etag
+    return body
+
+def _queue_full_error(error):
+    '''Return 429 error for QueueFull, telling when to retry'''
+    return bottle.HTTPError(429, str(error),
+                            **{'Retry-After': str(error.retry_after)})
+
+def _run_job(model, locations, output_mime, outputs):
+    '''Return response body for a background job'''
+    mudb = MulandDB(model, locations)
+    key = protocol.result_key(model, mudb, locations, output_mime, outputs)
+    return b''.join(_get_body(mudb, key, output_mime, outputs,
+                              config.mulandweb_job_timeout))
+
+@app.post('/<model>/jobs')
+def post_job_handler(model):
+    '''Handles POST requests creating background jobs'''
+    # Validate model name
+    if protocol.model_re.match(model) is None:
+        raise bottle.HTTPError(404)
 
-    locations = data_in['loc']
-    if not isinstance(locations, list):
-        raise bottle.HTTPError(400, "'loc' isn't an array")
+    locations, output_mime = _read_locations()
+    outputs = _read_outputs()
+    job_id = job_manager.submit(_run_job, model, locations, output_mime,
+                                outputs, info={'format': output_mime})
+
+    bottle.response.status = 202
+    bottle.response.headers['Content-Type'] = 'application/json'
+    bottle.response.headers['Location'] = '/jobs/%s' % job_id
+    return json.dumps({'id': job_id, 'status': 'queued'})
+
+@app.get('/jobs/<job_id>')
+def get_job_handler(job_id):
+    '''Handles GET requests for status and results of jobs'''
+    status = job_manager.status(job_id)
+    if status is None:
+        raise bottle.HTTPError(404)
 
-    for loc in locations:
-        if 'lnglat' not in loc:
-            raise bottle.HTTPError(400, "'lnglat' not in 'loc' items")
+    if status['status'] != 'done':
+        bottle.response.headers['Content-Type'] = 'application/json'
+        return json.dumps({key: status[key] for key in ['id', 'status', 'error']
+                           if key in status})
 
-        lnglat = loc['lnglat']
-        if not isinstance(lnglat, list) or len(lnglat) != 2:
-            raise bottle.HTTPError(400, "'lnglat' isn't array with 2 elements")
+    body = job_manager.result(job_id)
+    if body is None:
+        raise bottle.HTTPError(404)
+    bottle.response.headers['Content-Type'] = protocol.content_types[status['format']]
+    return body
 
-        if not all((isinstance(x, (int, float)) for x in lnglat)):
-            raise bottle.HTTPError(400, "lng or lat not a number")
+def _read_scenarios():
+    '''Read and validate scenario list from batch request
 
-        if 'units' not in loc:
-            raise bottle.HTTPError(400, "'units' not in 'loc' items")
-        units = loc['units']
-        if not isinstance(units, list):
-            raise bottle.HTTPError(400, "'units' isn't an array")
+    Returns tuple (names, scenarios), where scenarios holds the location
+    list of each scenario.
+    '''
+    ctype = bottle.request.headers['Content-Type'].lower() # pylint: disable=unsubscriptable-object
+    if ctype.split(';')[0] != 'application/json':
+        raise bottle.HTTPError(400, 'Invalid Content-Type')
 
-        for unit in units:
-            if 'type' not in unit:
-                raise bottle.HTTPError(400, "'type' not in unit")
-            if not isinstance(unit['type'], (int, float)):
-                raise bottle.HTTPError(400, "'type' isn't a number")
+    data_in = bottle.request.json
+    if not isinstance(data_in, dict):
+        raise bottle.HTTPError(400, 'Input data isn\'t an object.')
 
-    # Get data from MulandDB
+    if 'scenarios' not in data_in:
+        raise bottle.HTTPError(400, "'scenarios' is not present at input data.")
+
+    items = data_in['scenarios']
+    if not isinstance(items, list):
+        raise bottle.HTTPError(400, "'scenarios' isn't an array")
+
+    names = []
+    scenarios = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or 'loc' not in item:
+            raise bottle.HTTPError(400, "'loc' not in 'scenarios' items")
+        name = item.get('name', str(index))
+        if not isinstance(name, str):
+            raise bottle.HTTPError(400, "'name' isn't a string")
+        if name in names:
+            raise bottle.HTTPError(400, "repeated scenario name '%s'" % name)
+        protocol.check_locations(item['loc'])
+        names.append(name)
+        scenarios.append(item['loc'])
+
+    return names, scenarios
+
+def _run_batch(mudb, scenarios, outputs):
+    '''Run Mu-Land for each scenario concurrently
+
+    mudb holds the locations of all scenarios, so database lookups are
+    shared. Its data is split by scenario, numbering zones as if each
+    scenario was requested alone. The batch is admitted by the scheduler
+    with a slot per process solving it, raising QueueFull if shed.
+    '''
+    input_data = mudb.get()
+
+    inputs = []
+    offset = 0
+    for locations in scenarios:
+        i_map = {offset + i_idx: i_idx
+                 for i_idx in range(1, len(locations) + 1)}
+        inputs.append(partition.select(input_data, i_map))
+        offset += len(locations)
+
+    costs = [scheduler.estimate(data) for data in inputs]
+    timeout = max((scheduler.timeout(cost) for cost in costs), default=None)
+    slots = scheduler.acquire(sum(costs), slots=min(len(inputs),
+                                                    config.mulandweb_batch_workers))
     try:
-        mudata = MulandDB(model, locations).get()
-    except ModelNotFound:
+        return parallel.run_many(inputs, timeout, outputs,
+                                 static_key=(mudb.model, mudb.models_version))
+    finally:
+        scheduler.release(slots)
+
+@app.post('/<model>/batch')
+def post_batch_handler(model):
+    '''Handles POST requests with several scenarios'''
+    # Validate model name
+    if protocol.model_re.match(model) is None:
         raise bottle.HTTPError(404)
 
-    # Run Mu-Land
-    mu = Muland(**mudata)
+    names, scenarios = _read_scenarios()
+    outputs = _read_outputs()
+    mudb = protocol.get_mudb(model, [loc for locations in scenarios
+                             for loc in locations])
+
     try:
-        mu.run()
+        results = _run_batch(mudb, scenarios, outputs)
+    except QueueFull as e:
+        raise _queue_full_error(e)
     except MulandRunError as e:
         raise bottle.HTTPError(500, exception=e)
 
     # Send response
-    if output_mime == 'json':
-        bottle.response.headers['Content-Type'] = 'application/json'
-        return json.dumps(mu.output_data)
-    elif output_mime == 'xml':
-        bottle.response.headers['Content-Type'] = 'application/xml; charset=utf-8'
-        return xmlparser.dumps(mu.output_data)
+    bottle.response.headers['Content-Type'] = protocol.content_types['json']
+    return jsonstream.iterdumps(dict(zip(names, results)))
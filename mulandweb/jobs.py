@@ -0,0 +1,117 @@
+# coding: utf-8
+'''Provides background execution of MulandWeb requests'''
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from threading import Lock
+from uuid import uuid4
+import os, re, time, json, tempfile
+
+from . import config
+
+__all__ = ['JobManager', 'job_manager']
+
+class JobManager:
+    '''Runs jobs on a bounded worker pool, keeping their results on disk
+
+    Job status and results are kept as files, so they can be read by any
+    worker process serving the application. They are removed ttl seconds
+    after the job's last update.
+    '''
+    _id_re = re.compile('^[0-9a-f]{32}$')
+    _cleanup_interval = 60
+
+    def __init__(self, path=config.mulandweb_jobs_path,
+                 workers=config.mulandweb_job_workers,
+                 ttl=config.mulandweb_job_ttl):
+        '''Initialize manager storing jobs at path'''
+        self.path = path
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._last_cleanup = 0
+        self._lock = Lock()
+
+    def _filename(self, job_id, suffix):
+        '''Return path of job file'''
+        return str(Path(self.path, job_id + suffix))
+
+    def _write(self, filename, data):
+        '''Write file atomically'''
+        with tempfile.NamedTemporaryFile(dir=self.path, prefix='.',
+                                         delete=False) as file:
+            file.write(data)
+        os.replace(file.name, filename)
+
+    def _set_status(self, job_id, status, **kwargs):
+        '''Write job status'''
+        kwargs.update({'id': job_id, 'status': status, 'updated': time.time()})
+        self._write(self._filename(job_id, '.json'),
+                    json.dumps(kwargs).encode('utf-8'))
+
+    def submit(self, fn, *args, **kwargs):
+        '''Schedule fn(*args, **kwargs) and return job id
+
+        fn must return the result as bytes. Extra job information may be
+        given with the info keyword, a dict stored with the job's status.
+        '''
+        os.makedirs(self.path, exist_ok=True)
+        self.cleanup()
+
+        info = kwargs.pop('info', {})
+        job_id = uuid4().hex
+        self._set_status(job_id, 'queued', **info)
+        self._executor.submit(self._run, job_id, info, fn, args, kwargs)
+        return job_id
+
+    def _run(self, job_id, info, fn, args, kwargs):
+        '''Run job, recording its status and result'''
+        # pylint: disable=broad-except,too-many-arguments
+        self._set_status(job_id, 'running', **info)
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            self._set_status(job_id, 'failed', error=str(e) or repr(e), **info)
+            return
+        self._write(self._filename(job_id, '.out'), result)
+        self._set_status(job_id, 'done', **info)
+
+    def status(self, job_id):
+        '''Return status dict of job or None if it doesn't exist'''
+        if self._id_re.match(job_id) is None:
+            return None
+        try:
+            with open(self._filename(job_id, '.json')) as file:
+                status = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if status['updated'] + self.ttl < time.time():
+            return None
+        return status
+
+    def result(self, job_id):
+        '''Return result of a finished job or None'''
+        if self._id_re.match(job_id) is None:
+            return None
+        try:
+            with open(self._filename(job_id, '.out'), 'rb') as file:
+                return file.read()
+        except OSError:
+            return None
+
+    def cleanup(self):
+        '''Remove files of expired jobs'''
+        now = time.time()
+        with self._lock:
+            if self._last_cleanup + self._cleanup_interval > now:
+                return
+            self._last_cleanup = now
+
+        for entry in os.scandir(self.path):
+            try:
+                expired = entry.stat().st_mtime + self.ttl < now
+                if expired:
+                    os.remove(entry.path)
+            except OSError:
+                continue
+
+job_manager = JobManager()
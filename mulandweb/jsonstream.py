@@ -0,0 +1,52 @@
+# coding: utf-8
+'''Provides streaming JSON serialization of Muland output data'''
+
+import json
+
+from .output import OutputTable
+
+__all__ = ['iterdumps']
+
+_encode = json.JSONEncoder().encode
+
+def _is_records(value):
+    '''Check whether value is an OutputTable or non-empty list of records'''
+    return isinstance(value, OutputTable) or (
+        isinstance(value, (list, tuple)) and len(value) > 0 and
+        isinstance(value[0], (list, tuple)))
+
+def _iterencode(value, rows):
+    '''Yield JSON pieces of value, encoding records rows at a time'''
+    if isinstance(value, dict):
+        yield '{'
+        for index, (key, item) in enumerate(value.items()):
+            yield '%s%s: ' % (', ' if index else '', _encode(str(key)))
+            yield from _iterencode(item, rows)
+        yield '}'
+    elif _is_records(value):
+        yield '['
+        for start in range(0, len(value), rows):
+            # Strip brackets of the encoded slice
+            yield (', ' if start else '') + _encode(list(value[start:start + rows]))[1:-1]
+        yield ']'
+    else:
+        yield _encode(value)
+
+def iterdumps(data, chunk_size=64 * 1024, rows=1000):
+    '''Serialize data as JSON, yielding UTF-8 chunks of about chunk_size bytes
+
+    data is Muland output data, or a dict of them. The concatenated chunks
+    equal json.dumps(data), but only about rows records are encoded at
+    once.
+    '''
+    pieces = []
+    size = 0
+    for piece in _iterencode(data, rows):
+        pieces.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield ''.join(pieces).encode('utf-8')
+            pieces = []
+            size = 0
+    if pieces:
+        yield ''.join(pieces).encode('utf-8')
@@ -3,11 +3,18 @@
 
 from collections import namedtuple
 from pathlib import Path
-import os, tempfile, subprocess
-import csv
+import os, io, csv, subprocess, asyncio
+import itertools
+import logging
 
+import numpy as np
+
+from .workspace import workspaces
+from .output import MulandOutput
 from . import config
 
+_log = logging.getLogger(__name__)
+
 class MulandException(Exception):
     pass
 
@@ -24,6 +31,16 @@ class Muland:
 
     muland_binary = config.muland_binary
     work_folder = config.muland_work
+    engine = config.muland_engine
+    timeout = config.muland_timeout
+    shard_size = config.muland_shard_size
+    datafile_format = config.muland_datafile_format
+
+    engines = ['binary', 'numpy']
+    datafile_formats = ['csv', 'bin']
+
+    # Input files that depend only on the model
+    static_files = ['agents', 'bids_functions', 'demand', 'rent_functions']
 
     input_files = ['agents', 'agents_zones', 'bids_adjustments',
     'bids_functions', 'demand', 'demand_exogenous_cutoff',
@@ -33,7 +50,18 @@ class Muland:
     output_files = ['bids', 'bh', 'location', 'location_probability',
     'rents']
 
+    # Output files with one record per real estate (V_IDX, I_IDX)
+    vi_output_files = ['bids', 'location', 'location_probability', 'rents']
+
+    # Engines whose results for a real estate don't depend on the other
+    # real estates of the run, so runs may be split, merged or cached by
+    # unit. Both look zone values up by I_IDX, and mu-land as shipped at
+    # muLand/ does so since FixDimensions matches real estates by I_IDX;
+    # older mu-land builds spread them by position and aren't separable.
+    separable_engines = ['binary', 'numpy']
+
     csv_delimiter = ';'
+    csv_block_size = 4096 # records formatted at once
 
     # Check if muland binary and work folder are in place
     if not os.access(work_folder, os.R_OK & os.W_OK):
@@ -41,13 +69,33 @@ class Muland:
             raise DependencyError('Could not access work folder.')
         os.mkdir(work_folder)
 
-    if not os.access(muland_binary, os.X_OK):
+    if engine == 'binary' and not os.access(muland_binary, os.X_OK):
         raise DependencyError('Could not find muland binary.')
 
-    def __init__(self, **kwargs):
-        '''Initialize Muland'''
+    if datafile_format not in datafile_formats:
+        raise DependencyError('Unknown datafile format.')
+
+    def __init__(self, engine=None, outputs=None, static_key=None, **kwargs):
+        '''Initialize Muland
+
+        outputs lists the output files to be produced, defaulting to all.
+        static_key identifies the data of static_files, like a model and its
+        version, so their files can be written once and shared by runs.
+        '''
         input_files = self.input_files
 
+        if engine is not None:
+            if engine not in self.engines:
+                raise ValueError("unknown engine: '%s'" % engine)
+            self.engine = engine
+
+        if outputs is None:
+            outputs = self.output_files
+        for name in outputs:
+            if name not in self.output_files:
+                raise ValueError("unknown output: '%s'" % name)
+        self.outputs = [name for name in self.output_files if name in outputs]
+
         for file in input_files:
             if file not in kwargs:
                 raise TypeError("missing required argument: '%s'" % file)
@@ -55,7 +103,9 @@ class Muland:
                 raise TypeError("argument '%s' must be of type MulandData" % file)
 
         # Set instance attributes
-        self.output_data = {}
+        self.static_key = static_key
+        self._shards = None
+        self.output_data = MulandOutput()
         self.input_data = {key: value for key, value in kwargs.items()
                                       if key in input_files}
 
@@ -67,66 +117,288 @@ class Muland:
             pass
         raise AttributeError('No attribute or output data named \'%s\'' % name)
 
+    def _write_csv(self, filename, data):
+        '''Write MulandData as a CSV file
+
+        Output matches csv.writer with QUOTE_NONNUMERIC. Blocks of records
+        of equal length holding only ints and floats are formatted at once,
+        others are written by csv.writer. Records may be a NumPy array.
+        '''
+        delimiter = self.csv_delimiter
+        records = data.records
+        if isinstance(records, np.ndarray):
+            records = records.tolist()
+
+        with open(filename, 'w') as file:
+            writer = csv.writer(file, delimiter=delimiter,
+                                quoting=csv.QUOTE_NONNUMERIC)
+            writer.writerow(data.header)
+            for start in range(0, len(records), self.csv_block_size):
+                block = records[start:start + self.csv_block_size]
+                lengths = set(map(len, block))
+                values = tuple(itertools.chain.from_iterable(block))
+                if len(lengths) == 1 and set(map(type, values)) <= {int, float}:
+                    row_format = delimiter.join(['%s'] * lengths.pop()) + '\r\n'
+                    file.write((row_format * len(block)) % values)
+                else:
+                    writer.writerows(block)
+
+    @classmethod
+    def _read_csv(cls, filename):
+        '''Read numeric CSV file written by Muland into an array
+
+        The header line is skipped, giving its number of columns.
+        '''
+        with open(filename) as file:
+            header = file.readline()
+            text = file.read()
+        columns = header.count(cls.csv_delimiter) + 1
+        if not text.strip():
+            return np.empty((0, columns))
+        try:
+            values = np.loadtxt(io.StringIO(text), delimiter=cls.csv_delimiter,
+                                ndmin=2)
+        except ValueError as e:
+            raise MulandRunError('Malformed Mu-Land output %s: %s' % (filename, e))
+        if values.size % columns:
+            raise MulandRunError('Malformed Mu-Land output %s: %d values for '
+                                 '%d columns' % (filename, values.size, columns))
+        return values.reshape(-1, columns)
+
+    @staticmethod
+    def _write_bin(filename, data):
+        '''Write MulandData as a binary file
+
+        The file holds the number of rows and columns as little-endian
+        uint64, followed by the records as little-endian float64.
+        '''
+        records = np.asarray(data.records, dtype='<f8')
+        records = records.reshape(len(records), len(data.header))
+        with open(filename, 'wb') as file:
+            file.write(np.array(records.shape, dtype='<u8').tobytes())
+            file.write(records.tobytes())
+
+    @staticmethod
+    def _read_bin(filename):
+        '''Map binary file written by Muland into an array'''
+        rows, columns = np.fromfile(filename, dtype='<u8', count=2)
+        if not rows or not columns:
+            return np.empty((int(rows), int(columns)))
+        return np.memmap(filename, dtype='<f8', mode='r', offset=16,
+                         shape=(int(rows), int(columns)))
+
+    def _write_datafile(self, filename, data):
+        '''Write MulandData in datafile_format, filename lacking extension'''
+        if self.datafile_format == 'bin':
+            self._write_bin(filename + '.bin', data)
+        else:
+            self._write_csv(filename + '.csv', data)
+
     def _populate_working_dir(self, working_dir):
-        '''Prepares data for Muland reading'''
-        # Create input and output directories
-        os.mkdir(str(Path(working_dir, 'input')))
-        os.mkdir(str(Path(working_dir, 'output')))
+        '''Prepares data for Muland reading
+
+        working_dir must hold empty input and output directories.
+        '''
+        input_data = self.input_data
+
+        # Link static files, written once per static key and format
+        if self.static_key is not None:
+            static_dir = workspaces.static_dir(
+                (self.static_key, self.datafile_format),
+                {key: input_data[key] for key in self.static_files},
+                self._write_datafile)
+            extension = '.' + self.datafile_format
+            for key in self.static_files:
+                os.link(str(Path(static_dir, key + extension)),
+                        str(Path(working_dir, 'input', key + extension)))
+            input_data = {key: value for key, value in input_data.items()
+                          if key not in self.static_files}
 
         # Create files sent by user
-        for key, value in self.input_data.items():
-            header = value.header
-            records = value.records
-            filename = str(Path(working_dir, 'input', key + '.csv'))
+        for key, value in input_data.items():
+            self._write_datafile(str(Path(working_dir, 'input', key)), value)
+
+        # Select outputs to be written
+        if self.outputs != self.output_files:
+            filename = str(Path(working_dir, 'input', 'outputs.txt'))
             with open(filename, 'w') as file:
-                writer = csv.writer(file, delimiter=self.csv_delimiter,
-                                    quoting=csv.QUOTE_NONNUMERIC)
-                writer.writerow(header)
-                for row in records:
-                    writer.writerow(row)
+                file.write(''.join(name + '\n' for name in self.outputs))
 
-    def _run_muland(self, working_dir, timeout=2):
+    def _run_muland(self, working_dir, timeout):
         '''Run Muland on working dir'''
         with subprocess.Popen([self.muland_binary, working_dir],
                               stdout=subprocess.PIPE,
                               stderr=subprocess.PIPE) as process:
+            # pylint: disable=broad-except
             try:
                 stdout, stderr = process.communicate(None, timeout=timeout)
-                if stdout.find(b'Algorithm ended sucessfully') is -1:
-                    print(stdout.decode('ascii'))
-                    print(stderr.decode('ascii'))
-                    raise MulandRunError('Mu-Land finished without success message')
             except subprocess.TimeoutExpired:
                 process.kill()
-                stdout, stderr = process.communicate()
+                process.communicate()
                 raise MulandRunError('Mu-Land proccess timeout.')
-            except:
+            except Exception:
                 process.kill()
                 process.wait()
                 raise MulandRunError('Unknown error running Mu-Land')
 
+        if stdout.find(b'Algorithm ended sucessfully') == -1:
+            _log.error('Mu-Land failed at %s\nstdout:\n%s\nstderr:\n%s',
+                       working_dir, stdout.decode('ascii', 'replace'),
+                       stderr.decode('ascii', 'replace'))
+            raise MulandRunError('Mu-Land finished without success message')
+
+    async def _run_muland_async(self, working_dir, timeout):
+        '''Run Muland on working dir as an asyncio subprocess
+
+        The process is killed on timeout or when the task is cancelled.
+        '''
+        process = await asyncio.create_subprocess_exec(
+            self.muland_binary, working_dir,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(),
+                                                    timeout)
+        except asyncio.TimeoutError:
+            raise MulandRunError('Mu-Land proccess timeout.')
+        finally:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+
+        if stdout.find(b'Algorithm ended sucessfully') == -1:
+            _log.error('Mu-Land failed at %s\nstdout:\n%s\nstderr:\n%s',
+                       working_dir, stdout.decode('ascii', 'replace'),
+                       stderr.decode('ascii', 'replace'))
+            raise MulandRunError('Mu-Land finished without success message')
+
     def _collect_data(self, working_dir):
-        '''Collects data generated by Muland'''
-        for name in self.output_files:
-            output_data = []
-            fullname = str(Path(working_dir, 'output', name + '.csv'))
-            with open(fullname) as file:
-                next(file)
-                reader = csv.reader(file, delimiter=self.csv_delimiter,
-                                    quoting=csv.QUOTE_NONNUMERIC)
-                for row in reader:
-                    output_data.append(tuple(row))
-            self.output_data[name] = output_data
-
-    def run(self):
-        '''Runs Muland'''
-        # Create/destroy data directory
-        with tempfile.TemporaryDirectory(dir = self.work_folder) as working_dir:
+        '''Collects data generated by Muland
+
+        Output files are moved out of working_dir, and parsed as they are
+        accessed.
+        '''
+        reader = self._read_bin if self.datafile_format == 'bin' else self._read_csv
+        self.output_data.update(MulandOutput.from_directory(
+            workspaces.keep_output(working_dir),
+            {name: name + '.' + self.datafile_format for name in self.outputs},
+            reader))
+
+    def _run_engine(self):
+        '''Run Muland model in-process'''
+        from . import engine
+        try:
+            self.output_data.update(engine.solve(self.input_data, self.outputs))
+        except (ValueError, IndexError) as e:
+            raise MulandRunError('Error solving Mu-Land model: %s' % e)
+
+    @property
+    def shards(self):
+        '''Shards of input data solved in parallel by run, as (data, zones)
+
+        Runs are sharded by zones when they have more than shard_size real
+        estates and engine is in separable_engines, which holds both
+        engines when mu-land is built from this repository. Empty when not
+        sharded.
+        '''
+        if self._shards is None:
+            self._shards = []
+            n_vi = len(self.input_data['real_estates_zones'].records)
+            if self.engine in self.separable_engines and 0 < self.shard_size < n_vi:
+                from . import partition
+                shards = partition.shard(self.input_data, self.shard_size)
+                if len(shards) > 1:
+                    self._shards = shards
+        return self._shards
+
+    @property
+    def processes(self):
+        '''Number of solver processes run at once by run'''
+        return min(len(self.shards), config.mulandweb_batch_workers) or 1
+
+    def _run_sharded(self, timeout):
+        '''Run Muland over shards of zones in parallel'''
+        from . import partition, parallel
+        shards = self.shards
+        results = parallel.run_many([data for data, _ in shards], timeout,
+                                    self.outputs, self.engine, self.static_key)
+        self.output_data.update(
+            partition.unshard(results, [zones for _, zones in shards]))
+
+    def run(self, timeout=None):
+        '''Runs Muland
+
+        timeout is given in seconds and defaults to Muland.timeout. It does
+        not apply to the numpy engine. Data may be split into shards solved
+        in parallel, see shards.
+        '''
+        if timeout is None:
+            timeout = self.timeout
+
+        if self.shards:
+            self._run_sharded(timeout)
+            return
+
+        if self.engine == 'numpy':
+            self._run_engine()
+            return
+
+        # Acquire/release data directory
+        working_dir = workspaces.acquire()
+        try:
             # Prepare directory
             self._populate_working_dir(working_dir)
 
             # Run Muland
-            self._run_muland(working_dir)
+            self._run_muland(working_dir, timeout)
 
             # Collect data
             self._collect_data(working_dir)
+        finally:
+            workspaces.release(working_dir)
+
+    async def run_async(self, timeout=None):
+        '''Runs Muland without blocking the event loop
+
+        Like run, but muland_binary runs as an asyncio subprocess, which is
+        killed if the task is cancelled. File I/O, the numpy engine and
+        sharded runs are done at the loop's default executor.
+        '''
+        if timeout is None:
+            timeout = self.timeout
+        loop = asyncio.get_event_loop()
+
+        if await loop.run_in_executor(None, lambda: self.shards):
+            await loop.run_in_executor(None, self._run_sharded, timeout)
+            return
+
+        if self.engine == 'numpy':
+            await loop.run_in_executor(None, self._run_engine)
+            return
+
+        # Acquire/release data directory
+        working_dir = await loop.run_in_executor(None, workspaces.acquire)
+        try:
+            # Prepare directory
+            await _finish_in_executor(loop, self._populate_working_dir,
+                                      working_dir)
+
+            # Run Muland
+            await self._run_muland_async(working_dir, timeout)
+
+            # Collect data
+            await _finish_in_executor(loop, self._collect_data, working_dir)
+        finally:
+            workspaces.release(working_dir)
+
+async def _finish_in_executor(loop, func, *args):
+    '''Run func at the loop's default executor, even if the task is cancelled
+
+    Cancellation is raised once func is done, so the working directory it
+    uses isn't released while it still writes there.
+    '''
+    future = loop.run_in_executor(None, func, *args)
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        await asyncio.wait([future])
+        raise
@@ -2,18 +2,33 @@
 # pylint: disable=invalid-name,bad-continuation,line-too-long
 '''Implements MulandWeb\'s database access interfaces'''
 
+import io
 import csv
+import copy
+import time
+import hashlib
+import logging
 from itertools import zip_longest
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
 import shapefile
+import shapely
 from sqlalchemy import select, func, and_, text
 from shapely.geometry import Polygon
 
-from .muland import MulandData
+from .muland import Muland, MulandData
+from .output import OutputTable, MulandOutput, table_array
+from .zoneindex import ZoneIndex
 from . import db
+from . import config
 
 
-__all__ = ['MulandDB', 'MulandDBException', 'ModelNotFound', 'ModelImporter']
+__all__ = ['MulandDB', 'LocationColumns', 'MulandDBException', 'ModelNotFound',
+           'ModelCache', 'model_cache', 'ModelImporter']
+
+_log = logging.getLogger(__name__)
 
 class MulandDBException(Exception):
     '''Base Exception class for MulandDB'''
@@ -22,197 +37,583 @@ class ModelNotFound(MulandDBException):
     '''Model was not found at the database'''
     pass
 
+def _find_refs(refs, wanted):
+    '''Return row of refs holding each (V_IDX, I_IDX) of wanted, -1 if none'''
+    if not len(refs) or not len(wanted):
+        return np.full(len(wanted), -1, dtype=int)
+    refs = refs.astype(np.int64)
+    wanted = wanted.astype(np.int64)
+    span = int(max(refs[:, 0].max(), wanted[:, 0].max())) + 1
+    keys = refs[:, 1] * span + refs[:, 0]
+    wanted_keys = wanted[:, 1] * span + wanted[:, 0]
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    index = np.searchsorted(sorted_keys, wanted_keys).clip(0, len(keys) - 1)
+    return np.where(sorted_keys[index] == wanted_keys, order[index], -1)
+
+class LocationColumns:
+    '''Holds locations and units of a request as NumPy arrays
+
+    Locations are given by lng and lat, units by the index of their
+    location and their type. Overrides map upper case column names to
+    float arrays by location or by unit, holding NaN where the column isn't
+    overridden.
+    '''
+    # pylint: disable=too-many-arguments,too-few-public-methods
+    def __init__(self, lng, lat, location_overrides, unit_location, unit_type,
+                 unit_overrides):
+        '''Initialize columns'''
+        self.lng = lng
+        self.lat = lat
+        self.location_overrides = location_overrides
+        self.unit_location = unit_location
+        self.unit_type = unit_type
+        self.unit_overrides = unit_overrides
+        self._merged_overrides = None
+
+    @classmethod
+    def from_list(cls, locations):
+        '''Build columns from a list or iterator of location dicts'''
+        lng = []
+        lat = []
+        unit_location = []
+        unit_type = []
+        location_overrides = {}
+        unit_overrides = {}
+        for location_id, loc in enumerate(locations):
+            lng.append(loc['lnglat'][0])
+            lat.append(loc['lnglat'][1])
+            for key, value in loc.items():
+                if key in ['lnglat', 'units'] or not isinstance(value, (int, float)):
+                    continue
+                location_overrides.setdefault(key.upper(), {})[location_id] = value
+
+            for unit in loc['units']:
+                unit_id = len(unit_type)
+                unit_location.append(location_id)
+                unit_type.append(unit['type'])
+                for key, value in unit.items():
+                    if key == 'type' or not isinstance(value, (int, float)):
+                        continue
+                    unit_overrides.setdefault(key.upper(), {})[unit_id] = value
+
+        n_locations = len(lng)
+        n_units = len(unit_type)
+        return cls(np.array(lng, dtype=float),
+                   np.array(lat, dtype=float),
+                   {key: _sparse_column(values, n_locations)
+                    for key, values in location_overrides.items()},
+                   np.array(unit_location, dtype=int),
+                   np.array(unit_type, dtype=float),
+                   {key: _sparse_column(values, n_units)
+                    for key, values in unit_overrides.items()})
+
+    @classmethod
+    def from_columns(cls, columns):
+        '''Build columns from a dict of arrays, as sent in requests
+
+        columns holds arrays 'lng' and 'lat' by location, 'location' and
+        'type' by unit, and optionally objects 'location_overrides' and
+        'unit_overrides' mapping column names to arrays, where null means
+        the column isn't overridden. Raises ValueError on invalid columns.
+        '''
+        if not isinstance(columns, dict):
+            raise ValueError("'columns' isn't an object")
+
+        lng = _float_column(columns, 'lng')
+        lat = _float_column(columns, 'lat')
+        location = _float_column(columns, 'location')
+        unit_type = _float_column(columns, 'type')
+        if lng.shape != lat.shape:
+            raise ValueError("'lng' and 'lat' differ in length")
+        if location.shape != unit_type.shape:
+            raise ValueError("'location' and 'type' differ in length")
+        if not (np.isfinite(lng).all() and np.isfinite(lat).all()):
+            raise ValueError("lng or lat not a number")
+        if not np.isfinite(unit_type).all():
+            raise ValueError("'type' isn't a number")
+        if (unit_type != np.floor(unit_type)).any():
+            raise ValueError("'type' isn't an integer")
+        if (location.size and
+                ((location != np.floor(location)).any() or
+                 location.min() < 0 or location.max() >= lng.size)):
+            raise ValueError("'location' isn't an index of 'lng' and 'lat'")
+
+        overrides = []
+        for name, size in [('location_overrides', lng.size),
+                           ('unit_overrides', unit_type.size)]:
+            items = columns.get(name, {})
+            if not isinstance(items, dict):
+                raise ValueError("'%s' isn't an object" % name)
+            values = {}
+            for key, value in items.items():
+                values[key.upper()] = _float_column(items, key, nullable=True)
+                if values[key.upper()].size != size:
+                    raise ValueError("'%s' of '%s' differs in length" %
+                                     (key, name))
+            overrides.append(values)
+
+        return cls(lng, lat, overrides[0], location.astype(int), unit_type,
+                   overrides[1])
+
+    def merged_overrides(self):
+        '''Return overrides by unit, including those of their locations'''
+        if self._merged_overrides is None:
+            merged = {key: values[self.unit_location]
+                      for key, values in self.location_overrides.items()}
+            for key, values in self.unit_overrides.items():
+                if key in merged:
+                    merged[key] = np.where(np.isnan(values), merged[key], values)
+                else:
+                    merged[key] = values
+            self._merged_overrides = merged
+        return self._merged_overrides
+
+    def digest(self):
+        '''Return hash of columns, equal for equal columns'''
+        h = hashlib.sha256()
+        for array in [self.lng, self.lat, self.unit_location, self.unit_type]:
+            _hash_array(h, np.asarray(array, dtype=float))
+        for overrides in [self.location_overrides, self.unit_overrides]:
+            h.update(repr(len(overrides)).encode('utf-8'))
+            for key in sorted(overrides):
+                h.update(key.encode('utf-8') + b'\0')
+                _hash_array(h, overrides[key])
+        return h.hexdigest()
+
+def _hash_array(h, array):
+    '''Update hash h with array, prefixed by its shape'''
+    h.update(repr(array.shape).encode('utf-8'))
+    h.update(np.ascontiguousarray(array).tobytes())
+
+def _sparse_column(values, size):
+    '''Build float array of size from dict of values by index'''
+    column = np.full(size, np.nan)
+    column[list(values.keys())] = list(values.values())
+    return column
+
+def _float_column(columns, name, nullable=False):
+    '''Return item of columns as a 1-dimensional float array
+
+    Items must be JSON numbers, or null if nullable, which becomes NaN.
+    '''
+    if name not in columns:
+        raise ValueError("'%s' is not present at columns" % name)
+    values = columns[name]
+    allowed = {int, float, type(None)} if nullable else {int, float}
+    if not isinstance(values, list) or not set(map(type, values)) <= allowed:
+        raise ValueError("'%s' isn't an array of numbers" % name)
+    return np.array(values, dtype=float)
+
+class ModelCache:
+    '''Process-local cache of the tables of models not depending on locations
+
+    Entries are keyed by model name and hold the named items of a single
+    model version, which ModelImporter stamps after importing, so imported
+    models are reloaded.
+    '''
+    def __init__(self):
+        '''Initialize cache'''
+        self._entries = {}
+        self._lock = Lock()
+
+    def get(self, model, version, name):
+        '''Return item name of model version or None'''
+        with self._lock:
+            entry = self._entries.get(model)
+        if entry is None or entry[0] != version:
+            return None
+        return entry[1].get(name)
+
+    def put(self, model, version, name, value):
+        '''Store item name of model version, dropping other versions'''
+        with self._lock:
+            entry = self._entries.get(model)
+            if entry is None or entry[0] != version:
+                entry = self._entries[model] = (version, {})
+            entry[1][name] = value
+
+    def clear(self):
+        '''Remove all entries'''
+        with self._lock:
+            self._entries.clear()
+
+model_cache = ModelCache()
+
+_fetch_executor = ThreadPoolExecutor(max_workers=max(config.mulandweb_db_fetch_connections, 1))
+
 class MulandDB:
-    '''Provides data retrival from Muland Database'''
-    # pylint: disable=too-few-public-methods
-    def __init__(self, model: str, locations: list):
-        '''Initialize class'''
+    '''Provides data retrival from Muland Database
+
+    Locations and units are identified by their index at the request, and
+    the attributes locations and units hold the indexes of those that are
+    sent to Muland.
+    '''
+    # pylint: disable=too-few-public-methods,too-many-instance-attributes
+    fetch_connections = config.mulandweb_db_fetch_connections
+
+    # Tables depending on locations and their methods, by whether they join
+    # request_units
+    _location_tables = {'agents_zones': '_get_agents_zones_records'}
+    _unit_tables = {
+        'bids_adjustments': '_get_bids_adjustments_records',
+        'demand_exogenous_cutoff': '_get_demand_exogenous_cutoff_records',
+        'real_estates_zones': '_get_real_estates_zones',
+        'rent_adjustments': '_get_rent_adjustments',
+        'subsidies': '_get_subsidies',
+        'supply': '_get_supply',
+    }
+
+    def __init__(self, model: str, locations):
+        '''Initialize class
+
+        locations is either a list of location dicts or LocationColumns.
+        '''
         assert isinstance(model, str)
 
+        if not isinstance(locations, LocationColumns):
+            locations = LocationColumns.from_list(locations)
+
         self.conn = db.engine.connect()
 
-        s = select([db.models.c.id]).where(db.models.c.name == model)
-        result = self.conn.execute(s)
-        row = result.fetchone()
-        result.close()
-        if result is None:
+        s = (select([db.models.c.id, db.models.c.version])
+            .where(db.models.c.name == text('$1')))
+        result = self._execute('model', ['varchar'], s, model)
+        if not result:
             raise ModelNotFound
+        row = result[0]
 
-        _units = []
-        _locations = []
-        for loc in locations:
-            assert isinstance(loc['lnglat'][0], (int, float))
-            assert isinstance(loc['lnglat'][1], (int, float))
-
-            loc_overrides = {key: value for key, value in loc.items()
-                             if key not in ['lnglat', 'units']}
-            _location = {'location_id': len(_locations),
-                         'lng': loc['lnglat'][0],
-                         'lat': loc['lnglat'][1],
-                         'overrides': loc_overrides}
-            _locations.append(_location)
-
-            for unit in loc['units']:
-                unit_overrides = {key: value for key, value in unit.items()
-                                  if key not in ['type']}
-                _unit = {'unit_id': len(_units),
-                         'location': _location,
-                         'types_id': unit['type'],
-                         'overrides': unit_overrides}
-                _units.append(_unit)
-
+        self.model = model
         self.models_id = row[0]
-        self.units = _units
-        self.locations = _locations
-
-    def _apply_overrides(self, data):
-        '''Override data from db with values provided by user'''
-        header = data.header
-        if 'I_IDX' not in header and 'V_IDX' not in header:
+        self.models_version = row[1]
+        self.columns = locations
+        self.locations = np.arange(locations.lng.size)
+        self.units = np.arange(locations.unit_type.size)
+        self.zones_id = np.full(locations.lng.size, -1, dtype=int)
+        self.zones_data = {}
+        self._resolved = False
+
+    @staticmethod
+    def _canonical_overrides(overrides, rows):
+        '''Return hashable form of the overrides of each of rows'''
+        if not overrides:
+            return [()] * len(rows)
+        keys = sorted(overrides)
+        values = np.column_stack([overrides[key][rows] for key in keys])
+        return [tuple((key, value) for key, value in zip(keys, row)
+                      if value == value) # skip NaN
+                for row in values.tolist()]
+
+    def unit_keys(self, units=None):
+        '''Return keys identifying the data sent to Muland for units
+
+        Units with equal keys get equal results from Muland, regardless of
+        their location. Locations must have been resolved.
+        '''
+        if units is None:
+            units = self.units
+        columns = self.columns
+        locations = columns.unit_location[units]
+        return list(zip(
+            self.zones_id[locations].tolist(),
+            columns.unit_type[units].astype(int).tolist(),
+            self._canonical_overrides(columns.location_overrides, locations),
+            self._canonical_overrides(columns.merged_overrides(), units)))
+
+    def unit_refs(self, units=None):
+        '''Return (V_IDX, I_IDX) identifying units at Muland data'''
+        if units is None:
+            units = self.units
+        columns = self.columns
+        return list(zip(columns.unit_type[units].astype(int).tolist(),
+                        (columns.unit_location[units] + 1).tolist()))
+
+    def split_output(self, output_data, units=None):
+        '''Split Muland output data into records of each unit
+
+        Returns a list with a dict for each unit, mapping output file names
+        to the unit's record as an array row. Rows of all units are copied
+        together, so output files of the run aren't kept.
+        '''
+        refs = np.array(self.unit_refs(units), dtype=float).reshape(-1, 2)
+        unit_records = [{} for _ in range(len(refs))]
+        for name in Muland.vi_output_files:
+            if name not in output_data:
+                continue
+            array = table_array(output_data[name])
+            rows = _find_refs(array[:, :2], refs)
+            found = np.flatnonzero(rows >= 0)
+            for position, record in zip(found.tolist(), array[rows[found]]):
+                unit_records[position][name] = record
+        return unit_records
+
+    def join_output(self, unit_records, bh, units=None, outputs=None):
+        '''Build Muland output data from records of each unit
+
+        Records are renumbered after the units they are assigned to. Only
+        output files in outputs are included, defaulting to all.
+        '''
+        if outputs is None:
+            outputs = Muland.output_files
+        refs = np.array(self.unit_refs(units), dtype=float).reshape(-1, 2)
+        output_data = MulandOutput()
+        for name in Muland.output_files:
+            if name not in outputs:
+                continue
+            if name == 'bh':
+                output_data[name] = (bh if isinstance(bh, OutputTable)
+                                     else OutputTable(table_array(bh)))
+                continue
+            present = [position for position, records in enumerate(unit_records)
+                       if name in records]
+            if not present:
+                output_data[name] = OutputTable(np.empty((0, 2)))
+                continue
+            values = np.stack([unit_records[position][name] for position in present])
+            output_data[name] = OutputTable(np.column_stack((refs[present],
+                                                             values[:, 2:])))
+        return output_data
+
+    def resolve(self):
+        '''Find zones of locations, dropping locations outside every zone'''
+        if self._resolved:
             return
 
-        records = data.records
-        header_idx = {key.upper(): index
-                      for key, index in zip(header, range(len(header)))}
+        for location_id, zones_id, zones_data in self._get_zones():
+            self.zones_id[location_id] = zones_id
+            self.zones_data[zones_id] = zones_data
 
-        # if there is no type, iterate over zones
+        # Remove locations not contained by any zones
+        inside = self.zones_id >= 0
+        self.locations = np.flatnonzero(inside)
+        self.units = np.flatnonzero(inside[self.columns.unit_location])
+        self._resolved = True
+
+    def _find_units(self, units, i_idx, v_idx):
+        '''Return index of the unit of each (V_IDX, I_IDX), -1 if not in units'''
+        if not len(units) or not len(i_idx):
+            return np.full(len(i_idx), -1)
+        columns = self.columns
+        span = int(max(columns.unit_type.max(), v_idx.max())) + 1
+        keys = columns.unit_location[units] * span + columns.unit_type[units].astype(int)
+        wanted = (i_idx - 1) * span + v_idx.astype(int)
+        order = np.argsort(keys, kind='stable')
+        pos = np.searchsorted(keys[order], wanted).clip(0, len(units) - 1)
+        found = keys[order][pos] == wanted
+        return np.where(found, units[order][pos], -1)
+
+    def _apply_overrides(self, data, units):
+        '''Override data from db with values provided by user
+
+        Records are matched to locations by I_IDX, and to units by V_IDX and
+        I_IDX if present. Units override values of their locations.
+        '''
+        header = [key.upper() for key in data.header]
+        if 'I_IDX' not in header:
+            return
+
+        # if there is no type, override by location
         if 'V_IDX' not in header:
-            for record, loc in zip(records, self.locations):
-                for key, value in loc['overrides'].items():
-                    if not isinstance(value, (int, float)):
-                        continue
-                    key = key.upper()
-                    if key[:-3] == '_IDX' or key[:2] == 'ID':
-                        continue
-                    try:
-                        record[header_idx[key]] = value
-                    except KeyError:
-                        continue
+            overrides = self.columns.location_overrides
+        else:
+            overrides = self.columns.merged_overrides()
+        targets = [(header.index(key), values)
+                   for key, values in overrides.items()
+                   if key in header and not key.endswith('_IDX') and
+                   not key.startswith('ID')]
+        if not targets or not data.records:
             return
 
-        # otherwise, operate over units
-        for record, unit in zip(records, self.units):
-            overrides = unit['location']['overrides']
-            overrides.update(unit['overrides'])
-            for key, value in overrides.items():
-                if not isinstance(value, (int, float)):
-                    continue
-                key = key.upper()
-                if key[:-3] == '_IDX' or key[:2] == 'ID':
-                    continue
-                try:
-                    idx = header_idx[key]
-                except KeyError:
-                    continue
-                record[idx] = value
+        records = np.array(data.records, dtype=float)
+        i_idx = records[:, header.index('I_IDX')].astype(int)
+        if 'V_IDX' not in header:
+            rows = i_idx - 1
+        else:
+            rows = self._find_units(units, i_idx, records[:, header.index('V_IDX')])
+        found = rows >= 0
+        for column, values in targets:
+            value = np.where(found, values[rows], np.nan)
+            mask = ~np.isnan(value)
+            records[mask, column] = value[mask]
+        data.records[:] = records.tolist()
+
+    def get(self, units=None):
+        '''Get data for Muland
+
+        When units is given, only those units and their locations are
+        included in the data.
+        '''
+        self.resolve()
+        if units is None:
+            units = self.units
+            locations = self.locations
+        else:
+            locations = np.unique(self.columns.unit_location[units])
 
-    def get(self):
-        '''Get data for Muland'''
         data = {}
-        headers = self._get_headers()
+        records = self._fetch(units, locations)
+        headers, model_data = self._get_model_data()
 
         # zones
-        zone_map, zones_records = self._get_zones()
-        data['zones'] = MulandData(header=['I_IDX'] + headers['zones_header'],
-                                   records=zones_records)
-        self._apply_overrides(data['zones'])
-
-        locations = self.locations
-        for location_id, zones_id in zone_map:
-            locations[location_id]['zones_id'] = zones_id
-        del locations
-
-        # Remove locations not contained by any zones
-        outsider_locids = {location['location_id']
-                           for location in self.locations
-                           if 'zones_id' not in location}
-        self.locations = [loc for loc in self.locations
-                          if loc['location_id'] not in outsider_locids]
-        self.units = [unit for unit in self.units
-                      if unit['location']['location_id'] not in outsider_locids]
+        data['zones'] = MulandData(
+            header=['I_IDX'] + headers['zones_header'],
+            records=[[location_id + 1] + list(self.zones_data[zones_id])
+                     for location_id, zones_id in
+                     zip(locations.tolist(), self.zones_id[locations].tolist())]
+        )
+        self._apply_overrides(data['zones'], units)
 
         # agents
-        data['agents'] = MulandData(
-            header=['IDAGENT', 'IDMARKET', 'IDAGGRA', 'UPPERBB'] + headers['agents_header'],
-            records=self._get_agents_records()
-        )
-        self._apply_overrides(data['agents'])
+        data['agents'] = model_data['agents']
 
         # agents_zones
         data['agents_zones'] = MulandData(
             header=['H_IDX', 'I_IDX', 'ACC', 'P_LN_ATT'] + headers['agents_zones_header'],
-            records=self._get_agents_zones_records()
+            records=records['agents_zones']
         )
-        self._apply_overrides(data['agents_zones'])
+        self._apply_overrides(data['agents_zones'], units)
 
         # bids_adjustments
         data['bids_adjustments'] = MulandData(
             header=['H_IDX', 'V_IDX', 'I_IDX', 'BIDADJ'],
-            records=self._get_bids_adjustments_records()
+            records=records['bids_adjustments']
         )
-        self._apply_overrides(data['bids_adjustments'])
+        self._apply_overrides(data['bids_adjustments'], units)
 
         # bids_functions
-        data['bids_functions'] = MulandData(
-            header=['IDMARKET', 'IDAGGRA', 'IDATTRIB', 'LINEAPAR', 'CAGENT_X',
-                    'CREST_X', 'CACC_X', 'CZONES_X', 'EXPPAR_X', 'CAGENT_Y',
-                    'CREST_Y', 'CACC_Y', 'CZONES_Y', 'EXPPAR_Y'],
-            records=self._get_bids_functions_records()
-        )
-        self._apply_overrides(data['bids_functions'])
+        data['bids_functions'] = model_data['bids_functions']
 
         # demand
-        data['demand'] = MulandData(
-            header=['H_IDX', 'DEMAND'],
-            records=self._get_demand_records()
-        )
-        self._apply_overrides(data['demand'])
+        data['demand'] = model_data['demand']
 
         # demand_exogenous_cutoff
         data['demand_exogenous_cutoff'] = MulandData(
             header=['H_IDX', 'V_IDX', 'I_IDX', 'DCUTOFF'],
-            records=self._get_demand_exogenous_cutoff_records()
+            records=records['demand_exogenous_cutoff']
         )
-        self._apply_overrides(data['demand_exogenous_cutoff'])
+        self._apply_overrides(data['demand_exogenous_cutoff'], units)
 
         # real_estates_zones
         data['real_estates_zones'] = MulandData(
             header=['V_IDX', 'I_IDX', 'M_IDX'] + headers['real_estates_zones_header'],
-            records=self._get_real_estates_zones()
+            records=records['real_estates_zones']
         )
-        self._apply_overrides(data['real_estates_zones'])
+        self._apply_overrides(data['real_estates_zones'], units)
 
         # rent_adjustments
         data['rent_adjustments'] = MulandData(
             header=['V_IDX', 'I_IDX', 'RENTADJ'],
-            records=self._get_rent_adjustments()
+            records=records['rent_adjustments']
         )
-        self._apply_overrides(data['rent_adjustments'])
+        self._apply_overrides(data['rent_adjustments'], units)
 
         # rent_funtions
-        data['rent_functions'] = MulandData(
-            header=['IDMARKET', 'IDATTRIB', 'SCALEPAR', 'LINEAPAR', 'CREST_X',
-                    'CZONES_X', 'EXPPAR_X', 'CREST_Y', 'CZONES_Y', 'EXPPAR_Y'],
-            records=self._get_rent_functions()
-        )
-        self._apply_overrides(data['rent_functions'])
+        data['rent_functions'] = model_data['rent_functions']
 
         # subsidies
         data['subsidies'] = MulandData(
             header=['H_IDX', 'V_IDX', 'I_IDX', 'SUBSIDIES'],
-            records=self._get_subsidies()
+            records=records['subsidies']
         )
-        self._apply_overrides(data['subsidies'])
+        self._apply_overrides(data['subsidies'], units)
 
         # supply
         data['supply'] = MulandData(
             header=['V_IDX', 'I_IDX', 'NREST'],
-            records=self._get_supply()
+            records=records['supply']
         )
-        self._apply_overrides(data['supply'])
+        self._apply_overrides(data['supply'], units)
 
         return data
 
+    def _fetch(self, units, locations):
+        '''Fetch records of the tables depending on locations
+
+        Tables are split among up to fetch_connections pooled connections,
+        self.conn being one of them, and fetched concurrently. The model
+        data is fetched alongside them if it isn't cached. Returns dict of
+        records by table name.
+        '''
+        names = list(self._location_tables) + list(self._unit_tables)
+        if model_cache.get(self.model, self.models_version, 'data') is None:
+            names.insert(0, 'model')
+        count = max(1, min(self.fetch_connections, len(names)))
+        groups = [names[index::count] for index in range(count)]
+
+        futures = [_fetch_executor.submit(self._fetch_tables, group, units, locations)
+                   for group in groups[1:]]
+        records = self._fetch_tables(groups[0], units, locations, self.conn)
+        for future in futures:
+            records.update(future.result())
+        return records
+
+    def _fetch_tables(self, names, units, locations, conn=None):
+        '''Fetch records of the tables in names at conn
+
+        A new pooled connection is used if conn is None. Units are loaded
+        into request_units if any table joins it.
+        '''
+        mudb = copy.copy(self)
+        mudb.conn = db.engine.connect() if conn is None else conn
+        try:
+            joins_units = any(name in self._unit_tables for name in names)
+            if joins_units:
+                mudb._create_units_table()
+
+            records = {}
+            with mudb.conn.begin():
+                if joins_units:
+                    mudb._load_units(units)
+                for name in names:
+                    if name == 'model':
+                        mudb._get_model_data()
+                    elif name in self._unit_tables:
+                        records[name] = getattr(mudb, self._unit_tables[name])(units)
+                    else:
+                        records[name] = getattr(mudb, self._location_tables[name])(locations)
+            return records
+        finally:
+            if conn is None:
+                mudb.conn.close()
+
+    def _get_model_data(self):
+        '''Get headers and data of the model not depending on locations
+
+        Returns (headers, data), where data maps agents, bids_functions,
+        demand and rent_functions to MulandData. They are kept at
+        model_cache and shared by requests, so they must not be modified.
+        None of them is overridden by locations, lacking I_IDX.
+        '''
+        tables = model_cache.get(self.model, self.models_version, 'data')
+        if tables is not None:
+            return tables
+
+        headers = self._get_headers()
+        data = {
+            'agents': MulandData(
+                header=['IDAGENT', 'IDMARKET', 'IDAGGRA', 'UPPERBB'] + headers['agents_header'],
+                records=self._get_agents_records()
+            ),
+            'bids_functions': MulandData(
+                header=['IDMARKET', 'IDAGGRA', 'IDATTRIB', 'LINEAPAR', 'CAGENT_X',
+                        'CREST_X', 'CACC_X', 'CZONES_X', 'EXPPAR_X', 'CAGENT_Y',
+                        'CREST_Y', 'CACC_Y', 'CZONES_Y', 'EXPPAR_Y'],
+                records=self._get_bids_functions_records()
+            ),
+            'demand': MulandData(
+                header=['H_IDX', 'DEMAND'],
+                records=self._get_demand_records()
+            ),
+            'rent_functions': MulandData(
+                header=['IDMARKET', 'IDATTRIB', 'SCALEPAR', 'LINEAPAR', 'CREST_X',
+                        'CZONES_X', 'EXPPAR_X', 'CREST_Y', 'CZONES_Y', 'EXPPAR_Y'],
+                records=self._get_rent_functions()
+            ),
+        }
+        tables = (headers, data)
+        model_cache.put(self.model, self.models_version, 'data', tables)
+        return tables
+
     def _get_headers(self):
         '''Get CSV header records'''
         db_models = db.models
@@ -221,53 +622,117 @@ class MulandDB:
                     db_models.c.agents_header,
                     db_models.c.agents_zones_header,
                     db_models.c.real_estates_zones_header])
-            .where(db_models.c.id == self.models_id)
-            .limit(1))
+            .where(db_models.c.id == text('$1')))
 
-        result = self.conn.execute(s)
-        header = dict(result.fetchone())
-        result.close()
+        result = self._execute('headers', ['integer'], s, self.models_id)
+        return dict(result[0])
 
+    def _execute(self, name, types, statement, *params):
+        '''Execute statement with params, returning its rows
 
-        return header
+        Parameters are given at statement as $1, $2... of types. Statements
+        are prepared once per pooled connection, by name, and their
+        execution times are logged.
+        '''
+        conn = self.conn
+        name = 'mulandweb_' + name
+        prepared = conn.info.setdefault('mulandweb_prepared', set())
+        if name not in prepared:
+            compiled = statement.compile(dialect=conn.dialect)
+            assert not compiled.params, 'statement %s has bound parameters' % name
+            sql = str(compiled)
+            conn.execute('PREPARE %s (%s) AS %s' % (name, ', '.join(types), sql))
+            prepared.add(name)
+
+        start = time.perf_counter()
+        rows = conn.execute('EXECUTE %s (%s)' % (name, ', '.join(['%s'] * len(params))),
+                            [params]).fetchall()
+        _log.debug('%s: %d rows in %.1f ms', name, len(rows),
+                   (time.perf_counter() - start) * 1000)
+        return rows
+
+    def _create_units_table(self):
+        '''Create db.request_units once per pooled connection
+
+        Rows of the temporary table are deleted when transactions end.
+        '''
+        conn = self.conn
+        if conn.info.get('mulandweb_request_units'):
+            return
+        name = db.request_units.name
+        conn.execute(text('CREATE TEMPORARY TABLE %s (lid integer, '
+                          'zones_id integer, types_id integer) '
+                          'ON COMMIT DELETE ROWS' % name))
+        conn.execute(text('CREATE INDEX ON %s (zones_id, types_id)' % name))
+        conn.info['mulandweb_request_units'] = True
+
+    def _load_units(self, units):
+        '''Load (I_IDX, zones_id, types_id) of units into db.request_units
+
+        The temporary table is filled with COPY and emptied when the current
+        transaction ends. Per unit queries join it.
+        '''
+        columns = self.columns
+        locations = columns.unit_location[units]
+        rows = np.column_stack((locations + 1, self.zones_id[locations],
+                                columns.unit_type[units].astype(int)))
+        buf = io.StringIO()
+        np.savetxt(buf, rows, fmt='%d', delimiter='\t')
+        buf.seek(0)
+
+        name = db.request_units.name
+        cursor = self.conn.connection.cursor()
+        try:
+            cursor.copy_expert('COPY %s (lid, zones_id, types_id) FROM STDIN'
+                               % name, buf)
+        finally:
+            cursor.close()
 
     # zones
     #"I_IDX";"INDAREA";"COMAREA";"SERVAREA";"TOTAREA";"TOTBUILT";"INCOMEHH";"DIST_ACC"
     #1.00;2.7441056;0.4679935;3.2301371;8968.0590000;10.9089400;0.00;2.8959340
     def _get_zones(self):
-        '''Get zones records
+        '''Get zones of locations
 
-        Returns tuple (zone_map, records). The zone_map field carries a
-        list of tuples (point_id, zone_id). The records field carries a list
-        of records for the zones file.
+        Returns list of tuples (location_id, zones_id, data), where data
+        carries the zone record without its I_IDX.
         '''
-        db_zones = db.zones
+        columns = self.columns
+        index, zones_data = self._get_zone_index()
+
+        # Look up each distinct point once
+        lnglat = np.column_stack((columns.lng, columns.lat))
+        points, point_of_location = np.unique(lnglat, axis=0, return_inverse=True)
+        found = index.locate(points[:, 0], points[:, 1])[point_of_location.ravel()]
+        zones_id = index.zones_id.tolist()
 
-        values = ', '.join(
-            ['(%s, ST_Transform(ST_SetSRID(ST_Point(%s, %s), 4326), 900913))' %
-             (loc['location_id'], loc['lng'], loc['lat'])
-             for loc in self.locations])
+        return [(location_id, zones_id[zone], zones_data[zone])
+                for location_id, zone in enumerate(found.tolist())
+                if zone >= 0]
 
-        s = (select([text('locs.id'),
-                     db_zones.c.id,
+    def _get_zone_index(self):
+        '''Get ZoneIndex of the model and the data of each of its zones
+
+        Both are kept at model_cache, and data carries zone records without
+        their I_IDX.
+        '''
+        zones = model_cache.get(self.model, self.models_version, 'zones')
+        if zones is not None:
+            return zones
+
+        db_zones = db.zones
+
+        s = (select([db_zones.c.id,
+                     func.ST_AsBinary(db_zones.c.area),
                      db_zones.c.data])
-            .select_from(db_zones
-                .join(text('(VALUES %s) AS locs (id, geom) ' % values),
-                      func.ST_Contains(db_zones.c.area, text('locs.geom'))))
-            .where(db_zones.c.models_id == self.models_id)
-            .order_by(text('locs.id')))
-
-        result = self.conn.execute(s)
-        zone_map = []
-        records = []
-        for row in result:
-            data = [row[0] + 1]
-            data.extend(row[2])
-            records.append(data)
-            zone_map.append([row[0], row[1]])
-        result.close()
+            .where(db_zones.c.models_id == text('$1')))
 
-        return zone_map, records
+        result = self._execute('zone_areas', ['integer'], s, self.models_id)
+        areas = shapely.from_wkb([bytes(row[1]) for row in result])
+        zones = (ZoneIndex([row[0] for row in result], areas),
+                 [row[2] for row in result])
+        model_cache.put(self.model, self.models_version, 'zones', zones)
+        return zones
 
     # agents
     #"IDAGENT";"IDMARKET";"IDAGGRA";"UPPERBB";"HHINC";"RHO";"FNIP";"ONES"
@@ -281,30 +746,24 @@ class MulandDB:
                      db_agents.c.aggra_id,
                      db_agents.c.upperbb,
                      db_agents.c.data])
-            .where(db_agents.c.models_id == self.models_id))
+            .where(db_agents.c.models_id == text('$1')))
 
-        result = self.conn.execute(s)
         records = []
-        for row in db.engine.execute(s):
+        for row in self._execute('agents', ['integer'], s, self.models_id):
             data = list(row[0:4])
             data.extend(row[4])
             records.append(data)
-        result.close()
 
         return records
 
     # agents_zones
     #"H_IDX";"I_IDX";"ACC";"P_LN_ATT"
     #1.00;1.00;0.7308194;0.0000000
-    def _get_agents_zones_records(self):
+    def _get_agents_zones_records(self, locations):
         '''Get agents records'''
         db_azones = db.agents_zones
 
-        values = ', '.join(['(%s, %s)' %
-                            (location['location_id'] + 1, location['zones_id'])
-                            for location in self.locations])
-
-        if not values:
+        if not len(locations):
             return []
 
         s = (select([db_azones.c.agents_id,
@@ -313,49 +772,42 @@ class MulandDB:
                      db_azones.c.att,
                      db_azones.c.data])
             .select_from(db_azones
-                .join(text('(VALUES %s) AS locs (id, zones_id) ' % values),
+                .join(text('unnest($2, $3) AS locs (id, zones_id)'),
                       db_azones.c.zones_id == text('locs.zones_id')))
-            .where(db_azones.c.models_id == self.models_id))
+            .where(db_azones.c.models_id == text('$1')))
 
-        result = self.conn.execute(s)
         records = []
-        for row in db.engine.execute(s):
+        for row in self._execute('agents_zones', ['integer', 'integer[]', 'integer[]'], s,
+                                 self.models_id, (locations + 1).tolist(),
+                                 self.zones_id[locations].tolist()):
             data = list(row[0:4])
             data.extend(row[4])
             records.append(data)
-        result.close()
 
         return records
 
     # bids_adjustments
     #"H_IDX";"V_IDX";"I_IDX";"BIDADJ"
     #1.00;1.00;1.00;0.0000000000
-    def _get_bids_adjustments_records(self):
+    def _get_bids_adjustments_records(self, units):
         '''Get bids_adjustments records'''
         db_badj = db.bids_adjustments
 
-        values = ', '.join(['(%s, %s, %s)' %
-                            (unit['location']['location_id'] + 1,
-                             unit['location']['zones_id'],
-                             unit['types_id'])
-                            for unit in self.units])
-
-        if not values:
+        if not len(units):
             return []
 
         s = (select([db_badj.c.agents_id,
                      db_badj.c.types_id,
-                     text('units.lid'),
+                     db.request_units.c.lid,
                      db_badj.c.bidadj])
             .select_from(db_badj
-                .join(text('(VALUES %s) AS units (lid, zones_id, types_id) ' % values),
-                      and_(db_badj.c.zones_id == text('units.zones_id'),
-                           db_badj.c.types_id == text('units.types_id'))))
-            .where(db_badj.c.models_id == self.models_id))
+                .join(db.request_units,
+                      and_(db_badj.c.zones_id == db.request_units.c.zones_id,
+                           db_badj.c.types_id == db.request_units.c.types_id)))
+            .where(db_badj.c.models_id == text('$1')))
 
-        result = self.conn.execute(s)
+        result = self._execute('bids_adjustments', ['integer'], s, self.models_id)
         records = [list(row) for row in result]
-        result.close()
 
         return records
 
@@ -380,11 +832,10 @@ class MulandDB:
                      db_bfunc.c.cacc_y,
                      db_bfunc.c.czones_y,
                      db_bfunc.c.exppar_y])
-            .where(db_bfunc.c.models_id == self.models_id))
+            .where(db_bfunc.c.models_id == text('$1')))
 
-        result = self.conn.execute(s)
+        result = self._execute('bids_functions', ['integer'], s, self.models_id)
         records = [list(row) for row in result]
-        result.close()
 
         return records
 
@@ -397,110 +848,88 @@ class MulandDB:
 
         s = (select([db_demand.c.agents_id,
                      db_demand.c.demand])
-            .where(db_demand.c.models_id == self.models_id))
+            .where(db_demand.c.models_id == text('$1')))
 
-        result = self.conn.execute(s)
+        result = self._execute('demand', ['integer'], s, self.models_id)
         records = [list(row) for row in result]
-        result.close()
 
         return records
 
     # demand_exogenous_cutoff
     #"H_IDX";"V_IDX";"I_IDX";"DCUTOFF"
     #1.00;1.00;1.00;1.00
-    def _get_demand_exogenous_cutoff_records(self):
+    def _get_demand_exogenous_cutoff_records(self, units):
         '''Get demand_exogenous_cutoff records'''
         db_decutoff = db.demand_exogenous_cutoff
 
-        values = ', '.join(['(%s, %s, %s)' %
-                            (unit['location']['location_id'] + 1,
-                             unit['location']['zones_id'],
-                             unit['types_id'])
-                            for unit in self.units])
-
-        if not values:
+        if not len(units):
             return []
 
         s = (select([db_decutoff.c.agents_id,
                      db_decutoff.c.types_id,
-                     text('units.lid'),
+                     db.request_units.c.lid,
                      db_decutoff.c.dcutoff])
             .select_from(db_decutoff
-                .join(text('(VALUES %s) AS units (lid, zones_id, types_id) ' % values),
-                      and_(db_decutoff.c.zones_id == text('units.zones_id'),
-                           db_decutoff.c.types_id == text('units.types_id'))))
-            .where(db_decutoff.c.models_id == self.models_id))
+                .join(db.request_units,
+                      and_(db_decutoff.c.zones_id == db.request_units.c.zones_id,
+                           db_decutoff.c.types_id == db.request_units.c.types_id)))
+            .where(db_decutoff.c.models_id == text('$1')))
 
-        result = self.conn.execute(s)
+        result = self._execute('demand_exogenous_cutoff', ['integer'], s, self.models_id)
         records = [list(row) for row in result]
-        result.close()
 
         return records
 
     # real_estates_zones
     #"V_IDX";"I_IDX";"M_IDX";"LOTSIZE";"BUILT";"IS_HOUSE";"IS_APT"
     #1.00;1.00;1.00;3.4800000;0.027670;1.00;0.00
-    def _get_real_estates_zones(self):
+    def _get_real_estates_zones(self, units):
         '''Get real_estates_zones records'''
         db_rezones = db.real_estates_zones
 
-        values = ', '.join(['(%s, %s, %s)' %
-                            (unit['location']['location_id'] + 1,
-                             unit['location']['zones_id'],
-                             unit['types_id'])
-                            for unit in self.units])
-
-        if not values:
+        if not len(units):
             return []
 
         s = (select([db_rezones.c.types_id,
-                     text('units.lid'),
+                     db.request_units.c.lid,
                      db_rezones.c.markets_id,
                      db_rezones.c.data])
             .select_from(db_rezones
-                .join(text('(VALUES %s) AS units (lid, zones_id, types_id) ' % values),
-                      and_(db_rezones.c.zones_id == text('units.zones_id'),
-                           db_rezones.c.types_id == text('units.types_id'))))
-            .where(db_rezones.c.models_id == self.models_id))
+                .join(db.request_units,
+                      and_(db_rezones.c.zones_id == db.request_units.c.zones_id,
+                           db_rezones.c.types_id == db.request_units.c.types_id)))
+            .where(db_rezones.c.models_id == text('$1')))
 
-        result = self.conn.execute(s)
+        result = self._execute('real_estates_zones', ['integer'], s, self.models_id)
         records = []
         for row in result:
             data = list(row[:3])
             data.extend(row[3])
             records.append(data)
 
-        result.close()
         return records
 
     # rent_adjustments
     #"V_IDX";"I_IDX";"RENTADJ"
     #1.00;1.00;0.00
-    def _get_rent_adjustments(self):
+    def _get_rent_adjustments(self, units):
         '''Get rent_adjustments records'''
         db_rentadj = db.rent_adjustments
 
-        values = ', '.join(['(%s, %s, %s)' %
-                            (unit['location']['location_id'] + 1,
-                             unit['location']['zones_id'],
-                             unit['types_id'])
-                            for unit in self.units])
-
-        if not values:
+        if not len(units):
             return []
 
         s = (select([db_rentadj.c.types_id,
-                     text('units.lid'),
+                     db.request_units.c.lid,
                      db_rentadj.c.adjustment])
             .select_from(db_rentadj
-                .join(text('(VALUES %s) AS units (lid, zones_id, types_id) ' % values),
-                      and_(db_rentadj.c.zones_id == text('units.zones_id'),
-                           db_rentadj.c.types_id == text('units.types_id'))))
-            .where(db_rentadj.c.models_id == self.models_id))
+                .join(db.request_units,
+                      and_(db_rentadj.c.zones_id == db.request_units.c.zones_id,
+                           db_rentadj.c.types_id == db.request_units.c.types_id)))
+            .where(db_rentadj.c.models_id == text('$1')))
 
-        result = self.conn.execute(s)
+        result = self._execute('rent_adjustments', ['integer'], s, self.models_id)
         records = [list(row) for row in result]
-        result.close()
 
         return records
 
@@ -521,74 +950,59 @@ class MulandDB:
                      db_rentfunc.c.crest_y,
                      db_rentfunc.c.czones_y,
                      db_rentfunc.c.exppar_y])
-            .where(db_rentfunc.c.models_id == self.models_id))
+            .where(db_rentfunc.c.models_id == text('$1')))
 
-        result = self.conn.execute(s)
+        result = self._execute('rent_functions', ['integer'], s, self.models_id)
         records = [list(row) for row in result]
-        result.close()
 
         return records
 
     # subsidies
     #"H_IDX";"V_IDX";"I_IDX";"SUBSIDIES"
     #1.00;1.00;1.00;0.0000000000
-    def _get_subsidies(self):
+    def _get_subsidies(self, units):
         '''Get subsidies records'''
         db_subsidies = db.subsidies
 
-        values = ', '.join(['(%s, %s, %s)' %
-                            (unit['location']['location_id'] + 1,
-                             unit['location']['zones_id'],
-                             unit['types_id'])
-                            for unit in self.units])
-
-        if not values:
+        if not len(units):
             return []
 
         s = (select([db_subsidies.c.agents_id,
                      db_subsidies.c.types_id,
-                     text('unit.lid'),
+                     db.request_units.c.lid,
                      db_subsidies.c.subsidies])
             .select_from(db_subsidies
-                .join(text('(VALUES %s) AS unit (lid, zones_id, types_id) ' % values),
-                      and_(db_subsidies.c.zones_id == text('unit.zones_id'),
-                           db_subsidies.c.types_id == text('unit.types_id'))))
-            .where(db_subsidies.c.models_id == self.models_id))
+                .join(db.request_units,
+                      and_(db_subsidies.c.zones_id == db.request_units.c.zones_id,
+                           db_subsidies.c.types_id == db.request_units.c.types_id)))
+            .where(db_subsidies.c.models_id == text('$1')))
 
-        result = self.conn.execute(s)
+        result = self._execute('subsidies', ['integer'], s, self.models_id)
         records = [list(row) for row in result]
-        result.close()
 
         return records
 
     # supply
     #"V_IDX";"I_IDX";"NREST"
     #1.00;1.00;0.0000000000
-    def _get_supply(self):
+    def _get_supply(self, units):
         '''Get supply records'''
         db_supply = db.supply
 
-        values = ', '.join(['(%s, %s, %s)' %
-                            (unit['location']['location_id'] + 1,
-                             unit['location']['zones_id'],
-                             unit['types_id'])
-                            for unit in self.units])
-
-        if not values:
+        if not len(units):
             return []
 
         s = (select([db_supply.c.types_id,
-                     text('unit.lid'),
+                     db.request_units.c.lid,
                      db_supply.c.nrest])
             .select_from(db_supply
-                .join(text('(VALUES %s) AS unit (lid, zones_id, types_id) ' % values),
-                      and_(db_supply.c.zones_id == text('unit.zones_id'),
-                           db_supply.c.types_id == text('unit.types_id'))))
-            .where(db_supply.c.models_id == self.models_id))
+                .join(db.request_units,
+                      and_(db_supply.c.zones_id == db.request_units.c.zones_id,
+                           db_supply.c.types_id == db.request_units.c.types_id)))
+            .where(db_supply.c.models_id == text('$1')))
 
-        result = self.conn.execute(s)
+        result = self._execute('supply', ['integer'], s, self.models_id)
         records = [list(row) for row in result]
-        result.close()
 
         return records
 
@@ -631,6 +1045,7 @@ class ModelImporter:
         self.db_import_bids_adjustments()
         self.db_import_bids_functions()
         self.db_import_rent_functions()
+        self.db_stamp_model()
 
     def db_create_model(self):
         '''Create entry for the model at the db and returns its id'''
@@ -657,7 +1072,8 @@ class ModelImporter:
             zones_header=zones_header,
             agents_header=agents_header,
             agents_zones_header=agents_zones_header,
-            real_estates_zones_header=real_estates_zones_header
+            real_estates_zones_header=real_estates_zones_header,
+            version=func.now()
         ).returning(db.models.c.id)
 
         result = db.engine.execute(s)
@@ -666,6 +1082,17 @@ class ModelImporter:
 
         return models_id
 
+    def db_stamp_model(self):
+        '''Stamp model version once its tables are imported'''
+        assert self.models_id is not None
+
+        s = (db.models.update()
+            .where(db.models.c.id == self.models_id)
+            .values(version=func.now()))
+
+        result = db.engine.execute(s)
+        result.close()
+
     def _get_zone_shapes(self):
         '''Parse shapefile and return mapping between zone_id and polygon wkt'''
         sf = shapefile.Reader(self.shapefile)
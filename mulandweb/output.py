@@ -0,0 +1,92 @@
+# coding: utf-8
+'''Provides lazy, array-backed access to Muland output data'''
+
+from pathlib import Path
+import shutil, weakref
+
+import numpy as np
+
+__all__ = ['OutputTable', 'MulandOutput', 'table_array']
+
+class _Directory:
+    '''Directory removed once no longer referenced'''
+    # pylint: disable=too-few-public-methods
+    def __init__(self, path):
+        '''Initialize directory at path'''
+        self.path = path
+        weakref.finalize(self, shutil.rmtree, path, True)
+
+class OutputTable:
+    '''Table of Muland output records backed by a 2-dimensional array
+
+    source is either the array or a file parsed by reader(source) on first
+    access, which may map it into memory. Rows are given as tuples of
+    floats, like the records of MulandData, and columns as arrays.
+    '''
+    block_size = 1000 # rows converted at once while iterating
+
+    def __init__(self, source, reader=None, directory=None):
+        '''Initialize table, keeping directory while source isn't parsed'''
+        self._array = source if reader is None else None
+        self._source = source
+        self._reader = reader
+        self._directory = directory
+
+    @property
+    def array(self):
+        '''Array of records, parsed from source if needed'''
+        if self._array is None:
+            self._array = self._reader(self._source)
+            self._source = self._reader = self._directory = None
+        return self._array
+
+    def column(self, index):
+        '''Return array with column index of records'''
+        return self.array[:, index]
+
+    def __len__(self):
+        return len(self.array)
+
+    def __getitem__(self, index):
+        '''Return row tuple, list of row tuples for slices, or array slice
+
+        Indexing with a tuple slices the array, as in table[:, 2:].
+        '''
+        if isinstance(index, tuple):
+            return self.array[index]
+        if isinstance(index, slice):
+            return list(map(tuple, self.array[index].tolist()))
+        return tuple(self.array[index].tolist())
+
+    def __iter__(self):
+        array = self.array
+        for start in range(0, len(array), self.block_size):
+            yield from map(tuple, array[start:start + self.block_size].tolist())
+
+    def __reduce__(self):
+        '''Pickle as an in-memory table'''
+        return (OutputTable, (np.array(self.array),))
+
+def table_array(records):
+    '''Return OutputTable or list of records as a 2-dimensional array'''
+    if isinstance(records, OutputTable):
+        return records.array
+    array = np.array(records, dtype=float)
+    if not len(array):
+        return np.empty((0, 0))
+    return array.reshape(len(array), -1)
+
+class MulandOutput(dict):
+    '''Muland output data, mapping output file names to OutputTable'''
+
+    @classmethod
+    def from_directory(cls, directory, files, reader):
+        '''Build output data of files kept at directory
+
+        files maps output names to file names, which are parsed on first
+        access with reader. directory is removed once no table needs it.
+        '''
+        holder = _Directory(directory)
+        return cls((name, OutputTable(str(Path(directory, filename)), reader,
+                                      holder))
+                   for name, filename in files.items())
@@ -0,0 +1,57 @@
+# coding: utf-8
+'''Provides concurrent Muland runs over a process pool'''
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock
+
+from .muland import Muland, MulandRunError
+from . import config
+
+__all__ = ['run_many']
+
+_executor = None
+_executor_lock = Lock()
+
+def _get_executor():
+    '''Return process pool, creating it on first use'''
+    global _executor # pylint: disable=global-statement
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=config.mulandweb_batch_workers)
+        return _executor
+
+def _reset_executor(executor):
+    '''Drop a broken process pool so the next run creates another'''
+    global _executor # pylint: disable=global-statement
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False)
+
+def _run(input_data, timeout, outputs, engine, static_key):
+    '''Run Muland over input data returning its output data'''
+    # pylint: disable=too-many-arguments
+    mu = Muland(engine=engine, outputs=outputs, static_key=static_key,
+                **input_data)
+    mu.shard_size = 0 # runs are already parallel
+    mu.run(timeout)
+    return mu.output_data
+
+def run_many(inputs, timeout=None, outputs=None, engine=None, static_key=None):
+    '''Run Muland concurrently for each dict of input data
+
+    Returns a list with the output data of each run, including only output
+    files in outputs, which defaults to all. engine and static_key are
+    given to Muland.
+    '''
+    executor = _get_executor()
+    try:
+        futures = [executor.submit(_run, input_data, timeout, outputs, engine,
+                                   static_key)
+                   for input_data in inputs]
+        return [future.result() for future in futures]
+    except BrokenProcessPool:
+        _reset_executor(executor)
+        raise MulandRunError('Mu-Land worker process died')
@@ -0,0 +1,156 @@
+# coding: utf-8
+'''Provides partitioning and merging of Muland data by zone'''
+
+from bisect import bisect_left
+from collections import Counter
+
+from .muland import Muland, MulandData
+
+__all__ = ['select', 'merge', 'split_output', 'shard', 'unshard']
+
+def select(input_data, i_map):
+    '''Select Muland input data of the zones in i_map
+
+    i_map maps I_IDX values of input_data to I_IDX values at the returned
+    data, so selected zones may be renumbered. Data without I_IDX, like
+    agents and functions, is shared with input_data.
+    '''
+    data = {}
+    for name, table in input_data.items():
+        if 'I_IDX' not in table.header:
+            data[name] = table
+            continue
+
+        column = table.header.index('I_IDX')
+        records = []
+        for record in table.records:
+            i_idx = i_map.get(int(record[column]))
+            if i_idx is None:
+                continue
+            record = list(record)
+            record[column] = i_idx
+            records.append(record)
+        data[name] = MulandData(header=table.header, records=records)
+    return data
+
+def merge(inputs):
+    '''Merge Muland input data of several runs into one
+
+    Zones of each input are renumbered after those of the inputs before
+    it. Data without I_IDX is taken from the first input, so it must be
+    equal at all of them. Returns tuple (data, offsets), where offsets
+    holds the number added to I_IDX of each input.
+    '''
+    offsets = []
+    offset = 0
+    for input_data in inputs:
+        offsets.append(offset)
+        zones = input_data['zones']
+        column = zones.header.index('I_IDX')
+        offset += int(max((record[column] for record in zones.records),
+                          default=0))
+
+    data = {}
+    for name, table in inputs[0].items():
+        if 'I_IDX' not in table.header:
+            data[name] = table
+            continue
+
+        column = table.header.index('I_IDX')
+        records = []
+        for input_data, offset in zip(inputs, offsets):
+            for record in input_data[name].records:
+                record = list(record)
+                record[column] += offset
+                records.append(record)
+        data[name] = MulandData(header=table.header, records=records)
+    return data, offsets
+
+def split_output(output_data, offsets):
+    '''Split Muland output data of merged inputs by input
+
+    offsets is given as returned by merge, and zones are numbered back.
+    Output files without zones, like bh, are shared by all inputs.
+    '''
+    results = [{} for _ in offsets]
+    for name, records in output_data.items():
+        if name not in Muland.vi_output_files:
+            for result in results:
+                result[name] = records
+            continue
+
+        parts = [[] for _ in offsets]
+        for record in records:
+            i_idx = int(record[1])
+            index = bisect_left(offsets, i_idx) - 1
+            parts[index].append((record[0], i_idx - offsets[index]) +
+                                tuple(record[2:]))
+        for result, part in zip(results, parts):
+            result[name] = part
+    return results
+
+def shard(input_data, size):
+    '''Split Muland input data into shards of about size real estates
+
+    Zones are kept whole, so shards may be larger when zones are. Zones are
+    renumbered from 1 at each shard. Returns a list of tuples (data, zones)
+    where zones lists the original I_IDX of each zone of the shard.
+    '''
+    real_estates = input_data['real_estates_zones']
+    column = real_estates.header.index('I_IDX')
+    counts = Counter(int(record[column]) for record in real_estates.records)
+
+    zones = input_data['zones']
+    column = zones.header.index('I_IDX')
+    groups = [[]]
+    count = 0
+    for record in zones.records:
+        i_idx = int(record[column])
+        if groups[-1] and count + counts[i_idx] > size:
+            groups.append([])
+            count = 0
+        groups[-1].append(i_idx)
+        count += counts[i_idx]
+
+    # Shard and new I_IDX of each zone
+    zone_shard = {i_idx: (index, new_i_idx)
+                  for index, group in enumerate(groups)
+                  for new_i_idx, i_idx in enumerate(group, 1)}
+
+    shards = [{} for _ in groups]
+    for name, table in input_data.items():
+        if 'I_IDX' not in table.header:
+            for data in shards:
+                data[name] = table
+            continue
+
+        column = table.header.index('I_IDX')
+        parts = [[] for _ in groups]
+        for record in table.records:
+            try:
+                index, i_idx = zone_shard[int(record[column])]
+            except KeyError:
+                continue
+            record = list(record)
+            record[column] = i_idx
+            parts[index].append(record)
+        for data, records in zip(shards, parts):
+            data[name] = MulandData(header=table.header, records=records)
+    return list(zip(shards, groups))
+
+def unshard(results, groups):
+    '''Join Muland output data of shards, numbering zones back
+
+    groups lists the zones of each shard, as returned by shard. Output
+    files without zones, like bh, are taken from the first shard.
+    '''
+    output_data = {}
+    for name, records in results[0].items():
+        if name not in Muland.vi_output_files:
+            output_data[name] = records
+            continue
+        output_data[name] = [
+            (record[0], group[int(record[1]) - 1]) + tuple(record[2:])
+            for result, group in zip(results, groups)
+            for record in result[name]]
+    return output_data
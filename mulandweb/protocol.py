@@ -0,0 +1,137 @@
+# coding: utf-8
+'''Provides request parsing and validation shared by MulandWeb servers
+
+Errors are raised as bottle.HTTPError, which the asyncio server converts
+into responses.
+'''
+
+import re
+import codecs
+from xml.etree.ElementTree import ParseError
+import bottle
+
+from .muland import Muland
+from .mulanddb import MulandDB, LocationColumns, ModelNotFound
+from .cache import result_store
+from . import xmlparser
+
+__all__ = ['model_re', 'utf8reader', 'content_types', 'etag_matches',
+           'output_mime', 'read_xml', 'check_data', 'check_locations', 'parse_outputs',
+           'get_mudb', 'result_key']
+
+model_re = re.compile('[a-z]')
+utf8reader = codecs.getreader('utf-8')
+
+content_types = {'json': 'application/json',
+                 'xml': 'application/xml; charset=utf-8'}
+
+def etag_matches(if_none_match, etag):
+    '''Check whether If-None-Match header value matches etag'''
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == '*' or tag == etag:
+            return True
+    return False
+
+def output_mime(ctype):
+    '''Return output MIME type, 'json' or 'xml', for request Content-Type'''
+    ctype = ctype.lower()
+    mime = ctype.split(';')[0]
+    if mime == 'application/json':
+        return 'json'
+    elif mime == 'application/xml' or mime == 'text/xml':
+        if 'charset=utf-8' not in ctype:
+            raise bottle.HTTPError(400, 'Specify charset=utf-8 for '
+                                        'for this MIME type.')
+        return 'xml'
+    raise bottle.HTTPError(400, 'Invalid Content-Type')
+
+def read_xml(file):
+    '''Read locations of an XML request body from file as LocationColumns
+
+    Locations are added to the columns as their elements are parsed, so
+    neither the document nor a list of location dicts is held at once.
+    '''
+    try:
+        return LocationColumns.from_list(xmlparser.iterload(utf8reader(file)))
+    except ParseError:
+        raise bottle.HTTPError(400, 'Invalid XML')
+
+def check_data(data_in):
+    '''Validate input data, returning its locations'''
+    # Prepare data
+    if data_in is None:
+        raise bottle.HTTPError(400, 'No input data.')
+
+    if not isinstance(data_in, dict):
+        raise bottle.HTTPError(400, 'Input data isn\'t an object.')
+
+    if 'columns' in data_in:
+        try:
+            return LocationColumns.from_columns(data_in['columns'])
+        except ValueError as e:
+            raise bottle.HTTPError(400, str(e))
+
+    if 'loc' not in data_in:
+        raise bottle.HTTPError(400, "'loc' is not present at input data.")
+
+    locations = data_in['loc']
+    check_locations(locations)
+    return locations
+
+def check_locations(locations):
+    '''Validate location list'''
+    # pylint: disable=too-many-branches
+    if not isinstance(locations, list):
+        raise bottle.HTTPError(400, "'loc' isn't an array")
+
+    for loc in locations:
+        if 'lnglat' not in loc:
+            raise bottle.HTTPError(400, "'lnglat' not in 'loc' items")
+
+        lnglat = loc['lnglat']
+        if not isinstance(lnglat, list) or len(lnglat) != 2:
+            raise bottle.HTTPError(400, "'lnglat' isn't array with 2 elements")
+
+        if not all((isinstance(x, (int, float)) for x in lnglat)):
+            raise bottle.HTTPError(400, "lng or lat not a number")
+
+        if 'units' not in loc:
+            raise bottle.HTTPError(400, "'units' not in 'loc' items")
+        units = loc['units']
+        if not isinstance(units, list):
+            raise bottle.HTTPError(400, "'units' isn't an array")
+
+        for unit in units:
+            if 'type' not in unit:
+                raise bottle.HTTPError(400, "'type' not in unit")
+            if not isinstance(unit['type'], (int, float)):
+                raise bottle.HTTPError(400, "'type' isn't a number")
+
+def parse_outputs(names):
+    '''Parse comma separated output file names, None for all'''
+    if not names:
+        return None
+    names = [name.strip() for name in names.split(',')]
+    for name in names:
+        if name not in Muland.output_files:
+            raise bottle.HTTPError(400, "unknown output '%s'" % name)
+    return [name for name in Muland.output_files if name in names]
+
+def get_mudb(model, locations):
+    '''Return MulandDB for request, raising 404 for unknown models'''
+    try:
+        return MulandDB(model, locations)
+    except ModelNotFound:
+        raise bottle.HTTPError(404)
+
+def result_key(model, mudb, locations, output_mime, outputs):
+    '''Return result store key of request'''
+    if isinstance(locations, LocationColumns):
+        locations = {'columns': locations.digest()}
+    return result_store.key(model, mudb.models_version, locations, output_mime,
+                            outputs)
@@ -0,0 +1,164 @@
+# coding: utf-8
+'''Provides cost-aware admission of Muland runs'''
+
+from threading import Condition
+import asyncio, heapq, itertools, math, time
+
+from .muland import Muland, MulandException
+from . import config
+
+__all__ = ['QueueFull', 'Scheduler', 'scheduler']
+
+class QueueFull(MulandException):
+    '''Raised when a run is shed, retry_after seconds being suggested'''
+    def __init__(self, retry_after):
+        super().__init__('Mu-Land queue is full')
+        self.retry_after = retry_after
+
+class Scheduler:
+    '''Admits Muland runs to a budget of concurrent solver slots
+
+    The cost of a run is estimated as agents x real estates x markets, and
+    rate is the cost solved per second. Waiting runs are admitted by their
+    arrival time plus estimated duration, favouring short runs without
+    starving long ones. Runs that may be shed are refused with QueueFull
+    once queue_size runs are waiting. Runs solved by several processes at
+    once, like sharded runs and batches, take a slot per process.
+    '''
+    timeout_factor = 2 # estimated durations allowed before timing out
+
+    def __init__(self, slots=config.mulandweb_solver_slots,
+                 queue_size=config.mulandweb_solver_queue,
+                 rate=config.mulandweb_solver_rate):
+        '''Initialize scheduler'''
+        self.slots = slots
+        self.queue_size = queue_size
+        self.rate = rate
+        self._running = 0
+        self._waiting = []
+        self._counter = itertools.count()
+        self._cond = Condition()
+
+    @staticmethod
+    def estimate(input_data):
+        '''Estimate cost of running Muland over input data'''
+        agents = input_data['agents']
+        column = agents.header.index('IDMARKET')
+        markets = len({record[column] for record in agents.records})
+        units = len(input_data['real_estates_zones'].records)
+        return len(agents.records) * units * max(markets, 1)
+
+    def duration(self, cost):
+        '''Estimated seconds to solve a run of cost'''
+        return cost / self.rate
+
+    def timeout(self, cost):
+        '''Timeout for a run of cost, in seconds'''
+        return Muland.timeout + self.timeout_factor * self.duration(cost)
+
+    def retry_after(self):
+        '''Seconds suggested to clients before retrying a shed run'''
+        with self._cond:
+            waiting = sum(entry[2] for entry in self._waiting)
+        return max(1, math.ceil(waiting / max(self.slots, 1)))
+
+    def _push(self, cost, slots, waiter=None):
+        '''Queue a run of cost, returning its entry
+
+        Entries are (deadline, counter, duration, slots, waiter), where
+        waiter is (loop, future) for runs waiting in asyncio, or None for
+        threads waiting on the condition.
+        '''
+        duration = self.duration(cost)
+        entry = (time.monotonic() + duration, next(self._counter), duration,
+                 slots, waiter)
+        heapq.heappush(self._waiting, entry)
+        return entry
+
+    def _admit(self):
+        '''Admit asyncio runs at the head of the queue while slots are free
+
+        Threads are notified to admit themselves. Must be called holding
+        the condition.
+        '''
+        while self._waiting:
+            _, _, _, slots, waiter = self._waiting[0]
+            if waiter is None or self._running + slots > self.slots:
+                break
+            heapq.heappop(self._waiting)
+            self._running += slots
+            loop, future = waiter
+            loop.call_soon_threadsafe(self._resolve, future, slots)
+        self._cond.notify_all()
+
+    def _resolve(self, future, slots):
+        '''Give slots to an admitted asyncio run, releasing them if cancelled'''
+        if future.cancelled():
+            self.release(slots)
+        else:
+            future.set_result(slots)
+
+    def acquire(self, cost, shed=True, slots=1):
+        '''Wait for slots solver slots for a run of cost
+
+        Raises QueueFull if shed is true and the queue is full. Runs never
+        take more than all slots. Returns the number of slots taken, to be
+        given to release.
+        '''
+        slots = max(1, min(slots, self.slots))
+        with self._cond:
+            if not self._waiting and self._running + slots <= self.slots:
+                self._running += slots
+                return slots
+            if shed and len(self._waiting) >= self.queue_size:
+                raise QueueFull(self.retry_after())
+
+            entry = self._push(cost, slots)
+            self._admit()
+            while (self._running + slots > self.slots or
+                   self._waiting[0] is not entry):
+                self._cond.wait()
+            heapq.heappop(self._waiting)
+            self._running += slots
+            self._admit()
+            return slots
+
+    def release(self, slots=1):
+        '''Release slots solver slots'''
+        with self._cond:
+            self._running -= slots
+            self._admit()
+
+    async def acquire_async(self, cost, shed=True, slots=1):
+        '''Wait for solver slots like acquire, without blocking the loop
+
+        Runs wait in the same queue as those of acquire, as futures set by
+        release once they are admitted.
+        '''
+        slots = max(1, min(slots, self.slots))
+        loop = asyncio.get_event_loop()
+        with self._cond:
+            if not self._waiting and self._running + slots <= self.slots:
+                self._running += slots
+                return slots
+            if shed and len(self._waiting) >= self.queue_size:
+                raise QueueFull(self.retry_after())
+
+            future = loop.create_future()
+            entry = self._push(cost, slots, (loop, future))
+            self._admit()
+
+        try:
+            return await future
+        except asyncio.CancelledError:
+            with self._cond:
+                if entry in self._waiting:
+                    self._waiting.remove(entry)
+                    heapq.heapify(self._waiting)
+                    self._admit()
+                elif future.done() and not future.cancelled():
+                    # Admitted, but cancelled before resuming
+                    self.release(future.result())
+            raise
+
+scheduler = Scheduler()
@@ -0,0 +1,141 @@
+# coding: utf-8
+'''Provides working directories for Muland runs'''
+
+from pathlib import Path
+from threading import Lock
+import os, shutil, tempfile, hashlib
+
+from . import config
+
+__all__ = ['Workspaces', 'workspaces']
+
+class Workspaces:
+    '''Manages working directories of Muland runs under path
+
+    Input files that only depend on the model are written once per static
+    key at path/static and hard linked into run directories. Up to
+    static_keep of them are kept, removing the least recently used, so
+    files of old model versions don't pile up. Run directories are kept at
+    path/runs and recycled after being emptied, so path is best placed on a
+    tmpfs.
+    '''
+    def __init__(self, path=config.muland_work, keep=config.muland_work_keep,
+                 static_keep=config.muland_work_static_keep):
+        '''Initialize workspaces, keeping up to keep free run directories'''
+        self.path = path
+        self.keep = keep
+        self.static_keep = static_keep
+        self._free = []
+        self._pid = os.getpid()
+        self._lock = Lock()
+
+    def static_dir(self, key, files, write):
+        '''Return directory holding static files for key
+
+        files maps file names to data, written with write(filename, data)
+        if the directory doesn't exist yet.
+        '''
+        name = hashlib.sha256(repr(key).encode('utf-8')).hexdigest()
+        directory = str(Path(self.path, 'static', name))
+        try:
+            os.utime(directory) # mark as recently used
+            return directory
+        except FileNotFoundError:
+            pass
+
+        # Write to a temporary directory, then move it into place
+        os.makedirs(str(Path(self.path, 'static')), exist_ok=True)
+        temp = tempfile.mkdtemp(dir=str(Path(self.path, 'static')), prefix='.')
+        for file, data in files.items():
+            write(str(Path(temp, file)), data)
+        try:
+            os.rename(temp, directory)
+        except OSError:
+            # Created meanwhile by another run
+            shutil.rmtree(temp, ignore_errors=True)
+            return directory
+        self._evict_static(directory)
+        return directory
+
+    def _evict_static(self, directory):
+        '''Remove least recently used static directories beyond static_keep
+
+        directory, just created, is never removed.
+        '''
+        entries = []
+        for entry in os.scandir(str(Path(self.path, 'static'))):
+            if entry.name.startswith('.') or entry.path == directory:
+                continue
+            try:
+                entries.append((entry.stat().st_mtime_ns, entry.path))
+            except FileNotFoundError:
+                pass # removed meanwhile
+        entries.sort()
+        for _, path in entries[:max(len(entries) + 1 - self.static_keep, 0)]:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def clean(self):
+        '''Remove directories left by runs of previous processes
+
+        Removes run directories, kept outputs and partially written static
+        directories, as left when a server is killed. Must not be called
+        while runs are in progress.
+        '''
+        with self._lock:
+            self._free = []
+        for folder in ['runs', 'outputs']:
+            shutil.rmtree(str(Path(self.path, folder)), ignore_errors=True)
+        static = str(Path(self.path, 'static'))
+        if os.path.isdir(static):
+            for entry in os.scandir(static):
+                if entry.name.startswith('.'):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+
+    def acquire(self):
+        '''Return an empty run directory with input and output folders'''
+        with self._lock:
+            if self._pid != os.getpid():
+                # Free directories belong to the parent process
+                self._free = []
+                self._pid = os.getpid()
+            if self._free:
+                return self._free.pop()
+
+        os.makedirs(str(Path(self.path, 'runs')), exist_ok=True)
+        directory = tempfile.mkdtemp(dir=str(Path(self.path, 'runs')))
+        os.mkdir(str(Path(directory, 'input')))
+        os.mkdir(str(Path(directory, 'output')))
+        return directory
+
+    def keep_output(self, directory):
+        '''Move output folder of run directory to path/outputs
+
+        Returns the path the output files were moved to, leaving an empty
+        output folder at the run directory.
+        '''
+        os.makedirs(str(Path(self.path, 'outputs')), exist_ok=True)
+        output = tempfile.mkdtemp(dir=str(Path(self.path, 'outputs')))
+        os.rename(str(Path(directory, 'output')), output)
+        os.mkdir(str(Path(directory, 'output')))
+        return output
+
+    def release(self, directory):
+        '''Empty run directory and keep it for reuse'''
+        try:
+            for folder in ['input', 'output']:
+                for entry in os.scandir(str(Path(directory, folder))):
+                    if entry.is_dir(follow_symlinks=False):
+                        shutil.rmtree(entry.path)
+                    else:
+                        os.remove(entry.path)
+        except OSError:
+            shutil.rmtree(directory, ignore_errors=True)
+            return
+
+        with self._lock:
+            if self._pid == os.getpid() and len(self._free) < self.keep:
+                self._free.append(directory)
+                return
+        shutil.rmtree(directory, ignore_errors=True)
+
+workspaces = Workspaces()
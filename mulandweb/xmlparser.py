@@ -1,62 +1,97 @@
 # coding: utf-8
 '''Provides an XML parser for MulandWeb interface'''
 
-from xml.etree.ElementTree import Element, SubElement, ParseError
-from xml.etree.ElementTree import ElementTree as ElementWrapper
-from io import BytesIO
+from xml.etree.ElementTree import ParseError
+from xml.sax.saxutils import escape
+from io import BytesIO, StringIO
 from defusedxml import ElementTree
 
-__all__ = ['load', 'loads', 'dump', 'dumps']
+__all__ = ['load', 'loads', 'iterload', 'dump', 'dumps', 'iterdump']
 
 def dump(datain, file):
     '''Build and return XML file from data generated by Muland'''
-    ElementWrapper(_build(datain)).write(file, encoding='utf-8',
-                                         xml_declaration=True)
+    for chunk in iterdump(datain):
+        file.write(chunk)
 
 def dumps(datain):
     '''Build and return XML string from data generated by Muland'''
-    buffer = BytesIO()
-    dump(datain, buffer)
-    return buffer.getvalue().decode('utf-8')
+    return b''.join(iterdump(datain)).decode('utf-8')
 
-def _build(datain):
-    '''Build and return XML Element from Muland Output dict'''
-    datatag = Element('data')
+def iterdump(datain, chunk_size=64 * 1024):
+    '''Build XML from data generated by Muland, yielding UTF-8 chunks
+
+    Chunks are of about chunk_size bytes, and their concatenation is the
+    document ElementTree would write for the same data.
+    '''
+    pieces = ["<?xml version='1.0' encoding='utf-8'?>\n"]
+    size = 0
+    for piece in _iterbuild(datain):
+        pieces.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield ''.join(pieces).encode('utf-8')
+            pieces = []
+            size = 0
+    if pieces:
+        yield ''.join(pieces).encode('utf-8')
+
+def _iterbuild(datain):
+    '''Yield XML pieces of Muland Output dict, a record at a time'''
+    if not datain:
+        yield '<data />'
+        return
+    yield '<data>'
     for file_key, file_value in datain.items():
-        filetag = SubElement(datatag, file_key)
+        if not file_value:
+            yield '<%s />' % file_key
+            continue
+        yield '<%s>' % file_key
         for record in file_value:
-            recordtag = SubElement(filetag, 'record')
-            for recdata in record:
-                SubElement(recordtag, 'rd').text = str(recdata)
-    return datatag
+            if not record:
+                yield '<record />'
+                continue
+            yield '<record><rd>%s</rd></record>' % '</rd><rd>'.join(
+                escape(str(recdata)) for recdata in record)
+        yield '</%s>' % file_key
+    yield '</data>'
 
 def load(file):
     '''Load XML from file-like object and returns location list'''
     try:
-        tree = ElementTree.parse(file)
-        root = tree.getroot()
+        return list(iterload(file))
     except ParseError:
         return
-    return _parse_root(root)
 
 def loads(string):
     '''Load XML from string and returns location list'''
-    try:
-        tree = ElementTree.fromstring(string)
-        root = tree.getroot()
-    except ParseError:
-        return
-    return _parse_root(root)
+    if isinstance(string, str):
+        return load(StringIO(string))
+    return load(BytesIO(string))
+
+def iterload(file):
+    '''Load XML from file-like object yielding each location once parsed
 
-def _parse_root(root):
-    '''Parse Tree's root returning location list'''
-    ret = []
-    for element in root:
+    Locations are parsed as their elements close, and elements already
+    parsed are cleared, so the document is never held in memory as a
+    whole. Raises ParseError on invalid documents.
+    '''
+    root = None
+    depth = 0
+    for event, element in ElementTree.iterparse(file, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = element
+            depth += 1
+            continue
+
+        depth -= 1
+        if depth != 1:
+            continue
         if element.tag == 'location':
             location = _parse_location(element)
             if location is not None:
-                ret.append(location)
-    return ret
+                yield location
+        root.clear()
 
 def _parse_location(location):
     '''Parse location tag returning dict of it.'''
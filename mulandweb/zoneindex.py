@@ -0,0 +1,70 @@
+# coding: utf-8
+'''Provides in-process assignment of points to zones'''
+
+from collections import OrderedDict
+from threading import Lock
+
+import numpy as np
+import shapely
+from shapely.strtree import STRtree
+
+from . import config
+
+__all__ = ['ZoneIndex', 'project']
+
+_earth_radius = 6378137.0 # sphere of EPSG:900913
+
+def project(lng, lat):
+    '''Project arrays of WGS 84 coordinates to EPSG:900913'''
+    x = np.radians(lng) * _earth_radius
+    y = np.log(np.tan(np.pi / 4 + np.radians(lat) / 2)) * _earth_radius
+    return x, y
+
+class ZoneIndex:
+    '''STRtree of the zone areas of a model
+
+    Areas are given in EPSG:900913, as stored at the database, and points
+    in longitude and latitude. Zones found for each coordinate are cached,
+    up to cache_size coordinates.
+    '''
+    def __init__(self, zones_id, areas, cache_size=config.mulandweb_zone_cache_size):
+        '''Index areas, zones_id holding the id of each'''
+        self.zones_id = np.asarray(zones_id, dtype=int)
+        self.cache_size = cache_size
+        self._tree = STRtree(areas)
+        self._cache = OrderedDict()
+        self._lock = Lock()
+
+    def locate(self, lng, lat):
+        '''Return index of the zone containing each point, -1 if none
+
+        Points on zone boundaries aren't contained, like in ST_Contains.
+        '''
+        keys = list(zip(np.asarray(lng, dtype=float).tolist(),
+                        np.asarray(lat, dtype=float).tolist()))
+        found = np.full(len(keys), -1, dtype=int)
+        missing = []
+        with self._lock:
+            for position, key in enumerate(keys):
+                try:
+                    found[position] = self._cache[key]
+                    self._cache.move_to_end(key)
+                except KeyError:
+                    missing.append(position)
+
+        if not missing:
+            return found
+
+        missing = np.array(missing)
+        x, y = project(np.asarray(lng, dtype=float)[missing],
+                       np.asarray(lat, dtype=float)[missing])
+        points, zones = self._tree.query(shapely.points(x, y), predicate='within')
+        found[missing[points]] = zones
+
+        if self.cache_size > 0:
+            with self._lock:
+                for position in missing.tolist():
+                    self._cache[keys[position]] = int(found[position])
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return found
@@ -17,7 +17,11 @@ setup(name='mulandweb',
         'psycopg2',
         'SQLAlchemy',
         'pyshp',
-        'shapely',
+        'shapely>=2.0',
         'defusedxml',
+        'numpy',
       ],
+      extras_require={
+        'async': ['aiohttp>=3.9'],
+      },
       zip_safe=False)
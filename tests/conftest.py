@@ -0,0 +1,28 @@
+# coding: utf-8
+'''Configures MulandWeb for tests, before it's imported'''
+
+import csv
+import os
+from pathlib import Path
+import tempfile
+
+import pytest
+
+os.environ.setdefault('MULAND_ENGINE', 'numpy')
+os.environ.setdefault('MULAND_WORK_PATH', tempfile.mkdtemp(prefix='muland-work-'))
+os.environ.setdefault('MULANDWEB_CACHE_PATH',
+                      tempfile.mkdtemp(prefix='mulandweb-cache-'))
+
+_demo_city = Path(__file__).parent.parent / 'muLand' / 'test' / 'demo-city' / 'input'
+
+@pytest.fixture
+def demo_city():
+    '''Input data of mu-land's demo city, as a dict of MulandData'''
+    from mulandweb.muland import Muland, MulandData
+    input_data = {}
+    for name in Muland.input_files:
+        with (_demo_city / (name + '.csv')).open() as file:
+            reader = csv.reader(file, delimiter=';', quoting=csv.QUOTE_NONNUMERIC)
+            header = next(reader)
+            input_data[name] = MulandData(header, [list(row) for row in reader])
+    return input_data
@@ -0,0 +1,44 @@
+# coding: utf-8
+'''Tests of request validation at the asyncio server'''
+
+import asyncio
+
+import pytest
+
+pytest.importorskip('aiohttp')
+from aiohttp.test_utils import TestClient, TestServer # pylint: disable=wrong-import-position
+
+from mulandweb import aioserver # pylint: disable=wrong-import-position
+
+def _post(path, body, content_type='application/json'):
+    '''POST body to path, returning (status, text) of the response'''
+    async def post():
+        async with TestClient(TestServer(aioserver.make_app())) as client:
+            response = await client.post(path, data=body,
+                                         headers={'Content-Type': content_type})
+            return response.status, await response.text()
+    return asyncio.run(post())
+
+@pytest.mark.parametrize('body, content_type, error', [
+    (b'{"loc": [', 'application/json', 'Invalid JSON'),
+    (b'', 'application/json', 'No input data.'),
+    (b'[]', 'application/json', "Input data isn't an object."),
+    (b'{"loc": [{"units": []}]}', 'application/json', "'lnglat' not in 'loc' items"),
+    (b'{"columns": {"lng": "x"}}', 'application/json', "'lng'"),
+    (b'<loc/>', 'application/xml', 'charset=utf-8'),
+    (b'{}', 'text/plain', 'Invalid Content-Type'),
+])
+def test_invalid_requests_are_refused(body, content_type, error):
+    status, text = _post('/demo', body, content_type)
+    assert status == 400
+    assert error in text
+
+def test_invalid_outputs_are_refused():
+    body = b'{"loc": [{"lnglat": [0, 0], "units": [{"type": 1}]}]}'
+    status, text = _post('/demo?outputs=rents,prices', body)
+    assert status == 400
+    assert "unknown output 'prices'" in text
+
+def test_unknown_model_names():
+    status, _ = _post('/0', b'{"loc": []}')
+    assert status == 404
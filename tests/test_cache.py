@@ -0,0 +1,130 @@
+# coding: utf-8
+'''Tests of caches of Muland results'''
+
+import os
+
+import numpy as np
+import pytest
+
+from mulandweb.muland import Muland, MulandData
+from mulandweb.mulanddb import MulandDB
+from mulandweb.output import table_array
+from mulandweb.cache import ResultStore, UnitCache
+from mulandweb import protocol
+
+class _Units:
+    '''Units of a request at demo city zones, in place of a MulandDB
+
+    Each unit has its own location, numbered from I_IDX 1, at the given
+    demo city zone.
+    '''
+    model = 'demo-city'
+    models_version = 1
+    split_output = MulandDB.split_output
+    join_output = MulandDB.join_output
+
+    def __init__(self, input_data, zones, types):
+        '''Initialize units of types at zones'''
+        self.input_data = input_data
+        self.zones = np.array(zones)
+        self.types = np.array(types)
+        self.units = np.arange(len(zones))
+        self.requested = []
+
+    def resolve(self):
+        '''Locations are resolved at initialization'''
+
+    def unit_keys(self, units):
+        '''Return (zone, type) of units'''
+        return list(zip(self.zones[units].tolist(), self.types[units].tolist()))
+
+    def unit_refs(self, units=None):
+        '''Return (V_IDX, I_IDX) of units'''
+        if units is None:
+            units = self.units
+        return list(zip(self.types[units].tolist(), (units + 1).tolist()))
+
+    def get(self, units=None):
+        '''Get data for Muland, copying demo city records of each unit'''
+        if units is None:
+            units = self.units
+        self.requested.append(units.tolist())
+        data = {}
+        for name, table in self.input_data.items():
+            if 'I_IDX' not in table.header:
+                data[name] = table
+                continue
+            i_column = table.header.index('I_IDX')
+            v_column = (table.header.index('V_IDX') if 'V_IDX' in table.header
+                        else None)
+            records = []
+            for unit in units.tolist():
+                for record in table.records:
+                    if record[i_column] != self.zones[unit]:
+                        continue
+                    if v_column is not None and record[v_column] != self.types[unit]:
+                        continue
+                    record = list(record)
+                    record[i_column] = unit + 1
+                    records.append(record)
+            data[name] = MulandData(table.header, records)
+        return data
+
+def test_equal_units_are_solved_once(demo_city):
+    units = _Units(demo_city, [3, 3, 7, 3, 7, 8], [1, 1, 2, 1, 2, 1])
+    output_data = UnitCache().run(units)
+    assert units.requested == [[0, 2, 5]]
+
+    mu = Muland(**units.get())
+    mu.run()
+    for name in Muland.output_files:
+        assert table_array(output_data[name]) == pytest.approx(
+            table_array(mu.output_data[name]))
+
+def test_equal_requests_get_equal_keys():
+    locations = [{'lnglat': [1, 2], 'units': [{'type': 3}]}]
+    key = ResultStore.key('demo', 1, locations, 'json')
+    assert key == ResultStore.key('demo', '1', [{'units': [{'type': 3.0}],
+                                                 'lnglat': [1.0, 2.0]}],
+                                  'json', ['rents', 'location_probability',
+                                           'location', 'bh', 'bids'])
+    assert key != ResultStore.key('demo', 2, locations, 'json')
+    assert key != ResultStore.key('demo', 1, locations, 'xml')
+    assert key != ResultStore.key('demo', 1, locations, 'json', ['rents'])
+
+def test_bodies_are_kept_in_memory_and_on_disk(tmp_path):
+    store = ResultStore(str(tmp_path), memory_max=10, disk_max=100)
+    assert store.get('a') is None
+    assert b''.join(store.put_iter('a', [b'12345', b'678'])) == b'12345678'
+    store.put('b', b'x' * 20)
+    assert store.get('a') == b'12345678'
+    # Bodies larger than the memory tier are read from disk
+    assert store.get('b') == b'x' * 20
+
+    # Other processes sharing the directory find them too
+    assert ResultStore(str(tmp_path), 10, 100).get('b') == b'x' * 20
+
+def test_least_recently_used_bodies_are_evicted(tmp_path):
+    store = ResultStore(str(tmp_path), memory_max=0, disk_max=25)
+    store.put('a', b'a' * 10)
+    store.put('b', b'b' * 10)
+    os.utime(str(tmp_path / 'a'), (1, 1))
+    os.utime(str(tmp_path / 'b'), (2, 2))
+    store.put('c', b'c' * 10)
+    assert store.get('a') is None
+    assert store.get('b') == b'b' * 10
+    assert store.get('c') == b'c' * 10
+
+def test_incomplete_bodies_are_not_stored(tmp_path):
+    store = ResultStore(str(tmp_path), memory_max=100, disk_max=100)
+    chunks = store.put_iter('a', [b'123', b'456'])
+    assert next(chunks) == b'123'
+    chunks.close()
+    assert store.get('a') is None
+    assert not os.listdir(str(tmp_path))
+
+def test_etags_match_if_none_match_headers():
+    assert protocol.etag_matches('"a", W/"b"', '"b"')
+    assert protocol.etag_matches('*', '"b"')
+    assert not protocol.etag_matches('"a"', '"b"')
+    assert not protocol.etag_matches(None, '"b"')
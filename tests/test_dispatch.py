@@ -0,0 +1,57 @@
+# coding: utf-8
+'''Tests of merging of concurrent Muland runs'''
+
+from threading import Event, Thread
+
+import pytest
+
+from mulandweb.muland import Muland
+from mulandweb.output import table_array
+from mulandweb import dispatch, partition
+
+def test_concurrent_runs_are_merged(demo_city, monkeypatch):
+    started, merged, busy = Event(), Event(), Event()
+    zones = []
+
+    class _Muland(Muland):
+        '''Muland recording zones of each run, keeping runs of 'busy' running'''
+        def __init__(self, **kwargs):
+            super().__init__(**kwargs)
+            if self.static_key != 'busy':
+                zones.append(len(self.input_data['zones'].records))
+                merged.set()
+
+        def run(self, timeout=None):
+            if self.static_key == 'busy':
+                started.set()
+                busy.wait(5)
+            super().run(timeout)
+
+    monkeypatch.setattr(dispatch, 'Muland', _Muland)
+    dispatcher = dispatch.Dispatcher(window=0.5)
+    inputs = [partition.select(demo_city, {3: 1, 7: 2}),
+              partition.select(demo_city, {8: 1})]
+    results = [None, None]
+
+    def run(index):
+        results[index] = dispatcher.run('model', inputs[index])
+
+    # Runs only wait for others to join them while a run is in progress
+    threads = [Thread(target=dispatcher.run, args=('busy', inputs[1]), daemon=True)]
+    threads[0].start()
+    assert started.wait(5)
+    threads += [Thread(target=run, args=(index,), daemon=True) for index in range(2)]
+    for thread in threads[1:]:
+        thread.start()
+    assert merged.wait(5)
+    busy.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert zones == [3]
+    for input_data, output_data in zip(inputs, results):
+        mu = Muland(**input_data)
+        mu.run()
+        for name in Muland.output_files:
+            assert table_array(output_data[name]) == pytest.approx(
+                table_array(mu.output_data[name]))
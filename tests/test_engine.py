@@ -0,0 +1,119 @@
+# coding: utf-8
+'''Tests of the in-process NumPy engine'''
+
+import numpy as np
+import pytest
+
+from mulandweb.muland import Muland, MulandData
+from mulandweb import engine, partition
+
+def _small_model():
+    '''Two agents of one market bidding for three real estates at two zones
+
+    Bids are INCOME * ACCESS + 0.5 * SIZE, and rents 2 * SIZE plus the
+    logsum of bids, with unit scale.
+    '''
+    h_vi = [(1, 1, 1), (1, 2, 1), (1, 1, 2), (2, 1, 1), (2, 1, 2)]
+    return {
+        'agents': MulandData(['IDAGENT', 'IDMARKET', 'IDAGGRA', 'UPPERBB', 'INCOME'],
+                             [[1, 1, 1, 0, 2.0], [2, 1, 1, 0, 4.0]]),
+        'zones': MulandData(['I_IDX', 'ACCESS'], [[1, 1.0], [2, 3.0]]),
+        'real_estates_zones': MulandData(['V_IDX', 'I_IDX', 'M_IDX', 'SIZE'],
+                                         [[1, 1, 1, 2.0], [2, 1, 1, 1.0],
+                                          [1, 2, 1, 2.0]]),
+        'agents_zones': MulandData(['H_IDX', 'I_IDX', 'ACC', 'P_LN_ATT'], []),
+        'bids_functions': MulandData(
+            ['IDMARKET', 'IDAGGRA', 'IDATTRIB', 'LINEAPAR', 'CAGENT_X',
+             'CREST_X', 'CACC_X', 'CZONES_X', 'EXPPAR_X', 'CAGENT_Y',
+             'CREST_Y', 'CACC_Y', 'CZONES_Y', 'EXPPAR_Y'],
+            [[1, 1, 1, 1.0, 5, 0, 0, 0, 1, 0, 0, 0, 2, 1],
+             [1, 1, 2, 0.5, 0, 4, 0, 0, 1, 0, 0, 0, 0, 1]]),
+        'bids_adjustments': MulandData(['H_IDX', 'V_IDX', 'I_IDX', 'BIDADJ'],
+                                       [[1, 2, 1, 0.5]]),
+        'subsidies': MulandData(['H_IDX', 'V_IDX', 'I_IDX', 'SUBSIDIES'],
+                                [[2, 1, 2, -1.0]]),
+        'demand': MulandData(['IDAGENT', 'DEMAND'], [[1, 1.0], [2, 2.0]]),
+        # Agent 2 doesn't locate at real estate (2, 1)
+        'demand_exogenous_cutoff': MulandData(['H_IDX', 'V_IDX', 'I_IDX', 'DCUTOFF'],
+                                              [list(row) + [1.0] for row in h_vi]),
+        'rent_functions': MulandData(
+            ['IDMARKET', 'IDATTRIB', 'SCALEPAR', 'LINEAPAR', 'CREST_X',
+             'CZONES_X', 'EXPPAR_X', 'CREST_Y', 'CZONES_Y', 'EXPPAR_Y'],
+            [[1, 1, 1.0, 2.0, 4, 0, 1, 0, 0, 1]]),
+        'rent_adjustments': MulandData(['V_IDX', 'I_IDX', 'RENTADJ'],
+                                       [[1, 2, 0.25]]),
+        'supply': MulandData(['V_IDX', 'I_IDX', 'NREST'],
+                             [[1, 1, 10.0], [2, 1, 5.0], [1, 2, 1.0]]),
+    }
+
+def test_small_model():
+    output_data = engine.solve(_small_model())
+    e = np.exp
+
+    # b_hvi = INCOME_h * ACCESS_i + 0.5 * SIZE_vi, plus adjustments and subsidies
+    assert output_data['bids'][:, :].tolist() == [[1, 1, 3.0, 5.0],
+                                                 [2, 1, 3.0, 4.5],
+                                                 [1, 2, 7.0, 12.0]]
+    assert output_data['bh'][:, :].tolist() == [[1, 0.0], [2, 0.0]]
+
+    # P_hvi = H_h phi_hvi exp(b_hvi) / sum over agents
+    expected = [[e(3) / (e(3) + 2 * e(5)), 2 * e(5) / (e(3) + 2 * e(5))],
+                [1.0, 0.0],
+                [e(7) / (e(7) + 2 * e(12)), 2 * e(12) / (e(7) + 2 * e(12))]]
+    probability = output_data['location_probability']
+    assert probability[:, :2].tolist() == [[1, 1], [2, 1], [1, 2]]
+    assert probability[:, 2:] == pytest.approx(np.array(expected))
+
+    # H_hvi = S_vi P_hvi
+    supply = np.array([10.0, 5.0, 1.0])[:, None]
+    assert output_data['location'][:, 2:] == pytest.approx(supply * np.array(expected))
+
+    # r_vi = ln(sum of H_h phi_hvi exp(b_hvi)) / mu + 2 * SIZE + adjustments
+    rents = [np.log(e(3) + 2 * e(5)) + 4, 3 + 2, np.log(e(7) + 2 * e(12)) + 4 + 0.25]
+    assert output_data['rents'][:, :2].tolist() == [[1, 1], [2, 1], [1, 2]]
+    assert output_data['rents'].column(2) == pytest.approx(rents)
+
+def test_zone_values_follow_i_idx():
+    '''Zone values are found by I_IDX, not by position of real estates'''
+    input_data = _small_model()
+    records = input_data['real_estates_zones'].records
+    input_data['real_estates_zones'] = MulandData(
+        input_data['real_estates_zones'].header, records[::-1])
+
+    reversed_bids = engine.solve(input_data, ['bids'])['bids'][:, :]
+    bids = engine.solve(_small_model(), ['bids'])['bids'][:, :]
+    assert reversed_bids.tolist() == bids[::-1].tolist()
+
+def test_location_probabilities_sum_to_one(demo_city):
+    output_data = engine.solve(demo_city, ['location_probability'])
+    totals = output_data['location_probability'][:, 2:].sum(axis=1)
+    assert len(totals) > 0
+    assert totals == pytest.approx(np.ones(len(totals)))
+
+def test_output_subsets_give_the_same_values(demo_city):
+    output_data = engine.solve(demo_city)
+    assert list(output_data) == Muland.output_files
+
+    for outputs in [['rents'], ['location_probability'], ['bids', 'location']]:
+        subset = engine.solve(demo_city, outputs)
+        assert list(subset) == outputs
+        for name in outputs:
+            assert np.array_equal(subset[name][:, :], output_data[name][:, :])
+
+def test_real_estates_are_solved_independently(demo_city):
+    '''Results of a zone don't depend on the other zones of the run'''
+    output_data = engine.solve(demo_city, ['rents', 'location_probability'])
+
+    zones = [3, 7, 8]
+    selected = partition.select(demo_city, {i_idx: new_i_idx for new_i_idx, i_idx
+                                             in enumerate(zones, 1)})
+    subset = engine.solve(selected, ['rents', 'location_probability'])
+    for name in ['rents', 'location_probability']:
+        rows = {(v_idx, zones[int(i_idx) - 1]): values
+                for v_idx, i_idx, *values in subset[name]}
+        expected = {(v_idx, int(i_idx)): values
+                    for v_idx, i_idx, *values in output_data[name]
+                    if int(i_idx) in zones}
+        assert rows.keys() == expected.keys()
+        for key, values in expected.items():
+            assert rows[key] == pytest.approx(values)
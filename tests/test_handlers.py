@@ -0,0 +1,47 @@
+# coding: utf-8
+'''Tests of request validation at the bottle application'''
+
+from io import BytesIO
+from wsgiref.util import setup_testing_defaults
+import json
+
+import bottle
+import pytest
+
+from mulandweb import app
+
+def _post(path, body, content_type='application/json'):
+    '''POST body to path, returning (status code, body) of the response'''
+    environ = {}
+    setup_testing_defaults(environ)
+    environ.update({'REQUEST_METHOD': 'POST', 'PATH_INFO': path,
+                    'CONTENT_TYPE': content_type,
+                    'CONTENT_LENGTH': str(len(body)),
+                    'wsgi.input': BytesIO(body)})
+    status = []
+    chunks = app(environ, lambda code, headers, exc_info=None: status.append(code))
+    return int(status[0].split()[0]), b''.join(chunks).decode('utf-8')
+
+_location = {'lnglat': [0, 0], 'units': [{'type': 1}]}
+
+@pytest.mark.parametrize('data, error', [
+    ({}, "'scenarios' is not present at input data."),
+    ({'scenarios': {}}, "'scenarios' isn't an array"),
+    ({'scenarios': [{'name': 'a'}]}, "'loc' not in 'scenarios' items"),
+    ({'scenarios': [{'name': 1, 'loc': []}]}, "'name' isn't a string"),
+    ({'scenarios': [{'name': 'a', 'loc': [_location]},
+                    {'name': 'a', 'loc': [_location]}]},
+     "repeated scenario name 'a'"),
+    ({'scenarios': [{'loc': [{'lnglat': [0], 'units': []}]}]},
+     "'lnglat' isn't array with 2 elements"),
+])
+def test_invalid_batches_are_refused(data, error):
+    status, body = _post('/demo/batch', json.dumps(data).encode('utf-8'))
+    assert status == 400
+    assert bottle.html_escape(error) in body
+
+def test_batches_are_json_only():
+    status, body = _post('/demo/batch', b'<data/>',
+                         'application/xml; charset=utf-8')
+    assert status == 400
+    assert 'Invalid Content-Type' in body
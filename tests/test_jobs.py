@@ -0,0 +1,63 @@
+# coding: utf-8
+'''Tests of background execution of MulandWeb requests'''
+
+from threading import Event
+import os, time
+
+from mulandweb.jobs import JobManager
+
+def _wait_done(manager, job_id, timeout=5):
+    '''Wait until job isn't queued or running, returning its status'''
+    deadline = time.monotonic() + timeout
+    while True:
+        status = manager.status(job_id)
+        if status['status'] not in ['queued', 'running']:
+            return status
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.001)
+
+def test_jobs_report_status_and_result(tmp_path):
+    manager = JobManager(str(tmp_path), workers=1, ttl=60)
+    started, finish = Event(), Event()
+
+    def job(body):
+        started.set()
+        finish.wait(5)
+        return body
+
+    job_id = manager.submit(job, b'result', info={'format': 'json'})
+    assert started.wait(5)
+    status = manager.status(job_id)
+    assert status['status'] == 'running'
+    assert status['format'] == 'json'
+    assert manager.result(job_id) is None
+
+    finish.set()
+    assert _wait_done(manager, job_id)['status'] == 'done'
+    assert manager.result(job_id) == b'result'
+
+def test_failed_jobs_report_their_error(tmp_path):
+    manager = JobManager(str(tmp_path), workers=1, ttl=60)
+
+    def job():
+        raise ValueError('no zones')
+
+    job_id = manager.submit(job)
+    status = _wait_done(manager, job_id)
+    assert status['status'] == 'failed'
+    assert status['error'] == 'no zones'
+    assert manager.result(job_id) is None
+
+def test_unknown_and_expired_jobs(tmp_path):
+    manager = JobManager(str(tmp_path), workers=1, ttl=60)
+    assert manager.status('0' * 32) is None
+    assert manager.status('../jobs') is None
+    assert manager.result('../jobs') is None
+
+    job_id = manager.submit(lambda: b'result')
+    _wait_done(manager, job_id)
+    # Jobs expire ttl seconds after their last update
+    expired = JobManager(str(tmp_path), workers=1, ttl=-1)
+    assert expired.status(job_id) is None
+    expired.cleanup()
+    assert not os.listdir(str(tmp_path))
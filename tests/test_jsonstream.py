@@ -0,0 +1,35 @@
+# coding: utf-8
+'''Tests of streaming JSON serialization of Muland output data'''
+
+import json
+
+import numpy as np
+
+from mulandweb.output import OutputTable
+from mulandweb import jsonstream
+
+def _output_data():
+    '''Output data with list and array-backed records'''
+    return {'bh': [(1, 0.5), (2, -0.25)],
+            'rents': OutputTable(np.arange(30, dtype=float).reshape(10, 3)),
+            'location': OutputTable(np.empty((0, 2))),
+            'bids': []}
+
+def _as_lists(data):
+    '''Convert records of output data to lists, as json.dumps needs'''
+    return {name: [list(record) for record in records]
+            for name, records in data.items()}
+
+def test_chunks_equal_json_dumps():
+    data = _output_data()
+    expected = json.dumps(_as_lists(data)).encode('utf-8')
+    for chunk_size, rows in [(1, 1), (16, 3), (64 * 1024, 1000)]:
+        chunks = list(jsonstream.iterdumps(data, chunk_size, rows))
+        assert b''.join(chunks) == expected
+        if chunk_size < len(expected):
+            assert len(chunks) > 1
+
+def test_dicts_of_output_data():
+    data = {'a': _output_data(), 'b': {'bh': [(1, 1.0)]}}
+    expected = {'a': _as_lists(_output_data()), 'b': {'bh': [[1, 1.0]]}}
+    assert json.loads(b''.join(jsonstream.iterdumps(data, rows=4))) == expected
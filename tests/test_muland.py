@@ -0,0 +1,123 @@
+# coding: utf-8
+'''Tests of Muland runs'''
+
+import asyncio
+import csv, io
+
+import bottle
+import numpy as np
+import pytest
+
+from mulandweb.muland import Muland, MulandData, MulandRunError
+from mulandweb import protocol
+
+def _binary(tmp_path, script):
+    '''Write script as a Mu-Land binary, returning its path'''
+    path = tmp_path / 'muland'
+    path.write_text('#!/bin/sh\n' + script)
+    path.chmod(0o755)
+    return str(path)
+
+def _run(mu, run_async, timeout=None):
+    '''Run mu with run or run_async'''
+    if run_async:
+        asyncio.run(mu.run_async(timeout))
+    else:
+        mu.run(timeout)
+
+@pytest.mark.parametrize('run_async', [False, True])
+def test_failed_runs_raise(demo_city, tmp_path, caplog, run_async):
+    mu = Muland(engine='binary', **demo_city)
+    mu.muland_binary = _binary(tmp_path, 'echo "Singular matrix"\n')
+    with pytest.raises(MulandRunError, match='without success message'):
+        _run(mu, run_async)
+    assert 'Singular matrix' in caplog.text
+
+@pytest.mark.parametrize('run_async', [False, True])
+def test_runs_time_out(demo_city, tmp_path, run_async):
+    mu = Muland(engine='binary', **demo_city)
+    mu.muland_binary = _binary(tmp_path, 'exec sleep 10\n')
+    with pytest.raises(MulandRunError, match='timeout'):
+        _run(mu, run_async, timeout=0.2)
+
+def test_outputs_are_parsed_in_output_file_order():
+    assert protocol.parse_outputs(None) is None
+    assert protocol.parse_outputs('rents, bids') == ['bids', 'rents']
+    with pytest.raises(bottle.HTTPError):
+        protocol.parse_outputs('rents,prices')
+
+def test_only_selected_outputs_are_produced(demo_city, tmp_path):
+    mu = Muland(engine='numpy', outputs=['rents', 'bh'], **demo_city)
+    mu.run()
+    assert list(mu.output_data) == ['bh', 'rents']
+
+    # Mu-Land is told the outputs to write at input/outputs.txt
+    mu = Muland(engine='binary', outputs=['rents'], **demo_city)
+    mu.muland_binary = _binary(tmp_path, """\
+[ "$(cat "$1/input/outputs.txt")" = rents ] || exit 1
+printf '"V_IDX";"I_IDX";"RENT"\\n1;1;2.5\\n' > "$1/output/rents.csv"
+echo "Algorithm ended sucessfully"
+""")
+    mu.run()
+    assert list(mu.output_data) == ['rents']
+    assert mu.rents[:, :].tolist() == [[1, 1, 2.5]]
+
+def _copy_binary(tmp_path, extension):
+    '''Mu-Land binary keeping a copy of its input at tmp_path/input
+
+    Supply is given back as rents.
+    '''
+    return _binary(tmp_path, """\
+cp -r "$1/input" "%s"
+cp "$1/input/supply.%s" "$1/output/rents.%s"
+echo "Algorithm ended sucessfully"
+""" % (tmp_path / 'input', extension, extension))
+
+def test_csv_files_match_csv_writer(demo_city, tmp_path):
+    zones = MulandData(['I_IDX', 'NAME', 'ACC'],
+                       [[1, 'a;b', 2.5], [2, None], [3, 1e-20, -0.0]] * 3000)
+    supply = demo_city['supply']
+    # Records may be given as an array
+    array_supply = MulandData(supply.header, np.array(supply.records))
+    mu = Muland(engine='binary', outputs=['rents'],
+                **dict(demo_city, zones=zones, supply=array_supply))
+    mu.muland_binary = _copy_binary(tmp_path, 'csv')
+    mu.run()
+
+    for name, data in [('zones', zones), ('supply', supply)]:
+        expected = io.StringIO()
+        writer = csv.writer(expected, delimiter=';',
+                            quoting=csv.QUOTE_NONNUMERIC)
+        writer.writerow(data.header)
+        writer.writerows(data.records)
+        with open(str(tmp_path / 'input' / (name + '.csv')), newline='') as file:
+            assert file.read() == expected.getvalue()
+    assert mu.rents[:, :].tolist() == supply.records
+
+def test_malformed_csv_outputs_raise(demo_city, tmp_path):
+    mu = Muland(engine='binary', outputs=['rents'], **demo_city)
+    mu.muland_binary = _binary(tmp_path, """\
+printf '"V_IDX";"I_IDX";"RENT"\\n1;1;2.5\\n2;1\\n' > "$1/output/rents.csv"
+echo "Algorithm ended sucessfully"
+""")
+    mu.run()
+    with pytest.raises(MulandRunError, match='Malformed'):
+        mu.rents[:, :]
+
+def test_binary_datafiles(demo_city, tmp_path):
+    mu = Muland(engine='binary', outputs=['rents'], static_key=('demo', 1),
+                **demo_city)
+    mu.datafile_format = 'bin'
+    mu.muland_binary = _copy_binary(tmp_path, 'bin')
+    mu.run()
+
+    # Row and column counts as uint64, then records as float64
+    supply = np.array(demo_city['supply'].records)
+    with open(str(tmp_path / 'input' / 'supply.bin'), 'rb') as file:
+        assert np.frombuffer(file.read(16), '<u8').tolist() == list(supply.shape)
+        assert np.frombuffer(file.read(), '<f8').tolist() == supply.ravel().tolist()
+    # Static files are linked in with the rest
+    files = sorted(path.name for path in (tmp_path / 'input').iterdir())
+    assert files == sorted([name + '.bin' for name in Muland.input_files] +
+                           ['outputs.txt'])
+    assert mu.rents[:, :].tolist() == supply.tolist()
@@ -0,0 +1,178 @@
+# coding: utf-8
+'''Tests of MulandDB data handling that doesn't need a database'''
+# pylint: disable=protected-access
+
+from contextlib import contextmanager
+from threading import Barrier
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from mulandweb.mulanddb import LocationColumns, ModelCache, MulandDB
+from mulandweb import db, mulanddb
+
+_locations = [
+    {'lnglat': [1.5, -2], 'access': 3,
+     'units': [{'type': 1}, {'type': 2, 'lotsize': 7}]},
+    {'lnglat': [0, 4], 'units': []},
+    {'lnglat': [5, 5], 'units': [{'type': 1, 'access': 9}]},
+]
+
+_columns = {
+    'lng': [1.5, 0, 5], 'lat': [-2, 4, 5],
+    'location': [0, 0, 2], 'type': [1, 2, 1],
+    'location_overrides': {'access': [3, None, None]},
+    'unit_overrides': {'lotsize': [None, 7, None], 'access': [None, None, 9]},
+}
+
+def test_columns_equal_location_lists():
+    listed = LocationColumns.from_list(_locations)
+    columns = LocationColumns.from_columns(_columns)
+    assert columns.digest() == listed.digest()
+    assert columns.unit_location.tolist() == [0, 0, 2]
+    assert columns.unit_type.tolist() == [1, 2, 1]
+    assert columns.digest() != LocationColumns.from_columns(
+        dict(_columns, type=[1, 2, 2])).digest()
+
+def test_units_override_their_locations():
+    merged = LocationColumns.from_columns(_columns).merged_overrides()
+    assert sorted(merged) == ['ACCESS', 'LOTSIZE']
+    assert merged['ACCESS'].tolist() == [3, 3, 9]
+    assert np.isnan(merged['LOTSIZE'][[0, 2]]).all()
+
+@pytest.mark.parametrize('change, error', [
+    ({'lng': [1, 2]}, "'lng' and 'lat' differ in length"),
+    ({'lat': [1, 'a', 3]}, "'lat' isn't an array of numbers"),
+    ({'type': [1, 2.5, 1]}, "'type' isn't an integer"),
+    ({'location': [0, 3, 0]}, "'location' isn't an index"),
+    ({'location': [0, 0]}, "'location' and 'type' differ in length"),
+    ({'unit_overrides': {'lotsize': [1]}}, "'lotsize' of 'unit_overrides'"),
+    ({'location_overrides': []}, "'location_overrides' isn't an object"),
+])
+def test_invalid_columns(change, error):
+    with pytest.raises(ValueError, match=error):
+        LocationColumns.from_columns(dict(_columns, **change))
+
+class _Connection:
+    '''Pooled connection recording its statements and COPY payloads'''
+    def __init__(self):
+        '''Initialize connection'''
+        self.info = {}
+        self.statements = []
+        self.copied = []
+        self.closed = False
+        self.connection = SimpleNamespace(cursor=lambda: SimpleNamespace(
+            copy_expert=lambda sql, file: self.copied.append((sql, file.read())),
+            close=lambda: None))
+
+    def execute(self, statement):
+        '''Record statement'''
+        self.statements.append(str(statement))
+
+    @contextmanager
+    def begin(self):
+        '''Transactions do nothing'''
+        yield
+
+    def close(self):
+        '''Mark connection as closed'''
+        self.closed = True
+
+def _mudb(conn, cls=MulandDB):
+    '''MulandDB of _columns at conn, locations being at zones 4, none and 6'''
+    mudb = cls.__new__(cls)
+    mudb.conn = conn
+    mudb.model = 'demo'
+    mudb.models_version = 1
+    mudb.columns = LocationColumns.from_columns(_columns)
+    mudb.zones_id = np.array([4, -1, 6])
+    return mudb
+
+def test_units_are_copied_into_one_temporary_table():
+    conn = _Connection()
+    mudb = _mudb(conn)
+    mudb._create_units_table()
+    mudb._create_units_table()
+    assert len(conn.statements) == 2
+    assert conn.statements[0].startswith(
+        'CREATE TEMPORARY TABLE %s ' % db.request_units.name)
+
+    # Rows are (I_IDX, zones_id, types_id) of units
+    mudb._load_units(np.array([0, 2]))
+    assert conn.copied == [
+        ('COPY %s (lid, zones_id, types_id) FROM STDIN' % db.request_units.name,
+         '1\t4\t1\n3\t6\t1\n')]
+
+def test_model_cache_keeps_one_version_per_model():
+    cache = ModelCache()
+    cache.put('demo', 1, 'data', 'a')
+    cache.put('other', 1, 'data', 'b')
+    assert cache.get('demo', 1, 'data') == 'a'
+    assert cache.get('demo', 1, 'zones') is None
+
+    # Imported versions replace cached ones
+    assert cache.get('demo', 2, 'data') is None
+    cache.put('demo', 2, 'data', 'c')
+    assert cache.get('demo', 2, 'data') == 'c'
+    assert cache.get('demo', 1, 'data') is None
+    assert cache.get('other', 1, 'data') == 'b'
+
+    cache.clear()
+    assert cache.get('other', 1, 'data') is None
+
+class _FetchDB(MulandDB):
+    '''MulandDB giving back the table name and rows of each fetch
+
+    The first fetch at each connection waits for the other connection, so
+    fetches that don't run concurrently break the barrier.
+    '''
+    fetch_connections = 2
+    barrier = None
+
+    def _fetched(self, name):
+        '''Record fetch of name at the connection'''
+        if not self.conn.fetched:
+            self.barrier.wait(5)
+        self.conn.fetched.append(name)
+
+    def _get_model_data(self):
+        '''Record fetch of the model data'''
+        self._fetched('model')
+
+def _table_method(name):
+    '''Return _FetchDB method of table name'''
+    def method(self, rows):
+        '''Record fetch of the table, returning its name and rows'''
+        self._fetched(name)
+        return name, rows.tolist()
+    return method
+
+for _name, _method in (list(MulandDB._location_tables.items()) +
+                       list(MulandDB._unit_tables.items())):
+    setattr(_FetchDB, _method, _table_method(_name))
+
+def test_tables_are_fetched_concurrently(monkeypatch):
+    conns = []
+    def connect():
+        conns.append(_Connection())
+        conns[-1].fetched = []
+        return conns[-1]
+    monkeypatch.setattr(db.engine, 'connect', connect)
+    monkeypatch.setattr(mulanddb, 'model_cache', mulanddb.ModelCache())
+
+    mudb = _mudb(connect(), _FetchDB)
+    mudb.barrier = Barrier(2)
+    records = mudb._fetch(np.array([0, 2]), np.array([0, 2]))
+
+    assert len(conns) == 2
+    assert conns[1].closed and not conns[0].closed
+    assert sorted(conns[0].fetched + conns[1].fetched) == sorted(
+        ['model'] + list(records))
+    for name in MulandDB._location_tables:
+        assert records[name] == (name, [0, 2])
+    for name in MulandDB._unit_tables:
+        assert records[name] == (name, [0, 2])
+    # Units are loaded at each connection fetching tables that join them
+    for conn in conns:
+        assert len(conn.copied) == 1
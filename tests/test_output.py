@@ -0,0 +1,53 @@
+# coding: utf-8
+'''Tests of lazy, array-backed Muland output data'''
+
+import gc, os, pickle
+
+import numpy as np
+
+from mulandweb.output import MulandOutput, OutputTable, table_array
+
+def test_tables_give_records_as_tuples():
+    table = OutputTable(np.arange(12, dtype=float).reshape(4, 3))
+    table.block_size = 3
+    assert len(table) == 4
+    assert table[1] == (3.0, 4.0, 5.0)
+    assert table[2:] == [(6.0, 7.0, 8.0), (9.0, 10.0, 11.0)]
+    assert table[:, 0].tolist() == [0, 3, 6, 9]
+    assert table.column(2).tolist() == [2, 5, 8, 11]
+    assert list(table) == [tuple(row) for row in table.array.tolist()]
+
+def test_files_are_parsed_once_and_removed_when_unused(tmp_path):
+    directory = tmp_path / 'output'
+    directory.mkdir()
+    (directory / 'rents.csv').write_text('1;2\n')
+    parsed = []
+
+    def reader(filename):
+        parsed.append(os.path.basename(filename))
+        return np.array([[1.0, 2.0]])
+
+    output_data = MulandOutput.from_directory(
+        str(directory), {'rents': 'rents.csv', 'bids': 'bids.csv'}, reader)
+    assert not parsed
+    assert output_data['rents'][0] == (1.0, 2.0)
+    assert output_data['rents'][:] == [(1.0, 2.0)]
+    assert parsed == ['rents.csv']
+
+    # Pickled tables hold their records
+    table = pickle.loads(pickle.dumps(output_data['rents']))
+    assert table.array.tolist() == [[1.0, 2.0]]
+
+    # The directory is kept while a table may still parse from it
+    del output_data['rents']
+    gc.collect()
+    assert directory.exists()
+    del output_data
+    gc.collect()
+    assert not directory.exists()
+
+def test_table_array():
+    table = OutputTable(np.ones((2, 2)))
+    assert table_array(table) is table.array
+    assert table_array([(1, 2.5), (3, 4)]).tolist() == [[1, 2.5], [3, 4]]
+    assert table_array([]).shape == (0, 0)
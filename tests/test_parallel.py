@@ -0,0 +1,23 @@
+# coding: utf-8
+'''Tests of concurrent Muland runs over a process pool'''
+
+import pytest
+
+from mulandweb.muland import Muland
+from mulandweb.output import table_array
+from mulandweb import parallel, partition
+
+def test_runs_give_the_output_of_each_input(demo_city):
+    inputs = [partition.select(demo_city, {3: 1, 7: 2}),
+              partition.select(demo_city, {8: 1}),
+              partition.select(demo_city, {})]
+    results = parallel.run_many(inputs, outputs=['bh', 'rents'])
+
+    assert len(results) == len(inputs)
+    for input_data, output_data in zip(inputs, results):
+        assert sorted(output_data) == ['bh', 'rents']
+        mu = Muland(outputs=['bh', 'rents'], **input_data)
+        mu.run()
+        for name in ['bh', 'rents']:
+            assert table_array(output_data[name]) == pytest.approx(
+                table_array(mu.output_data[name]))
@@ -0,0 +1,97 @@
+# coding: utf-8
+'''Tests of partitioning and merging of Muland data by zone'''
+
+import numpy as np
+
+from mulandweb.muland import Muland, MulandData
+from mulandweb.output import table_array
+from mulandweb import partition
+
+def _input_data(zone_units):
+    '''Build input data with zone_units[i] real estates at zone i + 1'''
+    return {
+        'agents': MulandData(['IDAGENT', 'IDMARKET'], [(1, 1), (2, 1)]),
+        'zones': MulandData(['I_IDX', 'ACC'],
+                            [(i_idx, 10.0 * i_idx)
+                             for i_idx in range(1, len(zone_units) + 1)]),
+        'real_estates_zones': MulandData(
+            ['V_IDX', 'I_IDX', 'M_IDX'],
+            [(v_idx, i_idx, 1) for i_idx, units in enumerate(zone_units, 1)
+             for v_idx in range(1, units + 1)]),
+    }
+
+def _solve(input_data):
+    '''Fake output data, with a record of each real estate given its zone'''
+    zones = dict(input_data['zones'].records)
+    records = [(v_idx, i_idx, zones[i_idx] + v_idx)
+               for v_idx, i_idx, _ in input_data['real_estates_zones'].records]
+    return {'bh': [(1, 0.5), (2, 0.5)], 'rents': records, 'location': records}
+
+def test_merge_split_output_round_trip():
+    inputs = [_input_data([2, 1]), _input_data([1, 3, 2]), _input_data([1])]
+    data, offsets = partition.merge(inputs)
+
+    assert offsets == [0, 2, 5]
+    assert len(data['zones'].records) == 6
+    assert data['agents'] is inputs[0]['agents']
+
+    # Zones of each input get their own values after merging
+    for input_data, offset in zip(inputs, offsets):
+        for i_idx, acc in input_data['zones'].records:
+            assert [i_idx + offset, acc] in data['zones'].records
+
+    results = partition.split_output(_solve(data), offsets)
+    assert len(results) == len(inputs)
+    for input_data, result in zip(inputs, results):
+        expected = _solve(input_data)
+        assert sorted(result) == sorted(expected)
+        for name in expected:
+            assert list(result[name]) == expected[name]
+
+def test_merge_single_input():
+    input_data = _input_data([2, 2])
+    data, offsets = partition.merge([input_data])
+    assert offsets == [0]
+    assert partition.split_output(_solve(data), offsets) == [_solve(input_data)]
+
+def test_shard_unshard_round_trip():
+    input_data = _input_data([2, 1, 3, 1, 1, 2])
+    shards = partition.shard(input_data, 3)
+
+    assert len(shards) > 1
+    assert sorted(i_idx for _, zones in shards for i_idx in zones) == list(range(1, 7))
+    for data, zones in shards:
+        # Zones are kept whole and renumbered from 1
+        i_idxs = [record[0] for record in data['zones'].records]
+        assert i_idxs == list(range(1, len(zones) + 1))
+        real_estates = data['real_estates_zones'].records
+        assert {record[1] for record in real_estates} <= set(i_idxs)
+        assert len(real_estates) <= 3 or len(zones) == 1
+
+    output_data = partition.unshard([_solve(data) for data, _ in shards],
+                                    [zones for _, zones in shards])
+    expected = _solve(input_data)
+    assert output_data['bh'] == expected['bh']
+    for name in ['rents', 'location']:
+        assert sorted(output_data[name]) == sorted(expected[name])
+
+def test_shard_keeps_large_zones_whole():
+    shards = partition.shard(_input_data([5, 1]), 2)
+    assert [zones for _, zones in shards] == [[1], [2]]
+    assert len(shards[0][0]['real_estates_zones'].records) == 5
+
+def test_sharded_run_gives_the_same_output(demo_city):
+    mu = Muland(**demo_city)
+    mu.shard_size = 0
+    mu.run()
+
+    sharded = Muland(**demo_city)
+    sharded.shard_size = len(demo_city['real_estates_zones'].records) // 3
+    assert len(sharded.shards) > 1
+    sharded.run()
+
+    assert sorted(sharded.output_data) == sorted(mu.output_data)
+    for name, table in mu.output_data.items():
+        rows = sorted(map(tuple, table_array(sharded.output_data[name]).tolist()))
+        expected = sorted(map(tuple, table_array(table).tolist()))
+        assert np.allclose(rows, expected)
@@ -0,0 +1,175 @@
+# coding: utf-8
+'''Tests of cost-aware admission of Muland runs'''
+
+from threading import Thread
+import asyncio, time
+
+import pytest
+
+from mulandweb.scheduler import QueueFull, Scheduler
+
+def _wait_for(predicate, timeout=5):
+    '''Wait until predicate is true'''
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.001)
+
+def _queue(scheduler, costs, admitted):
+    '''Start a waiting run for each cost in order, appending its index once admitted
+
+    Each waiting run adds its duration to retry_after, so durations must
+    be over one second.
+    '''
+    threads = []
+    for index, cost in enumerate(costs):
+        waiting = scheduler.retry_after()
+        def run(index=index, cost=cost):
+            scheduler.acquire(cost, shed=False)
+            admitted.append(index)
+            scheduler.release()
+        thread = Thread(target=run, daemon=True)
+        thread.start()
+        threads.append(thread)
+        _wait_for(lambda waiting=waiting: scheduler.retry_after() > waiting)
+    return threads
+
+def test_admits_immediately_while_slots_are_free():
+    scheduler = Scheduler(slots=2, queue_size=0, rate=1)
+    assert scheduler.acquire(10) == 1
+    assert scheduler.acquire(10) == 1
+    with pytest.raises(QueueFull):
+        scheduler.acquire(10)
+    scheduler.release()
+    scheduler.release()
+    assert scheduler.acquire(10, slots=2) == 2
+
+def test_admits_short_runs_first():
+    scheduler = Scheduler(slots=1, queue_size=10, rate=1)
+    scheduler.acquire(1)
+    admitted = []
+    threads = _queue(scheduler, [1000, 10, 100], admitted)
+    scheduler.release()
+    for thread in threads:
+        thread.join(5)
+    assert admitted == [1, 2, 0]
+
+def test_admits_equal_runs_by_arrival():
+    scheduler = Scheduler(slots=1, queue_size=10, rate=1)
+    scheduler.acquire(1)
+    admitted = []
+    threads = _queue(scheduler, [5, 5, 5], admitted)
+    scheduler.release()
+    for thread in threads:
+        thread.join(5)
+    assert admitted == [0, 1, 2]
+
+def test_sheds_runs_once_queue_is_full():
+    scheduler = Scheduler(slots=1, queue_size=1, rate=1)
+    scheduler.acquire(1)
+    admitted = []
+    threads = _queue(scheduler, [10], admitted)
+
+    with pytest.raises(QueueFull) as info:
+        scheduler.acquire(10)
+    assert info.value.retry_after >= 10
+
+    # Runs that may not be shed wait instead
+    threads += _queue(scheduler, [20], admitted)
+    scheduler.release()
+    for thread in threads:
+        thread.join(5)
+    assert len(admitted) == 2
+
+def test_runs_take_a_slot_per_process():
+    scheduler = Scheduler(slots=3, queue_size=1, rate=1)
+    assert scheduler.acquire(10, slots=2) == 2
+    admitted = []
+    thread = Thread(target=lambda: admitted.append(scheduler.acquire(10, slots=2)),
+                    daemon=True)
+    thread.start()
+    _wait_for(lambda: scheduler.retry_after() > 1)
+    assert not admitted
+
+    scheduler.release(2)
+    thread.join(5)
+    assert admitted == [2]
+    # Runs never take more than all slots
+    scheduler.release(2)
+    assert scheduler.acquire(10, slots=5) == 3
+
+def test_async_runs_wait_in_order():
+    scheduler = Scheduler(slots=1, queue_size=2, rate=1)
+    admitted = []
+
+    async def run(index, cost):
+        await scheduler.acquire_async(cost)
+        admitted.append(index)
+        scheduler.release()
+
+    async def main():
+        scheduler.acquire(1)
+        tasks = []
+        for index, cost in enumerate([1000, 10]):
+            tasks.append(asyncio.ensure_future(run(index, cost)))
+            await asyncio.sleep(0)
+
+        # Runs beyond the queue are shed rather than waiting
+        with pytest.raises(QueueFull) as info:
+            await scheduler.acquire_async(10)
+        assert info.value.retry_after >= 1010
+
+        scheduler.release()
+        await asyncio.wait_for(asyncio.gather(*tasks), 5)
+
+    asyncio.run(main())
+    assert admitted == [1, 0]
+
+def test_async_and_thread_runs_share_the_queue():
+    scheduler = Scheduler(slots=1, queue_size=10, rate=1)
+    admitted = []
+
+    async def main():
+        scheduler.acquire(1)
+        threads = _queue(scheduler, [100], admitted)
+
+        async def run():
+            await scheduler.acquire_async(10)
+            admitted.append('async')
+            scheduler.release()
+        task = asyncio.ensure_future(run())
+        await asyncio.sleep(0)
+        assert scheduler.retry_after() == 110
+
+        scheduler.release()
+        await asyncio.wait_for(task, 5)
+        threads[0].join(5)
+
+    asyncio.run(main())
+    assert admitted == ['async', 0]
+
+def test_cancelled_async_runs_leave_the_queue():
+    scheduler = Scheduler(slots=1, queue_size=0, rate=1)
+
+    async def main():
+        scheduler.acquire(1)
+        task = asyncio.ensure_future(scheduler.acquire_async(10, shed=False))
+        await asyncio.sleep(0)
+        assert scheduler.retry_after() == 10
+
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert scheduler.retry_after() == 1
+
+        # Slots of runs cancelled once admitted are released
+        task = asyncio.ensure_future(scheduler.acquire_async(10, shed=False))
+        await asyncio.sleep(0)
+        scheduler.release()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(0)
+        assert await scheduler.acquire_async(10) == 1
+
+    asyncio.run(main())
@@ -0,0 +1,52 @@
+# coding: utf-8
+'''Tests of working directories of Muland runs'''
+
+import os
+
+from mulandweb.workspace import Workspaces
+
+def _write(filename, data):
+    '''Write data to filename'''
+    with open(filename, 'w') as file:
+        file.write(data)
+
+def test_static_dirs_are_written_once(tmp_path):
+    workspaces = Workspaces(str(tmp_path))
+    first = workspaces.static_dir('a', {'agents.csv': '1'}, _write)
+    assert workspaces.static_dir('a', {'agents.csv': '2'}, _write) == first
+    with open(os.path.join(first, 'agents.csv')) as file:
+        assert file.read() == '1'
+
+def test_least_recently_used_static_dirs_are_removed(tmp_path):
+    workspaces = Workspaces(str(tmp_path), static_keep=2)
+    first = workspaces.static_dir('a', {'agents.csv': 'a'}, _write)
+    second = workspaces.static_dir('b', {'agents.csv': 'b'}, _write)
+    os.utime(first, (1, 1))
+    os.utime(second, (2, 2))
+
+    # Using a directory keeps it
+    assert workspaces.static_dir('a', {}, _write) == first
+    third = workspaces.static_dir('c', {'agents.csv': 'c'}, _write)
+    assert os.path.isdir(first) and os.path.isdir(third)
+    assert not os.path.exists(second)
+
+def test_clean_removes_directories_of_previous_runs(tmp_path):
+    workspaces = Workspaces(str(tmp_path))
+    static = workspaces.static_dir('a', {'agents.csv': 'a'}, _write)
+    os.mkdir(os.path.join(str(tmp_path), 'static', '.partial'))
+    running = workspaces.acquire()
+    output = workspaces.keep_output(running)
+    free = workspaces.acquire()
+    workspaces.release(free)
+
+    Workspaces(str(tmp_path)).clean()
+    assert not os.path.exists(running)
+    assert not os.path.exists(output)
+    assert os.listdir(os.path.join(str(tmp_path), 'static')) == [
+        os.path.basename(static)]
+
+    # Free directories of a cleaned workspace aren't reused
+    workspaces.clean()
+    directory = workspaces.acquire()
+    assert directory != free
+    assert sorted(os.listdir(directory)) == ['input', 'output']
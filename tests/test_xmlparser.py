@@ -0,0 +1,86 @@
+# coding: utf-8
+'''Tests of the XML parser for MulandWeb interface'''
+
+from io import BytesIO
+from xml.etree import ElementTree
+from xml.etree.ElementTree import ParseError
+
+import bottle
+import numpy as np
+import pytest
+
+from mulandweb.output import OutputTable
+from mulandweb import protocol, xmlparser
+
+_request = b'''<?xml version="1.0" encoding="utf-8"?>
+<data>
+  <location lng="-70.5" lat="-33.25">
+    <access>2.5</access>
+    <unit type="3"><lotsize>120</lotsize><name>house</name></unit>
+    <unit type="x"/>
+    <unit type="1"/>
+  </location>
+  <location lat="1"><unit type="1"/></location>
+  <location lng="1" lat="2"/>
+</data>
+'''
+
+def test_iterload_yields_locations_as_they_close():
+    file = BytesIO(_request)
+    locations = xmlparser.iterload(file)
+    first = next(locations)
+    assert first == {'lnglat': [-70.5, -33.25], 'access': 2.5,
+                     'units': [{'type': 3, 'lotsize': 120.0}, {'type': 1}]}
+    assert list(locations) == [{'lnglat': [1.0, 2.0], 'units': []}]
+
+    # Large documents are read as locations are consumed
+    location = b'<location lng="1" lat="2"><unit type="1"/></location>'
+    body = b'<data>' + location * 10000 + b'</data>'
+    file = BytesIO(body)
+    next(xmlparser.iterload(file))
+    assert file.tell() < len(body)
+
+def test_iterload_raises_on_invalid_documents():
+    with pytest.raises(ParseError):
+        list(xmlparser.iterload(BytesIO(b'<data><location lng="1" lat="2">')))
+    assert xmlparser.loads('<data><location') is None
+
+def test_read_xml_builds_columns():
+    columns = protocol.read_xml(BytesIO(_request))
+    assert columns.lng.tolist() == [-70.5, 1.0]
+    assert columns.lat.tolist() == [-33.25, 2.0]
+    assert columns.unit_location.tolist() == [0, 0]
+    assert columns.unit_type.tolist() == [3, 1]
+    assert list(columns.location_overrides) == ['ACCESS']
+    assert columns.location_overrides['ACCESS'][0] == 2.5
+    assert columns.unit_overrides['LOTSIZE'][0] == 120
+
+    with pytest.raises(bottle.HTTPError) as info:
+        protocol.read_xml(BytesIO(b'<data>'))
+    assert info.value.status_code == 400
+
+def _tree_dump(datain):
+    '''Build XML of Muland output data with ElementTree'''
+    root = ElementTree.Element('data')
+    for file_key, file_value in datain.items():
+        file_element = ElementTree.SubElement(root, file_key)
+        for record in file_value:
+            record_element = ElementTree.SubElement(file_element, 'record')
+            for recdata in record:
+                ElementTree.SubElement(record_element, 'rd').text = str(recdata)
+    file = BytesIO()
+    ElementTree.ElementTree(root).write(file, encoding='utf-8',
+                                        xml_declaration=True)
+    return file.getvalue()
+
+def test_iterdump_matches_element_tree():
+    datain = {'bh': [(1, 0.5), (2, '<&>')],
+              'rents': OutputTable(np.arange(12, dtype=float).reshape(4, 3)),
+              'bids': [], 'location': [()]}
+    expected = _tree_dump(datain)
+    for chunk_size in [1, 50, 64 * 1024]:
+        chunks = list(xmlparser.iterdump(datain, chunk_size))
+        assert b''.join(chunks) == expected
+        assert len(chunks) > 1 or chunk_size > len(expected)
+    assert xmlparser.dumps(datain) == expected.decode('utf-8')
+    assert b''.join(xmlparser.iterdump({})) == _tree_dump({})
@@ -0,0 +1,46 @@
+# coding: utf-8
+'''Tests of in-process assignment of points to zones'''
+
+import numpy as np
+import shapely
+
+from mulandweb.zoneindex import ZoneIndex, project
+
+def _area(lng_min, lat_min, lng_max, lat_max):
+    '''Return box between WGS 84 coordinates, projected to EPSG:900913'''
+    (x_min, x_max), (y_min, y_max) = project(np.array([lng_min, lng_max]),
+                                             np.array([lat_min, lat_max]))
+    return shapely.box(x_min, y_min, x_max, y_max)
+
+def _index(cache_size=100):
+    '''Index two adjacent zones and a zone apart from them'''
+    areas = [_area(0, 0, 1, 1), _area(1, 0, 2, 1), _area(5, 5, 6, 6)]
+    return ZoneIndex([10, 20, 30], areas, cache_size)
+
+def test_locates_points_inside_zones():
+    index = _index()
+    found = index.locate([0.5, 1.5, 5.5, 3], [0.5, 0.5, 5.5, 3])
+    assert found.tolist() == [0, 1, 2, -1]
+    assert index.zones_id[found[:3]].tolist() == [10, 20, 30]
+
+def test_boundaries_are_not_contained():
+    index = _index()
+    # Shared edge, outer edge, corners of both zones and of one
+    found = index.locate([1, 0, 1, 0, 6], [0.5, 0.5, 1, 0, 6])
+    assert found.tolist() == [-1, -1, -1, -1, -1]
+
+def test_cached_points_give_the_same_zones():
+    index = _index(cache_size=2)
+    lng, lat = [0.5, 1, 1.5], [0.5, 0.5, 0.5]
+    first = index.locate(lng, lat)
+    assert first.tolist() == [0, -1, 1]
+    # Cached, evicted and new points together
+    found = index.locate([1.5, 0.5, 5.5] + lng, [0.5, 0.5, 5.5] + lat)
+    assert found.tolist() == [1, 0, 2, 0, -1, 1]
+    assert index.locate(lng, lat).tolist() == first.tolist()
+    assert index.locate([], []).tolist() == []
+
+def test_without_cache():
+    index = _index(cache_size=0)
+    assert index.locate([1.5, 1], [0.5, 0.5]).tolist() == [1, -1]
+    assert index.locate([1.5, 1], [0.5, 0.5]).tolist() == [1, -1]